@@ -0,0 +1,142 @@
+"""Compare the status reads of a dashboard tracking many uploads.
+
+Fills cv_uploads of the in-memory fakes of tools/fakes.py with uploads in
+every state and reads the statuses of 10 to 100 of them
+
+    single  one GET checkUploadStatus per upload, BROWSER_CONNECTIONS at once
+    batch   one POST checkUploadStatus with all ids (BatchGetItem)
+
+Every HTTP request adds REQUEST_OVERHEAD simulated seconds for API Gateway
+and the network. The fake DynamoDB leaves --unprocessed-rate of the batch
+keys unprocessed, the handler requests them again. kB is the response size
+of the batch with include_data.
+
+Usage: python benchmarks/bench_batch_status.py [--ids 10 25 50 100]
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "layers", "cvision_runtime", "python"))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+import fakes  # noqa: E402
+import local_pipeline  # noqa: E402
+
+REQUEST_OVERHEAD = 0.04
+BROWSER_CONNECTIONS = 6  # Parallel requests of a browser to one host
+REPEATS = 5
+
+
+def fill(table, count):
+    """Write count uploads, ready, in progress, streaming, failed and duplicates."""
+    upload_ids = []
+    for index in range(count):
+        upload_id = f"upload-{index}"
+        item = {"upload_id": upload_id, "status_version": 1}
+        kind = index % 5
+        if kind == 0:
+            item.update(process_status="in_progress")
+        elif kind == 1:
+            item.update(
+                process_status="in_progress",
+                status_version=3,
+                partial_cv_data={"Languages": fakes.sample_resume()["Languages"]},
+                section_status={"Languages": "complete", "Education": "pending"},
+            )
+        elif kind == 2:
+            item.update(process_status="failed", status_version=2)
+        elif kind == 3:
+            item.update(
+                process_status="in_progress", duplicate_of=f"upload-{index - 3}"
+            )
+        else:
+            item.update(
+                process_status="ready_to_retrieve",
+                status_version=2,
+                cv_data=fakes.sample_resume(surname=f"Schmidt {index}"),
+            )
+        table.put_item(Item=item)
+        upload_ids.append(upload_id)
+    return upload_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ids", type=int, nargs="+", default=[10, 25, 50, 100])
+    parser.add_argument("--unprocessed-rate", type=float, default=0.05)
+    parser.add_argument("--latency-scale", type=float, default=0.1)
+    args = parser.parse_args()
+    scale = args.latency_scale
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+    os.environ.setdefault("STATUS_BATCH_RETRY_SECONDS", str(0.05 * scale))
+    cloud = fakes.FakeCloud(latency_scale=scale)
+    cloud.install()
+    handler = local_pipeline.load_handler("checkUploadStatus").lambda_handler
+    upload_ids = fill(cloud.table("cv_uploads"), max(args.ids))
+    cloud.dynamodb.unprocessed_rate = args.unprocessed_rate
+
+    def single(upload_id):
+        time.sleep(REQUEST_OVERHEAD * scale)
+        response = handler(
+            {"httpMethod": "GET", "queryStringParameters": {"upload_id": upload_id}},
+            None,
+        )
+        return json.loads(response["body"])["process_status"]
+
+    def batch(ids, include_data):
+        time.sleep(REQUEST_OVERHEAD * scale)
+        response = handler(
+            {
+                "httpMethod": "POST",
+                "body": json.dumps({"upload_ids": ids, "include_data": include_data}),
+            },
+            None,
+        )
+        body = json.loads(response["body"])
+        return {i: s["process_status"] for i, s in body["statuses"].items()}, len(
+            response["body"]
+        )
+
+    print(f"Simulated ms per status read of all tracked uploads, p50 of {REPEATS}")
+    print(f"{'ids':>4} {'single':>8} {'batch':>8} {'batch+data':>11} {'kB':>6}")
+    for count in args.ids:
+        ids = upload_ids[:count]
+        timings = {"single": [], "batch": [], "data": []}
+        with contextlib.redirect_stdout(io.StringIO()):
+            with concurrent.futures.ThreadPoolExecutor(BROWSER_CONNECTIONS) as pool:
+                for _ in range(REPEATS):
+                    started = time.perf_counter()
+                    expected = dict(zip(ids, pool.map(single, ids)))
+                    timings["single"].append(time.perf_counter() - started)
+                    for mode, include_data in (("batch", False), ("data", True)):
+                        started = time.perf_counter()
+                        statuses, size = batch(ids, include_data)
+                        timings[mode].append(time.perf_counter() - started)
+                        # Unread ids are asked for again like the client does
+                        missing = [i for i in ids if i not in statuses]
+                        while missing:
+                            statuses.update(batch(missing, include_data)[0])
+                            missing = [i for i in ids if i not in statuses]
+                        assert statuses == expected, (statuses, expected)
+        ms = {
+            mode: statistics.median(values) / scale * 1000
+            for mode, values in timings.items()
+        }
+        print(
+            f"{count:>4} {ms['single']:>8.0f} {ms['batch']:>8.0f} "
+            f"{ms['data']:>11.0f} {size / 1000:>6.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
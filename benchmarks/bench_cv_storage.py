@@ -0,0 +1,153 @@
+"""Compare the cv_uploads item size of cv_data as a map and compressed.
+
+Generates resumes of 1 to 16 pages, the entries vary in their wording like
+real CVs do, and reports per resume size
+
+    map     cv_data as a native DynamoDB map, the format so far
+    gzip    cv_data in the binary format of cv_storage
+
+the item size by the DynamoDB size rules, the write units of saving it, the
+read units of one status read (strongly consistent, eventually consistent
+reads cost half), and the time to encode and decode the resume.
+
+Usage: python benchmarks/bench_cv_storage.py [--pages 1 2 4 8 16]
+"""
+
+import argparse
+import decimal
+import math
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "layers", "cvision_runtime", "python"))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+import fakes  # noqa: E402
+from cvision_runtime import cv_storage  # noqa: E402
+
+ENTRIES_PER_PAGE = 3
+WORDS = (
+    "Entwicklung Betreuung Einführung Migration Konzeption Optimierung Analyse "
+    "Verantwortung Abstimmung Fachbereichen Kunden Plattform Microservices "
+    "Datenbanken Schnittstellen Prozesse Teams Projekte Anforderungen Qualität "
+    "automatisierter Tests Lieferketten Controlling Vertrieb Reporting Kennzahlen "
+    "Cloud Infrastruktur Sicherheit Dokumentation Schulungen Workshops Budget "
+    "internationalen Standorten Stakeholdern Roadmap Architektur Wartung Betrieb"
+).split()
+CITIES = ("Berlin", "Hamburg", "München", "Köln", "Frankfurt am Main", "Leipzig")
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def generate_resume(rng, pages):
+    resume = fakes.sample_resume(surname=f"Schmidt {rng.randrange(10**6)}")
+    entries = pages * ENTRIES_PER_PAGE
+    resume["Working Experience"] = [
+        {
+            "Title": sentence(rng, 3)[:-1],
+            "Location": rng.choice(CITIES),
+            "Description": " ".join(sentence(rng, 12) for _ in range(2)),
+            "Bullet Points": [sentence(rng, 8) for _ in range(rng.randint(3, 6))],
+            "Start Date": f"{rng.randint(1, 12):02}/{2000 + index}",
+            "End Date": f"{rng.randint(1, 12):02}/{2001 + index}",
+            "Company": f"{rng.choice(WORDS)} {rng.choice(('GmbH', 'AG', 'SE'))}",
+            "Website": f"https://www.example-{index}.de",
+            "Additional Information": "",
+        }
+        for index in range(math.ceil(entries * 0.6))
+    ]
+    resume["Education"] = [
+        {**resume["Education"][0], "Description": sentence(rng, 10)}
+        for _ in range(max(1, entries // 6))
+    ]
+    resume["Certificates"] = [
+        {**resume["Certificates"][0], "Title": sentence(rng, 4)[:-1]}
+        for _ in range(max(1, entries // 4))
+    ]
+    resume["Skills and Competencies"]["Skills"] = rng.sample(WORDS, 12)
+    return resume
+
+
+def upload_item(cv_data):
+    return fakes.to_dynamodb(
+        {
+            "upload_id": str(uuid.uuid4()),
+            "process_status": "ready_to_retrieve",
+            "status_version": 3,
+            "upload_mode": "multipart",
+            "content_hash": "0" * 64,
+            "extraction_mode": "direct_text",
+            "stage_timings": {"upload": 812, "extraction": 9120, "db_save": 14},
+            "cv_data": cv_data,
+        }
+    )
+
+
+def item_size(item):
+    # https://docs.aws.amazon.com/amazondynamodb/latest/developerguide/CapacityUnitCalculations.html
+    return sum(len(name.encode()) + value_size(v) for name, v in item.items())
+
+
+def value_size(value):
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, decimal.Decimal):
+        digits = len(value.normalize().as_tuple().digits)
+        return math.ceil(digits / 2) + 1
+    if isinstance(value, dict):
+        return 3 + sum(len(k.encode()) + value_size(v) + 1 for k, v in value.items())
+    if isinstance(value, list):
+        return 3 + sum(value_size(v) + 1 for v in value)
+    raise TypeError(type(value))
+
+
+def timed(function, value, repeats=50):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        result = function(value)
+    return result, (time.perf_counter() - started) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--cvs", type=int, default=20, help="Resumes per page count")
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    print(
+        f"{'pages':>5} {'format':>7} {'item kB':>8} {'WCU':>5} {'RCU':>5} "
+        f"{'encode ms':>10} {'decode ms':>10}"
+    )
+    for pages in args.pages:
+        resumes = [generate_resume(rng, pages) for _ in range(args.cvs)]
+        rows = {"map": [], "gzip": []}
+        for resume in resumes:
+            rows["map"].append((item_size(upload_item(resume)), 0.0, 0.0))
+            encoded, encode_ms = timed(cv_storage.encode, resume)
+            decoded, decode_ms = timed(cv_storage.decode, encoded)
+            assert decoded == resume
+            rows["gzip"].append((item_size(upload_item(encoded)), encode_ms, decode_ms))
+        for storage, values in rows.items():
+            size = statistics.median(v[0] for v in values)
+            print(
+                f"{pages:>5} {storage:>7} {size / 1000:>8.1f} "
+                f"{math.ceil(size / 1024):>5} {math.ceil(size / 4096):>5} "
+                f"{statistics.median(v[1] for v in values):>10.2f} "
+                f"{statistics.median(v[2] for v in values):>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Load test of checkUploadStatus: fixed interval polling against long polling.
+
+Uploads generated CVs through the local pipeline of tools/local_pipeline.py
+against the in-memory fakes. Every upload gets a client from the moment its
+item exists until it reads a final status, like the frontend after the upload
+response:
+
+    poll   a plain status check every 5 seconds
+    long   one plain check, then requests with wait_seconds and the version
+           of the last response
+
+Reports the checkUploadStatus invocations per upload, the lag between the
+save of the final status and the client reading it, and the seconds the
+invocations ran, which long polling trades for fewer invocations.
+
+Usage: python benchmarks/bench_long_poll.py [--files 20] [--runs 2] [--stream]
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "layers", "cvision_runtime", "python"))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+import fakes  # noqa: E402
+import local_pipeline  # noqa: E402
+
+POLL_INTERVAL = 5.0  # Simulated seconds, STATUS_POLL_INTERVAL_MS of the frontend
+WAIT_SECONDS = 20.0
+
+
+class StatusClient:
+    """Follow the status of every new upload in one mode, counting the requests."""
+
+    def __init__(self, handler, mode, scale):
+        self.handler = handler
+        self.mode = mode
+        self.scale = scale
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=64)
+        self.clients = []
+        self.saved = {}  # upload_id -> time the final status was saved
+        self.lock = threading.Lock()
+
+    def on_change(self, event_name, table_name, old, new):
+        if table_name != "cv_uploads" or not new:
+            return
+        if event_name == "INSERT":
+            self.clients.append(self.executor.submit(self.follow, new["upload_id"]))
+        elif new["process_status"] in local_pipeline.FINAL_STATUSES:
+            with self.lock:
+                self.saved.setdefault(new["upload_id"], time.perf_counter())
+
+    def check(self, params, stats):
+        started = time.perf_counter()
+        response = self.handler.lambda_handler({"queryStringParameters": params}, None)
+        stats["requests"] += 1
+        stats["busy"] += time.perf_counter() - started
+        return json.loads(response["body"])
+
+    def follow(self, upload_id):
+        stats = {"upload_id": upload_id, "requests": 0, "busy": 0.0}
+        params = {"upload_id": upload_id}
+        while True:
+            if self.mode == "poll":
+                time.sleep(POLL_INTERVAL * self.scale)
+            body = self.check(params, stats)
+            if body["process_status"] in local_pipeline.FINAL_STATUSES:
+                stats["seen"] = time.perf_counter()
+                return stats
+            if self.mode == "long":
+                params = {
+                    "upload_id": upload_id,
+                    "wait_seconds": str(WAIT_SECONDS * self.scale),
+                    "version": str(body["version"]),
+                }
+
+    def results(self):
+        stats = [client.result() for client in self.clients]
+        for s in stats:
+            s["lag"] = s["seen"] - self.saved[s["upload_id"]]
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=20, help="CVs per upload")
+    parser.add_argument("--runs", type=int, default=2, help="Uploads per mode")
+    parser.add_argument("--latency-scale", type=float, default=0.01)
+    parser.add_argument(
+        "--stream", action="store_true", help="Stream the extraction sections"
+    )
+    args = parser.parse_args()
+    scale = args.latency_scale
+
+    os.environ["EXTRACTION_STREAMING"] = str(args.stream).lower()
+    # The slowest path, extraction and correction run of the assistants
+    os.environ["EXTRACTION_MODE"] = "assistant"
+    os.environ["CORRECTION_SKIP_THRESHOLD"] = "1.1"
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+    # The handler settings in simulated seconds
+    for name, seconds in (
+        ("MAX_WAIT_SECONDS", WAIT_SECONDS),
+        ("READ_MIN_SECONDS", 0.25),
+        ("READ_MAX_SECONDS", 2.0),
+    ):
+        os.environ.setdefault(f"LONG_POLL_{name}", str(seconds * scale))
+
+    print(f"checkUploadStatus per upload, {args.files} CVs x {args.runs} uploads")
+    print(
+        f"{'mode':>5} {'requests p50':>13} {'max':>5} {'lag p50 s':>10} "
+        f"{'lag max s':>10} {'busy s':>8}"
+    )
+    for mode in ("poll", "long"):
+        cloud = fakes.FakeCloud(latency_scale=scale)
+        cloud.install()
+        handlers = {
+            name: local_pipeline.load_handler(name) for name in local_pipeline.HANDLERS
+        }
+        client = StatusClient(handlers["checkUploadStatus"], mode, scale)
+        cloud.dynamodb.stream_listeners.append(client.on_change)
+        pipeline = local_pipeline.LocalPipeline(cloud, handlers)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for run in range(args.runs):
+                files = [
+                    (f"cv_{run}_{i}.pdf", local_pipeline.sample_cv_pdf(f"{run}-{i}"))
+                    for i in range(args.files)
+                ]
+                pipeline.run(files, {"cache_bust": "true"})
+            stats = client.results()
+        requests = [s["requests"] for s in stats]
+        lags = [s["lag"] / scale for s in stats]
+        print(
+            f"{mode:>5} {statistics.median(requests):>13.0f} {max(requests):>5} "
+            f"{statistics.median(lags):>10.1f} {max(lags):>10.1f} "
+            f"{sum(s['busy'] for s in stats) / scale / len(stats):>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
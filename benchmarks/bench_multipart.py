@@ -0,0 +1,94 @@
+"""Compare the email.parser based form-data extraction with the formdata parser.
+
+Usage: python benchmarks/bench_multipart.py [--sizes 1 10 30] [--repeat 5]
+"""
+
+import argparse
+import base64
+import os
+import sys
+import time
+import tracemalloc
+from email.parser import Parser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "initialUpload"))
+
+import formdata  # noqa: E402
+
+BOUNDARY = "----WebKitFormBoundary7MA4YWxkTrZu0gW"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def build_body(size_mb):
+    """Build a base64 encoded form-data body with a fake PDF of size_mb MB."""
+    pdf = b"%PDF-1.7\n" + os.urandom(size_mb * 1024 * 1024) + b"\n%%EOF\n"
+    body = (
+        (
+            f"--{BOUNDARY}\r\n"
+            'Content-Disposition: form-data; name="file"; filename="cv.pdf"\r\n'
+            "Content-Type: application/pdf\r\n\r\n"
+        ).encode()
+        + pdf
+        + f"\r\n--{BOUNDARY}--\r\n".encode()
+    )
+    return base64.b64encode(body).decode("ascii"), pdf
+
+
+def legacy_extract(body64, content_type):
+    """The previous extraction path of initialUpload, without the S3 upload."""
+    form_data = base64.b64decode(body64)
+    raw_data = form_data.decode("iso-8859-1")
+    full_message = f"content-type: {content_type}" + "\n\n" + raw_data
+    msg = Parser().parsestr(full_message)
+    for part in msg.walk():
+        content_disposition = part.get("Content-Disposition", None)
+        if content_disposition and "filename" in content_disposition:
+            return part.get_payload(decode=True)
+    return None
+
+
+def formdata_extract(body64, content_type):
+    form_data = base64.b64decode(body64)
+    return formdata.find_file_part(form_data, content_type).data
+
+
+def measure(function, body64, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(body64, CONTENT_TYPE)
+        timings.append(time.perf_counter() - start)
+        del result
+    tracemalloc.start()
+    result = function(body64, CONTENT_TYPE)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), sorted(timings)[len(timings) // 2], peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 30])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'size':>6} {'parser':>10} {'best ms':>10} {'median ms':>10} {'peak MB':>9}"
+    )
+    for size_mb in args.sizes:
+        body64, pdf = build_body(size_mb)
+        for label, function in (
+            ("email", legacy_extract),
+            ("formdata", formdata_extract),
+        ):
+            best, median, peak, result = measure(function, body64, args.repeat)
+            if bytes(result) != pdf:
+                raise SystemExit(f"{label} returned a wrong payload for {size_mb} MB")
+            print(
+                f"{size_mb:>4}MB {label:>10} {best * 1000:>10.1f} "
+                f"{median * 1000:>10.1f} {peak / 2**20:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Compare the extraction latency of long CVs with and without page groups.
+
+Uploads generated CVs of 8 to 20 pages through initialUpload against the
+in-memory fakes of tools/fakes.py in three modes:
+
+    assistant  vector store and assistant runs, the path of long CVs so far
+    single     one completion over the whole CV text
+    groups     page groups extracted concurrently (PAGE_PARALLEL_MIN_PAGES)
+
+The fake model reads the entries from the CV text and answers with a resume
+whose length grows with the CV, the simulated generation time per answer
+token is in LATENCIES. Every page break cuts an entry in two, the report
+checks that the merged resumes list every entry exactly once. The
+completions have DIRECT_TEXT_DEADLINE_SECONDS simulated seconds like in the
+upload request, direct is the number of CVs which made it, the others fell
+back to the assistants.
+
+Usage: python benchmarks/bench_page_parallel.py [--pages 8 12 16 20] [--cvs 3]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import statistics
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "layers", "cvision_runtime", "python"))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+import fitz  # noqa: E402
+import fakes  # noqa: E402
+import local_pipeline  # noqa: E402
+from cvision_runtime import cv_storage  # noqa: E402
+
+# Simulated seconds, about 65 answer tokens per second
+LATENCIES = {
+    "openai.completion": 2.0,
+    "openai.run.extraction": 15.0,
+    "openai.run.correction": 12.0,
+    "openai.answer_token": 0.015,
+}
+ENTRIES_PER_PAGE = 4
+ENTRY_KINDS = (
+    ("Station", "Working Experience"),
+    ("Ausbildung", "Education"),
+    ("Zertifikat", "Certificates"),
+)
+ENTRY_PATTERN = re.compile(r"^(Station|Ausbildung|Zertifikat): (.*)$", re.MULTILINE)
+DESCRIPTION = (
+    "Verantwortung für die Weiterentwicklung der Plattform, Abstimmung mit "
+    "Fachbereichen, Einführung automatisierter Tests und Betreuung von "
+    "Werkstudierenden sowie Vorträge auf internen Konferenzen"
+)
+
+
+def cv_pages(index, pages):
+    """Return the page texts of a generated CV, every page break cuts an entry."""
+    texts = []
+    entry = 0
+    for page in range(pages):
+        lines = []
+        if page == 0:
+            lines += [
+                "Lebenslauf",
+                "Vorname: Anna",
+                f"Nachname: Schmidt {index}",
+                f"E-Mail: anna.schmidt{index}@example.com",
+                "",
+            ]
+        else:
+            # The rest of the entry the previous page ended with
+            lines += [f"{cv_entry(entry - 1)} | Fortsetzung: {DESCRIPTION}", ""]
+        for _ in range(ENTRIES_PER_PAGE):
+            lines += [cv_entry(entry), DESCRIPTION[:70], ""]
+            entry += 1
+        texts.append("\n".join(lines))
+    return texts, entry
+
+
+def cv_entry(number):
+    label, _ = ENTRY_KINDS[number % len(ENTRY_KINDS)]
+    return (
+        f"{label}: Eintrag {number} | Beispiel {number} GmbH | "
+        f"01/{2000 + number % 20} | 12/{2001 + number % 20}"
+    )
+
+
+def cv_pdf(index, pages):
+    doc = fitz.open()
+    for text in cv_pages(index, pages)[0]:
+        page = doc.new_page()
+        page.insert_textbox(page.rect + (40, 40, -40, -40), text, fontsize=9)
+    return doc.tobytes()
+
+
+def read_resume(text):
+    """The fake model: the resume of the entries and names found in text."""
+    resume = fakes.sample_resume()
+    resume["Personal Information"]["Surname"] = ""
+    names = re.search(r"Nachname: (.*)", text)
+    if names:
+        resume["Personal Information"]["Surname"] = names.group(1).strip()
+    sections = {section: {} for _, section in ENTRY_KINDS}
+    for label, value in ENTRY_PATTERN.findall(text):
+        title, company, start, end, *rest = [v.strip() for v in value.split("|")]
+        section = dict(ENTRY_KINDS)[label]
+        entry = {
+            "Diploma" if section == "Education" else "Title": title,
+            "Company" if section == "Working Experience" else "Institution": company,
+            "Start Date": start,
+            "End Date": end,
+            "Description": " ".join(rest),
+        }
+        # Both halves of a cut entry in the same text are read as one entry
+        known = sections[section].get(title)
+        if known is None or len(entry["Description"]) > len(known["Description"]):
+            sections[section][title] = entry
+    for section, entries in sections.items():
+        resume[section] = list(entries.values())
+    return resume
+
+
+def pdf_text(data):
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        return "\n".join(page.get_text() for page in doc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[8, 12, 16, 20])
+    parser.add_argument("--cvs", type=int, default=3, help="CVs per page count")
+    parser.add_argument("--group-pages", type=int, default=3)
+    parser.add_argument("--latency-scale", type=float, default=0.01)
+    args = parser.parse_args()
+
+    os.environ["PAGE_PARALLEL_GROUP_PAGES"] = str(args.group_pages)
+    os.environ["CORRECTION_SKIP_THRESHOLD"] = "0.9"
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+    os.environ.setdefault("DIRECT_TEXT_DEADLINE_SECONDS", str(18 * args.latency_scale))
+    cloud = fakes.FakeCloud(
+        latency_scale=args.latency_scale, latency_overrides=LATENCIES
+    )
+    cloud.openai.completion_responder = lambda messages: read_resume(
+        messages[-1]["content"]
+    )
+
+    def assistant_answer(assistant_id, prompt):
+        file_id = re.search(r"file[-_]\w+", prompt).group(0)
+        resume = read_resume(pdf_text(cloud.openai.file_contents[file_id]))
+        return json.dumps(resume, ensure_ascii=False)
+
+    cloud.openai.responder = assistant_answer
+    cloud.install()
+    handlers = {
+        name: local_pipeline.load_handler(name) for name in local_pipeline.HANDLERS
+    }
+    upload_handler = handlers["initialUpload"]
+    pipeline = local_pipeline.LocalPipeline(cloud, handlers)
+    headers = {"force_reextract": "true", "cache_bust": "true"}
+    modes = {
+        "assistant": dict(EXTRACTION_MODE="assistant", max_pages=4, min_pages=0),
+        "single": dict(EXTRACTION_MODE="auto", max_pages=20, min_pages=0),
+        "groups": dict(EXTRACTION_MODE="auto", max_pages=4, min_pages=8),
+    }
+
+    print(f"Simulated seconds per CV, page groups of {args.group_pages} pages")
+    print(
+        f"{'pages':>5} {'mode':>10} {'p50 s':>8} {'max s':>8} {'entries':>9} "
+        f"{'direct':>7}"
+    )
+    for pages in args.pages:
+        files = [(f"cv_{pages}_{i}.pdf", cv_pdf(i, pages)) for i in range(args.cvs)]
+        expected = cv_pages(0, pages)[1]
+        for mode, settings in modes.items():
+            upload_handler.EXTRACTION_MODE = settings["EXTRACTION_MODE"]
+            upload_handler.text_extraction.DIRECT_TEXT_MAX_PAGES = settings["max_pages"]
+            upload_handler.page_groups.MIN_PAGES = settings["min_pages"]
+            with contextlib.redirect_stdout(io.StringIO()):
+                timings = pipeline.run(files, headers)
+            seconds = [t["end_to_end"] / args.latency_scale for t in timings.values()]
+            complete = direct = 0
+            for upload_id in timings:
+                item = cloud.table("cv_uploads").get_item(Key={"upload_id": upload_id})[
+                    "Item"
+                ]
+                direct += item.get("extraction_mode") in ("direct_text", "page_groups")
+                cv_data = cv_storage.decode(item.get("cv_data", {}))
+                found = sum(len(cv_data.get(s, [])) for _, s in ENTRY_KINDS)
+                surname = cv_data.get("Personal Information", {}).get("Surname", "")
+                complete += found == expected and surname.startswith("Schmidt")
+            print(
+                f"{pages:>5} {mode:>10} {statistics.median(seconds):>8.1f} "
+                f"{max(seconds):>8.1f} {complete:>4}/{len(timings)} {direct:>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,237 @@
+import base64
 import json
-import boto3
+import os
+import time
+from cvision_runtime import clients
+from cvision_runtime import cv_storage
 
+# Long polling: with wait_seconds and the version (or process_status) of the
+# last response, the request is held open until the upload changes or the
+# wait is over, and then answers like a plain status check. The item is
+# re-read with a growing delay, reading only the status and status_version.
+# Without wait_seconds the status is returned right away.
+#
+# Responses carry an ETag of the item and its status_version. A request with
+# a matching If-None-Match gets a 304 without body. The status is read with a
+# projection first, the whole item only when the response needs cv_data or
+# the partial sections and the client doesn't have them yet.
+#
+# POST {"upload_ids": [...], "include_data": false} returns the statuses of up
+# to MAX_BATCH_IDS uploads read with one BatchGetItem request, for clients
+# tracking many uploads: {"statuses": {upload_id: {"process_status",
+# "version", "sections"?, "data"?}}, "unread": [...]?}. data is only included
+# with include_data, unread lists the ids DynamoDB left unprocessed after
+# BATCH_READ_ATTEMPTS requests, the client asks for them again.
+MAX_WAIT_SECONDS = float(os.environ.get("LONG_POLL_MAX_WAIT_SECONDS", 20))
+READ_MIN_SECONDS = float(os.environ.get("LONG_POLL_READ_MIN_SECONDS", 0.25))
+READ_MAX_SECONDS = float(os.environ.get("LONG_POLL_READ_MAX_SECONDS", 2))
+READ_BACKOFF = float(os.environ.get("LONG_POLL_READ_BACKOFF", 1.5))
+# Answer this long before the lambda times out
+STOP_MARGIN_MS = int(os.environ.get("LONG_POLL_STOP_MARGIN_MS", 1000))
+MAX_BATCH_IDS = 100
+BATCH_READ_ATTEMPTS = int(os.environ.get("STATUS_BATCH_READ_ATTEMPTS", 4))
+BATCH_RETRY_SECONDS = float(os.environ.get("STATUS_BATCH_RETRY_SECONDS", 0.05))
+STATUS_PROJECTION = (
+    "upload_id, process_status, status_version, section_status, duplicate_of"
+)
 
+HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Credentials": True,
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,If-None-Match",
+    "Access-Control-Expose-Headers": "ETag",
+    # Browsers revalidate with If-None-Match before using a cached status
+    "Cache-Control": "no-cache",
+}
+
+
+@clients.track_invocation
 def lambda_handler(event, context):
-    query_string_params = event.get("queryStringParameters", {})
+    if request_method(event) == "POST":
+        return batch_status(event)
+    query_string_params = event.get("queryStringParameters") or {}
     upload_id = query_string_params.get("upload_id", "Default Value")
     print(upload_id)
-    database_client = boto3.resource("dynamodb")
-    table = database_client.Table("cv_uploads")
 
     try:
-        response = table.get_item(Key={"upload_id": upload_id})
-    except:
-        raise
+        wait_seconds = min(
+            float(query_string_params.get("wait_seconds") or 0), MAX_WAIT_SECONDS
+        )
+        version = query_string_params.get("version")
+        version = None if version is None else int(version)
+    except ValueError:
+        return generate_response(
+            400, {"error": "Bad Request - wait_seconds and version must be numbers"}
+        )
+    if wait_seconds > 0:
+        if context is not None:
+            remaining = context.get_remaining_time_in_millis() - STOP_MARGIN_MS
+            wait_seconds = min(wait_seconds, remaining / 1000)
+        item = wait_for_change(
+            upload_id,
+            version,
+            query_string_params.get("last_status"),
+            time.monotonic() + wait_seconds,
+        )
+    else:
+        item = read_upload(upload_id, ProjectionExpression=STATUS_PROJECTION)
 
-    status = response.get("Item", {}).get("process_status", "failed")
-    data = response.get("Item", {}).get("cv_data", "No Data Yet")
+    status = item.get("process_status", "failed")
+    if entity_tag(item, upload_id) in if_none_match(event):
+        # The CORS headers too, browsers check them on the 304 of a
+        # cross-origin request before using their cached response
+        return {
+            "statusCode": 304,
+            "body": "",
+            "headers": {**HEADERS, "ETag": entity_tag(item, upload_id)},
+        }
+    if status == "ready_to_retrieve" or (
+        status == "in_progress" and item.get("section_status")
+    ):
+        # After a wait the change just seen must be part of the response
+        item = (
+            clients.table("cv_uploads")
+            .get_item(
+                Key={"upload_id": item["upload_id"]}, ConsistentRead=wait_seconds > 0
+            )
+            .get("Item", item)
+        )
+        status = item.get("process_status", "failed")
+    data = cv_storage.decode(item.get("cv_data", "No Data Yet"))
     if status == "failed":
         data = "Upload Failed"
-    server_response = {"process_status": status, "data": data}
+    server_response = {
+        "process_status": status,
+        "data": data,
+        "version": int(item.get("status_version", 0)),
+    }
+    if status == "in_progress" and item.get("section_status"):
+        # A streamed extraction is running, return the sections it completed so far
+        server_response["data"] = item.get("partial_cv_data", {})
+        server_response["sections"] = item["section_status"]
+    return generate_response(
+        200, server_response, {"ETag": entity_tag(item, upload_id)}
+    )
+
+
+def read_upload(upload_id, **read_options):
+    table = clients.table("cv_uploads")
+    return table.get_item(Key={"upload_id": upload_id}, **read_options).get("Item", {})
+
+
+def wait_for_change(upload_id, version, last_status, deadline):
+    """Re-read the upload until it differs from what the client saw or deadline passes.
+
+    The client saw version, or without it last_status (default in_progress).
+    Returns the last read, with the attributes of STATUS_PROJECTION.
+    """
+    delay = READ_MIN_SECONDS
+    while True:
+        item = read_upload(
+            upload_id, ProjectionExpression=STATUS_PROJECTION, ConsistentRead=True
+        )
+        if version is not None:
+            if int(item.get("status_version", 0)) != version:
+                return item
+        elif item.get("process_status", "failed") != (last_status or "in_progress"):
+            return item
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return item
+        time.sleep(min(delay, remaining))
+        delay = min(delay * READ_BACKOFF, READ_MAX_SECONDS)
+
+
+def batch_status(event):
+    try:
+        body = event.get("body") or "{}"
+        if event.get("isBase64Encoded"):
+            body = base64.b64decode(body)
+        body = json.loads(body)
+    except ValueError:
+        return generate_response(400, {"error": "Bad Request - The body is no JSON"})
+    upload_ids = body.get("upload_ids") if isinstance(body, dict) else None
+    if not isinstance(upload_ids, list) or not 0 < len(upload_ids) <= MAX_BATCH_IDS:
+        return generate_response(
+            400, {"error": f"Bad Request - Send 1 to {MAX_BATCH_IDS} upload_ids"}
+        )
+    upload_ids = list(dict.fromkeys(str(upload_id) for upload_id in upload_ids))
+    include_data = body.get("include_data") is True
+    projection = None if include_data else STATUS_PROJECTION
+
+    items, unread = read_uploads(upload_ids, projection)
+    statuses = {
+        upload_id: compact_status(items.get(upload_id, {}), include_data)
+        for upload_id in upload_ids
+        if upload_id not in unread
+    }
+    server_response = {"statuses": statuses}
+    if unread:
+        server_response["unread"] = unread
+    return generate_response(200, server_response)
+
+
+def read_uploads(upload_ids, projection=None):
+    """Read upload items with BatchGetItem, returns ({upload_id: item}, unread ids).
+
+    Unprocessed keys are requested again with a doubling delay, up to
+    BATCH_READ_ATTEMPTS requests in total. Missing items are left out.
+    """
+    items = {}
+    request = {}
+    if projection:
+        request["ProjectionExpression"] = projection
+    keys = [{"upload_id": upload_id} for upload_id in upload_ids]
+    for attempt in range(BATCH_READ_ATTEMPTS):
+        if not keys:
+            break
+        if attempt:
+            time.sleep(BATCH_RETRY_SECONDS * 2 ** (attempt - 1))
+        result = clients.dynamodb().batch_get_item(
+            RequestItems={"cv_uploads": {**request, "Keys": keys}}
+        )
+        for item in result["Responses"].get("cv_uploads", []):
+            items[item["upload_id"]] = item
+        keys = result.get("UnprocessedKeys", {}).get("cv_uploads", {}).get("Keys", [])
+    return items, [key["upload_id"] for key in keys]
+
+
+def compact_status(item, include_data):
+    status = item.get("process_status", "failed")
+    entry = {"process_status": status, "version": int(item.get("status_version", 0))}
+    if status == "in_progress" and item.get("section_status"):
+        entry["sections"] = item["section_status"]
+        if include_data:
+            entry["data"] = item.get("partial_cv_data", {})
+    elif status == "ready_to_retrieve" and include_data:
+        entry["data"] = cv_storage.decode(item.get("cv_data", {}))
+    return entry
+
+
+def request_method(event):
+    # REST APIs send payload format 1.0, HTTP APIs 2.0
+    return event.get("httpMethod") or (
+        event.get("requestContext", {}).get("http", {}).get("method")
+    )
+
+
+def entity_tag(item, upload_id):
+    return f'"{upload_id}.{int(item.get("status_version", 0))}"'
+
+
+def if_none_match(event):
+    """Return the entity tags of the If-None-Match header, without weak prefixes."""
+    headers = {
+        name.lower(): value for name, value in (event.get("headers") or {}).items()
+    }
+    tags = headers.get("if-none-match") or ""
+    return {tag.strip().removeprefix("W/") for tag in tags.split(",") if tag.strip()}
+
+
+def generate_response(statusCode, body, headers=None):
     return {
-        "statusCode": 200,
-        "body": json.dumps(server_response),
-        "headers": {
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Credentials": True,
-            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-        },
+        "statusCode": statusCode,
+        "body": json.dumps(body),
+        "headers": {**HEADERS, **(headers or {})},
     }
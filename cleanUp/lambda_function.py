@@ -1,16 +1,35 @@
 import json
-import boto3
-from openai import OpenAI
+from cvision_runtime import clients
+from cvision_runtime import uploads
+from cvision_runtime import vector_store_pool
 
 
+@clients.track_invocation
 def lambda_handler(event, context):
+    # Scheduled runs reap leaked leases and clean quarantined stores of the pool
+    if event.get("action") == "sweep_vector_stores":
+        reaped = vector_store_pool.sweep()
+        return {
+            "statusCode": 200,
+            "body": json.dumps(
+                f"Reaped {reaped} expired or quarantined vector store leases"
+            ),
+        }
+
+    # Scheduled runs fail the entries of direct uploads that never arrived
+    if event.get("action") == "expire_direct_uploads":
+        expired = uploads.expire_pending_uploads()
+        return {
+            "statusCode": 200,
+            "body": json.dumps(f"Expired {expired} direct uploads"),
+        }
+
     upload_id = ""
     file_id = ""
     thread_id = ""
     stage = 0  # 0: File not uploaded to OpenAI yet, 1:File uploaded to OpenAI, 2:Database entry initialized, 3:Created Thread on OpenAI API
-    openai_client = OpenAI()
-    database_client = boto3.resource("dynamodb")
-    table = database_client.Table("cv_uploads")
+    openai_client = clients.openai()
+    table = clients.table("cv_uploads")
     item_key = {"upload_id": upload_id}
 
     if stage > 0:
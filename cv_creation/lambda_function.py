@@ -1,6 +1,8 @@
 import json
-import boto3
+from cvision_runtime import clients
+from cvision_runtime import stage_timings
 import os
+import tempfile
 from docx import Document
 from docx.enum.table import WD_ALIGN_VERTICAL
 from docx.shared import Pt, RGBColor, Inches, Emu
@@ -14,14 +16,24 @@ from docx.oxml.ns import qn
 DEBUG_MODE = False
 
 
+@clients.track_invocation
 def lambda_handler(event, context):
     """Lambda function handler for generating a CV document."""
+    # Files of this request live in their own directory which is removed afterwards
+    with stage_timings.stage(
+        None if DEBUG_MODE else event.get("upload_id"), "docx_render"
+    ), tempfile.TemporaryDirectory() as work_dir:
+        return create_cv_document(event, work_dir)
+
+
+def create_cv_document(event, work_dir):
+    """Generate the CV document using work_dir for temporary files."""
     profile_picture_present = False
     resume_data = event["resume_data"]
     s3_bucket = "cvision-completed-resumes"
     s3_key = f'{event["upload_id"]}.docx'
     logo_path = "./Branding/Sirato_Logo_Color.png"
-    image_path = "/tmp/profile.png"
+    image_path = os.path.join(work_dir, "profile.png")
     footer_text = (
         "Alle auf dem Dokument enthaltenen Informationen unterliegen den Allgemeinen Geschäftsbedingungen der "
         "Sirato Recruitment GmbH.\n\n"
@@ -38,8 +50,8 @@ def lambda_handler(event, context):
 
     # Download image and logo if stored in S3
     if not DEBUG_MODE:
-        s3 = boto3.client("s3")
-        with open("/tmp/profile.png", "wb") as file:
+        s3 = clients.s3()
+        with open(image_path, "wb") as file:
             try:
                 s3.download_fileobj(
                     "cv-profile-pictures", f'{event["upload_id"]}.png', file
@@ -56,6 +68,8 @@ def lambda_handler(event, context):
             except Exception as e:
                 # Catching other unexpected exceptions
                 print(f"An unexpected error occurred: {e}")
+        if not profile_picture_present:
+            os.remove(image_path)
 
     # Create the sidebar sections
     sidebar_sections = [
@@ -77,7 +91,7 @@ def lambda_handler(event, context):
     if DEBUG_MODE:
         docx_path = "./tmp/resume.docx"
     else:
-        docx_path = "/tmp/resume.docx"
+        docx_path = os.path.join(work_dir, "resume.docx")
     cv.save_document(docx_path)
 
     if DEBUG_MODE:
@@ -1,56 +1,57 @@
 import fitz
 import cv2
-import boto3
+import io
+import numpy as np
+from cvision_runtime import clients
+from cvision_runtime import stage_timings
+from cvision_runtime import uploads
+from urllib.parse import unquote_plus
 
+UPLOAD_PREFIXES = ("multipart/", "direct/")
 
-def save_profile_picture_to_s3(upload_id):
+
+def save_profile_picture_to_s3(pdf, upload_id):
     print("Extracting profile pictures from CV")
-    image_paths = extract_images_from_pdf("/tmp/temp_cv.pdf")
-    print("Extracted profile pictures from CV: ", image_paths)
-    profile_pictures = [img for img in image_paths if is_profile_picture(img)]
+    images = extract_images_from_pdf(pdf)
+    print(f"Extracted {len(images)} images from CV")
+    profile_pictures = [img for img in images if is_profile_picture(img)]
     if len(profile_pictures) > 0:  # Checking if there is at least one profile picture
-        s3_client = boto3.client("s3")
+        s3_client = clients.s3()
         bucket_name = "cv-profile-pictures"
 
         # Get the first profile picture
         first_profile_picture = profile_pictures[0]
 
         # Upload the first profile picture
-        s3_client.upload_file(first_profile_picture, bucket_name, f"{upload_id}.png")
+        s3_client.upload_fileobj(
+            io.BytesIO(first_profile_picture), bucket_name, f"{upload_id}.png"
+        )
         print(f"Uploaded {upload_id} to S3 bucket {bucket_name}")
 
 
-def extract_images_from_pdf(pdf_path):
-    doc = fitz.open(pdf_path)
+def extract_images_from_pdf(pdf):
+    doc = fitz.open(stream=pdf, filetype="pdf")
     images = []
-    images_filenames = []
     for i in range(len(doc)):  # Loop through each page
         for img_index, img in enumerate(doc.get_page_images(i)):
             xref = img[0]
             base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-            images.append(image_bytes)  # Store the image bytes in list if needed
-
-            # Create a filename and save the image
-            image_filename = f"/tmp/image_page_{i}_index_{img_index}_xref_{xref}.png"
-            with open(image_filename, "wb") as img_file:
-                img_file.write(image_bytes)
-            images_filenames.append(image_filename)
-            print(
-                f"Saved: {image_filename}"
-            )  # Optional: print out filename of saved image
+            images.append(base_image["image"])  # Keep the image bytes in memory
+            print(f"Extracted image {img_index} from page {i} (xref {xref})")
     doc.close()
-    return images_filenames
+    return images
 
 
-def is_profile_picture(image_path):
+def is_profile_picture(image_bytes):
     # Load the Haar Cascade for face detection
     face_cascade = cv2.CascadeClassifier(
         cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
     )
 
-    # Read the image
-    image = cv2.imread(image_path)
+    # Decode the image
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return False
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)  # Convert to grayscale
 
     # Detect faces
@@ -62,19 +63,30 @@ def is_profile_picture(image_path):
     return len(faces) > 0
 
 
-def download_pdf_to_tmp(bucket_name, object_key, local_path):
-    s3_client = boto3.client("s3")
-    with open(local_path, "wb") as file:
-        s3_client.download_fileobj(bucket_name, object_key, file)
+def download_pdf(bucket_name, object_key):
+    s3_client = clients.s3()
+    response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
+    return response["Body"].read()
+
+
+def upload_id_of(bucket_name, object_key):
+    # Uploads are stored below a prefix, the upload id is the last segment.
+    # Backfilled CVs keep their key, their id is derived from it.
+    if object_key.startswith(UPLOAD_PREFIXES):
+        return object_key.rsplit("/", 1)[-1]
+    return uploads.bulk_upload_id(bucket_name, object_key)
 
 
+@clients.track_invocation
 def lambda_handler(event, context):
-    upload_id = event["Records"][0]["s3"]["object"]["key"]
+    record = event["Records"][0]["s3"]
+    object_key = unquote_plus(record["object"]["key"])
+    upload_id = upload_id_of(record["bucket"]["name"], object_key)
     bucket_name = "cv-uploaded-resumes"
-    path = "/tmp/temp_cv.pdf"
-    print("Starting CV Download from S3")
-    download_pdf_to_tmp(bucket_name, upload_id, path)
-    print("Downloaded CV from S3")
-    save_profile_picture_to_s3(upload_id)
+    with stage_timings.stage(upload_id, "profile_extraction"):
+        print("Starting CV Download from S3")
+        pdf = download_pdf(bucket_name, object_key)
+        print("Downloaded CV from S3")
+        save_profile_picture_to_s3(pdf, upload_id)
     print("Done!")
     return {"statusCode": 200, "body": "Profile picture extracted and uploaded to S3"}
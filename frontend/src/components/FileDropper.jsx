@@ -1,6 +1,17 @@
-import React, { useState } from "react";
+import React, { useRef, useState } from "react";
 import TextEditor from "./TextEditor";
 
+// wss:// URL of the status WebSocket API, without it the status is long polled
+const STATUS_SOCKET_URL = process.env.REACT_APP_STATUS_SOCKET_URL;
+const STATUS_POLL_INTERVAL_MS = 5000;
+// checkStatus holds a request with the last seen version open up to this long
+const STATUS_WAIT_SECONDS = 20;
+// Files answered with 429 (over the OpenAI rate limit) are uploaded again after
+// their Retry-After, up to this many times
+const UPLOAD_MAX_RETRIES = 8;
+const UPLOAD_RETRY_SECONDS = 5; // Without a Retry-After
+const UPLOAD_MAX_RETRY_SECONDS = 60; // Retry-After is doubled per attempt up to this
+
 const FileDropper = () => {
   const [code, setCode] = useState("");
   const [setFiles] = useState([]);
@@ -11,8 +22,13 @@ const FileDropper = () => {
   const [isUploading, setIsUploading] = useState(false); // New state to track uploading status
   const [resumeData, setResumeData] = useState(null); // State to hold resume data
   const [uploadId, setUploadId] = useState(null); // State to hold uploadId
+  const [pendingSections, setPendingSections] = useState([]); // Sections still being extracted
+  const [isComplete, setIsComplete] = useState(true); // False while resumeData is partial
   const [language, setLanguage] = useState("en"); // State to hold the selected language
   const [anonymize, setAnonymize] = useState(false); // State to hold the anonymize setting
+  const socketRef = useRef(null); // Status WebSocket shared by all uploads
+  const watchedRef = useRef(new Set()); // Uploads waiting for a pushed status
+  const sectionReadsRef = useRef({}); // Upload id -> time partial sections were read
 
   const preventDefaults = (e) => {
     e.preventDefault();
@@ -45,12 +61,61 @@ const FileDropper = () => {
   const handleFiles = (selectedFiles) => {
     setIsUploading(true); // Start uploading
     setMessage("Your CV is being uploaded...");
-    Array.from(selectedFiles).forEach(uploadFile);
+    const files = Array.from(selectedFiles);
+    if (files.length > 1) {
+      uploadFilesMultipart(files); // One request for the whole batch
+    } else {
+      files.forEach(uploadFile);
+    }
   };
 
   const uploadFile = (file) => {
+    uploadFileDirect(file)
+      .then((uploadId) => {
+        setUploadId(uploadId); // Store the uploadId
+        checkStatus(uploadId);
+      })
+      .catch((error) => {
+        console.log("Direct upload failed, using multipart upload", error);
+        uploadFilesMultipart([file]);
+      });
+  };
+
+  // Uploads the PDF straight to S3 with a presigned POST from the API
+  const uploadFileDirect = async (file) => {
+    const response = await fetch(
+      "https://8bhp1g0nti.execute-api.eu-central-1.amazonaws.com/default/requestUploadUrl",
+      {
+        method: "POST",
+        headers: {
+          "x-api-key": code,
+        },
+      }
+    );
+    if (!response.ok) {
+      throw new Error(`Upload URL request failed: ${response.status}`);
+    }
+    const data = await response.json();
+
+    const formData = new FormData();
+    Object.entries(data.upload.fields).forEach(([key, value]) =>
+      formData.append(key, value)
+    );
+    formData.append("file", file, file.name); // S3 expects the file last
+
+    const s3Response = await fetch(data.upload.url, {
+      method: "POST",
+      body: formData,
+    });
+    if (!s3Response.ok) {
+      throw new Error(`S3 upload failed: ${s3Response.status}`);
+    }
+    return data.uploadId;
+  };
+
+  const uploadFilesMultipart = (files, attempt = 0) => {
     const formData = new FormData();
-    formData.append("file", file, file.name);
+    files.forEach((file) => formData.append("file", file, file.name));
 
     const requestOptions = {
       method: "POST",
@@ -65,10 +130,54 @@ const FileDropper = () => {
       "https://8bhp1g0nti.execute-api.eu-central-1.amazonaws.com/default/uploadCV",
       requestOptions
     )
-      .then((response) => response.json())
-      .then((data) => {
-        setUploadId(data.uploadId); // Store the uploadId
-        checkStatus(data.uploadId);
+      .then((response) =>
+        response.json().then((data) => ({ response, data }))
+      )
+      .then(({ response, data }) => {
+        // Files that failed are reported per file in upload order, the others
+        // are processed. A single file fails with the status of the response
+        const results =
+          response.status === 429
+            ? [
+                {
+                  statusCode: 429,
+                  retryAfter: Number(response.headers.get("Retry-After")),
+                },
+              ]
+            : data.uploads || [];
+        const limited = results
+          .map((result, index) => ({ ...result, file: files[index] }))
+          .filter((result) => result.statusCode === 429);
+        const retrying = limited.length > 0 && attempt < UPLOAD_MAX_RETRIES;
+        if (retrying) {
+          const seconds = Math.min(
+            UPLOAD_MAX_RETRY_SECONDS,
+            Math.max(
+              ...limited.map((result) => result.retryAfter || UPLOAD_RETRY_SECONDS)
+            ) *
+              2 ** attempt
+          );
+          setMessage("The service is busy, your CV is uploaded again shortly...");
+          setTimeout(
+            () =>
+              uploadFilesMultipart(
+                limited.map((result) => result.file),
+                attempt + 1
+              ),
+            seconds * 1000
+          );
+        }
+        const uploadIds = results
+          .filter((upload) => upload.uploadId)
+          .map((upload) => upload.uploadId);
+        if (uploadIds.length === 0) {
+          if (retrying) {
+            return;
+          }
+          throw new Error("No file of the upload was accepted");
+        }
+        setUploadId(uploadIds[0]); // Store the uploadId
+        uploadIds.forEach(checkStatus);
       })
       .catch((error) => {
         console.log("Upload error", error);
@@ -77,39 +186,138 @@ const FileDropper = () => {
       });
   };
 
-  const checkStatus = (uploadId) => {
-    setMessage("Checking CV processing status...");
-    const intervalId = setInterval(() => {
-      const requestOptions = {
-        method: "GET",
-        headers: {
-          "x-api-key": code,
-        },
-      };
-      fetch(
-        `https://8bhp1g0nti.execute-api.eu-central-1.amazonaws.com/default/checkStatus?upload_id=${uploadId}`,
-        requestOptions
-      )
-        .then((response) => response.json())
-        .then((data) => {
-          if (data.process_status === "ready_to_retrieve") {
-            clearInterval(intervalId);
-            setMessage("Generating Download link...");
-            setResumeData(data.data); // Set the initial resume data
-          } else if (data.process_status === "in_progress") {
-            setMessage("Your CV is still being processed...");
-          } else {
-            clearInterval(intervalId);
-            setMessage("Processing failed. Please try again.");
-            setIsUploading(false); // Reset uploading status on failure
+  // Reads the status once, with a version it waits for the next change.
+  // Resolves to { done, version }, done once the upload is done or failed
+  const fetchStatus = (uploadId, version) => {
+    const requestOptions = {
+      method: "GET",
+      headers: {
+        "x-api-key": code,
+      },
+    };
+    const wait =
+      version === undefined
+        ? ""
+        : `&wait_seconds=${STATUS_WAIT_SECONDS}&version=${version}`;
+    return fetch(
+      `https://8bhp1g0nti.execute-api.eu-central-1.amazonaws.com/default/checkStatus?upload_id=${uploadId}${wait}`,
+      requestOptions
+    )
+      .then((response) => response.json())
+      .then((data) => ({ done: showStatus(data), version: data.version }));
+  };
+
+  // Shows a checkStatus response, returns true once the upload is done or failed
+  const showStatus = (data) => {
+    if (data.process_status === "ready_to_retrieve") {
+      setMessage("Generating Download link...");
+      setPendingSections([]);
+      setIsComplete(true);
+      setResumeData(data.data); // Set the initial resume data
+      return true;
+    } else if (data.process_status === "in_progress") {
+      if (data.sections && Object.keys(data.data).length > 0) {
+        // A streamed extraction returns the sections it completed so far
+        setPendingSections(
+          Object.keys(data.sections).filter(
+            (section) => data.sections[section] !== "complete"
+          )
+        );
+        setIsComplete(false);
+        setResumeData(data.data);
+      }
+      setMessage("Your CV is still being processed...");
+      return false;
+    }
+    setMessage("Processing failed. Please try again.");
+    setIsUploading(false); // Reset uploading status on failure
+    return true;
+  };
+
+  // Long polls checkStatus, every request returns with the next status change
+  const pollStatus = (uploadId, version) => {
+    fetchStatus(uploadId, version)
+      .then(({ done, version: seen }) => {
+        if (done) {
+          return;
+        }
+        if (seen === undefined) {
+          // A checkStatus without long polling, ask again after the interval
+          setTimeout(() => pollStatus(uploadId), STATUS_POLL_INTERVAL_MS);
+        } else {
+          pollStatus(uploadId, seen);
+        }
+      })
+      .catch((error) => {
+        setMessage("Status check failed. Please try again.");
+        setIsUploading(false); // Reset uploading status on error
+      });
+  };
+
+  // Opens the status WebSocket or returns the open one, all uploads share it
+  const openStatusSocket = () => {
+    const current = socketRef.current;
+    if (current && current.readyState <= WebSocket.OPEN) {
+      return current;
+    }
+    const socket = new WebSocket(STATUS_SOCKET_URL);
+    socket.onmessage = (event) => {
+      const update = JSON.parse(event.data);
+      if (!watchedRef.current.has(update.upload_id)) {
+        return;
+      }
+      if (update.process_status === "in_progress") {
+        // Partial sections are read at most once per poll interval
+        const lastRead = sectionReadsRef.current[update.upload_id] || 0;
+        if (
+          !update.sections ||
+          Date.now() - lastRead < STATUS_POLL_INTERVAL_MS
+        ) {
+          return;
+        }
+        sectionReadsRef.current[update.upload_id] = Date.now();
+      }
+      fetchStatus(update.upload_id)
+        .then(({ done }) => {
+          if (done) {
+            watchedRef.current.delete(update.upload_id);
           }
         })
         .catch((error) => {
-          clearInterval(intervalId);
-          setMessage("Status check failed. Please try again.");
-          setIsUploading(false); // Reset uploading status on error
+          watchedRef.current.delete(update.upload_id);
+          pollStatus(update.upload_id);
         });
-    }, 5000);
+    };
+    socket.onclose = () => {
+      // The channel dropped, the uploads still waiting fall back to polling
+      if (socketRef.current === socket) {
+        socketRef.current = null;
+      }
+      watchedRef.current.forEach((uploadId) => pollStatus(uploadId));
+      watchedRef.current.clear();
+    };
+    socketRef.current = socket;
+    return socket;
+  };
+
+  // Waits for pushed status changes, polls checkStatus without a status socket
+  const checkStatus = (uploadId) => {
+    setMessage("Checking CV processing status...");
+    if (!STATUS_SOCKET_URL || typeof WebSocket === "undefined") {
+      pollStatus(uploadId);
+      return;
+    }
+    watchedRef.current.add(uploadId);
+    const socket = openStatusSocket();
+    const subscribe = () =>
+      socket.send(
+        JSON.stringify({ action: "subscribe", upload_ids: [uploadId] })
+      );
+    if (socket.readyState === WebSocket.OPEN) {
+      subscribe();
+    } else {
+      socket.addEventListener("open", subscribe);
+    }
   };
 
   const createCV = async (uploadId, editedResumeData) => {
@@ -164,7 +372,12 @@ const FileDropper = () => {
   return (
     <div className="bg-cover bg-center min-h-screen flex flex-col justify-center items-center px-4">
       {resumeData ? (
-        <TextEditor formData={resumeData} onSubmit={handleEditorSubmit} />
+        <TextEditor
+          formData={resumeData}
+          pendingSections={pendingSections}
+          isComplete={isComplete}
+          onSubmit={handleEditorSubmit}
+        />
       ) : (
         <>
           <div className="flex space-x-4 mb-4">
@@ -80,12 +80,20 @@ const emptyTemplates = {
   ],
 };
 
-const TextEditor = ({ formData, onSubmit }) => {
+const TextEditor = ({
+  formData,
+  onSubmit,
+  pendingSections = [],
+  isComplete = true,
+}) => {
   const [data, setData] = useState(formData);
+  const isPartial = !isComplete;
 
   useEffect(() => {
-    setData(formData);
-  }, [formData]);
+    // Sections arriving during the extraction are added to the shown ones,
+    // the final result replaces everything
+    setData((current) => (isPartial ? { ...formData, ...current } : formData));
+  }, [formData, isPartial]);
 
   const handleInputChange = (path, value) => {
     const keys = path.replace(/\[(\d+)\]/g, ".$1").split(".");
@@ -221,11 +229,20 @@ const TextEditor = ({ formData, onSubmit }) => {
 
   return (
     <div className="min-h-screen p-5 bg-[#000300] shadow-md rounded-lg overflow-y-auto">
+      {isPartial && (
+        <p className="mb-4 text-white">
+          {pendingSections.length > 0
+            ? `Still extracting: ${pendingSections.join(", ")}.`
+            : "Finishing the extraction..."}{" "}
+          The sections shown are a preview until the extraction is complete.
+        </p>
+      )}
       <form onSubmit={handleSubmit}>
         {renderFormFields(data)}
         <button
           type="submit"
-          className="mt-4 px-4 py-2 bg-[#00df9a] text-white rounded hover:bg-[#00b87a] hover:scale-105 transition-transform duration-200"
+          disabled={isPartial}
+          className="mt-4 px-4 py-2 bg-[#00df9a] text-white rounded hover:bg-[#00b87a] hover:scale-105 transition-transform duration-200 disabled:opacity-50"
         >
           Submit
         </button>
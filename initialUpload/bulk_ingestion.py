@@ -0,0 +1,414 @@
+import collections
+import concurrent.futures
+import decimal
+import hashlib
+import json
+import math
+import os
+import time
+from cvision_runtime import answers
+from cvision_runtime import clients
+from cvision_runtime import pipeline
+from cvision_runtime import rate_limit
+from cvision_runtime import result_cache
+from cvision_runtime import resume_schema
+from cvision_runtime import stage_timings
+from cvision_runtime import uploads
+from cvision_runtime import vector_store_pool
+import lambda_function
+import preflight
+
+# Bulk ingestion of historical CVs without the state machine. enqueue_handler
+# creates the cv_uploads entries of the PDFs below an S3 prefix and sends one
+# SQS message per CV, worker_handler pulls the messages in batches and
+# processes up to INGEST_PARALLELISM CVs at once in process. Every finished
+# step is checkpointed in the ingest_checkpoint map of the entry, a message
+# delivered again after a crashed worker continues with the next step and
+# polls runs that were already started instead of paying for them twice.
+#
+# Steps: queued -> uploaded (file and vector store) -> extraction (run
+# started) -> correction (run started) -> done
+
+BULK_QUEUE_URL = os.environ.get("BULK_QUEUE_URL", "")
+INGEST_PARALLELISM = int(os.environ.get("INGEST_PARALLELISM", 8))
+# Deliveries of a message before its CV is marked failed
+INGEST_MAX_ATTEMPTS = int(os.environ.get("INGEST_MAX_ATTEMPTS", 3))
+VISIBILITY_TIMEOUT = int(os.environ.get("INGEST_VISIBILITY_TIMEOUT", 300))
+RUN_POLL_SECONDS = float(os.environ.get("INGEST_RUN_POLL_SECONDS", 3))
+# The worker stops taking messages when less time is left in the invocation
+STOP_MARGIN_MS = int(os.environ.get("INGEST_STOP_MARGIN_MS", 180000))
+
+
+@clients.track_invocation
+def enqueue_handler(event, context):
+    """Enqueue the PDFs below event["prefix"] of event["bucket"].
+
+    CVs whose ingestion already started are skipped.
+    """
+    bucket = event["bucket"]
+    enqueued = skipped = 0
+    batch = []
+    for key in list_pdf_keys(bucket, event.get("prefix", "")):
+        upload_id = uploads.bulk_upload_id(bucket, key)
+        if not create_entry(upload_id, bucket, key):
+            skipped += 1
+            continue
+        batch.append(
+            {
+                "Id": str(len(batch)),
+                "MessageBody": json.dumps(
+                    {"upload_id": upload_id, "bucket": bucket, "key": key}
+                ),
+            }
+        )
+        if len(batch) == 10:  # SendMessageBatch limit
+            enqueued += send_batch(batch)
+            batch = []
+    if batch:
+        enqueued += send_batch(batch)
+    print(
+        json.dumps({"metric": "bulk_enqueue", "enqueued": enqueued, "skipped": skipped})
+    )
+    return {"enqueued": enqueued, "skipped": skipped}
+
+
+def list_pdf_keys(bucket, prefix):
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        response = clients.s3().list_objects_v2(**kwargs)
+        for obj in response.get("Contents", []):
+            if obj["Key"].lower().endswith(".pdf"):
+                yield obj["Key"]
+        if not response.get("IsTruncated"):
+            return
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def create_entry(upload_id, bucket, key):
+    # Returns False if the CV already got past the queued step
+    item = lambda_function.pending_entry_item(upload_id, upload_mode="bulk")
+    item["source"] = {"bucket": bucket, "key": key}
+    item["ingest_checkpoint"] = {"step": "queued"}
+    try:
+        clients.table("cv_uploads").put_item(
+            Item=item,
+            ConditionExpression="attribute_not_exists(upload_id) OR ingest_checkpoint.step = :queued",
+            ExpressionAttributeValues={":queued": "queued"},
+        )
+    except Exception as e:
+        if clients.is_conditional_check_failed(e):
+            return False
+        raise
+    return True
+
+
+def send_batch(entries):
+    response = clients.sqs().send_message_batch(
+        QueueUrl=BULK_QUEUE_URL, Entries=entries
+    )
+    for failed in response.get("Failed", []):
+        print(f"Error enqueuing message {failed['Id']}: {failed.get('Message')}")
+    return len(response.get("Successful", []))
+
+
+@clients.track_invocation
+def worker_handler(event, context):
+    """Process queued CVs until the queue is empty or the invocation runs out of time."""
+
+    def time_left():
+        return context.get_remaining_time_in_millis() > STOP_MARGIN_MS
+
+    return run_worker(BULK_QUEUE_URL, INGEST_PARALLELISM, time_left)
+
+
+def run_worker(queue_url, parallelism=INGEST_PARALLELISM, keep_going=lambda: True):
+    """Pull messages in batches and process up to parallelism CVs at once.
+
+    Returns the number of messages per outcome.
+    """
+    sqs = clients.sqs()
+    counts = collections.Counter()
+    running = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallelism) as executor:
+        while True:
+            free = parallelism - len(running)
+            if free > 0 and keep_going():
+                messages = sqs.receive_message(
+                    QueueUrl=queue_url,
+                    MaxNumberOfMessages=min(10, free),
+                    VisibilityTimeout=VISIBILITY_TIMEOUT,
+                    # Only wait for new messages when nothing else is to do
+                    WaitTimeSeconds=0 if running else 5,
+                    AttributeNames=["ApproximateReceiveCount"],
+                ).get("Messages", [])
+                running.update(
+                    executor.submit(process_message, queue_url, message)
+                    for message in messages
+                )
+                if not messages and not running:
+                    break
+            elif not running:
+                break
+            done, running = concurrent.futures.wait(
+                running,
+                timeout=RUN_POLL_SECONDS,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                counts[future.result()] += 1
+    print(json.dumps({"metric": "bulk_ingestion", "outcomes": dict(counts)}))
+    return dict(counts)
+
+
+def process_message(queue_url, message):
+    """Ingest the CV of one message, returns the outcome.
+
+    The message is deleted once the CV is finished. A failed attempt leaves
+    it in the queue, it is delivered again after the visibility timeout.
+    """
+    sqs = clients.sqs()
+    body = json.loads(message["Body"])
+    receipt = message["ReceiptHandle"]
+
+    def keep_alive():
+        sqs.change_message_visibility(
+            QueueUrl=queue_url,
+            ReceiptHandle=receipt,
+            VisibilityTimeout=VISIBILITY_TIMEOUT,
+        )
+
+    job = IngestionJob(body["upload_id"], body["bucket"], body["key"], keep_alive)
+    try:
+        outcome = job.run()
+    except Exception as e:
+        if rate_limit.is_rate_limited(e):
+            # Requeued, the next delivery continues from the checkpoint
+            delay = getattr(e, "retry_after", None) or 30
+            sqs.change_message_visibility(
+                QueueUrl=queue_url,
+                ReceiptHandle=receipt,
+                VisibilityTimeout=math.ceil(delay),
+            )
+            return "requeued"
+        attempts = int(message.get("Attributes", {}).get("ApproximateReceiveCount", 1))
+        print(f"Error ingesting {body['upload_id']} (attempt {attempts}): {e}")
+        if attempts < INGEST_MAX_ATTEMPTS:
+            return "retried"
+        job.fail("ingestion_error")
+        outcome = "failed"
+    sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=receipt)
+    return outcome
+
+
+class IngestionJob:
+    """Processing of one CV from its last checkpoint to the saved result."""
+
+    def __init__(self, upload_id, bucket, key, keep_alive):
+        self.upload_id = upload_id
+        self.bucket = bucket
+        self.key = key
+        self.keep_alive = keep_alive
+        self.timings = stage_timings.Recorder(upload_id)
+        self.checkpoint = {}
+
+    def run(self):
+        item = (
+            clients.table("cv_uploads")
+            .get_item(Key={"upload_id": self.upload_id}, ConsistentRead=True)
+            .get("Item")
+        )
+        if item is None or item["process_status"] != "in_progress":
+            return "skipped"  # Finished by an earlier delivery
+        self.checkpoint = dict(item.get("ingest_checkpoint") or {"step": "queued"})
+        if self.checkpoint["step"] == "queued":
+            outcome = self.prepare()
+            if outcome is not None:
+                return outcome
+        if self.checkpoint["step"] == "uploaded":
+            self.start_run("extraction")
+        if self.checkpoint["step"] == "extraction":
+            cv_data, validation = self.finish_extraction()
+            if cv_data is not None:
+                return self.save(
+                    cv_data,
+                    correction_skipped=True,
+                    extraction_confidence=decimal.Decimal(str(validation.confidence)),
+                )
+        cv_data = self.wait_for_answer("correction")
+        result_cache.store(
+            self.checkpoint.get("content_hash"),
+            pipeline.CORRECTION_ASSISTANT_ID,
+            "correction",
+            cv_data,
+        )
+        return self.save(cv_data, correction_skipped=False)
+
+    def prepare(self):
+        # Cached results and short CVs finish here, returns their outcome.
+        # Otherwise the PDF is uploaded to OpenAI and None returned.
+        pdf, _ = lambda_function.download_pdf_from_s3(self.bucket, self.key)
+        try:
+            page_texts = preflight.check_pdf(pdf)
+        except preflight.PreflightError as e:
+            lambda_function.mark_upload_failed(self.upload_id, e.reason)
+            return "rejected"
+        content_hash = hashlib.sha256(pdf).hexdigest()
+        saved, cached_extraction = lambda_function.use_cached_results(
+            self.upload_id, content_hash, self.timings
+        )
+        if saved:
+            return self.finish(content_hash, "cached")
+        if cached_extraction is None and lambda_function.try_direct_extraction(
+            self.upload_id, pdf, self.timings, page_texts
+        ):
+            return self.finish(content_hash, "direct")
+        file, vector_store = lambda_function.upload_file_to_openai_v2(
+            pdf, self.upload_id, self.timings
+        )
+        self.checkpoint.update(
+            content_hash=content_hash,
+            file_id=file.id,
+            vector_store_id=vector_store.id,
+        )
+        if isinstance(vector_store, vector_store_pool.PooledVectorStore):
+            self.checkpoint["vector_store_slot"] = vector_store.slot
+        if cached_extraction is not None:
+            self.start_run(
+                "correction",
+                pipeline.CORRECTION_PROMPT.format(
+                    file_id=file.id,
+                    extraction=json.dumps(cached_extraction, ensure_ascii=False),
+                ),
+            )
+        else:
+            self.save_checkpoint("uploaded")
+        return None
+
+    def start_run(self, mode, prompt=None):
+        file_id = self.checkpoint["file_id"]
+        if prompt is None:
+            prompt = pipeline.EXTRACTION_PROMPT.format(file_id=file_id)
+        self.extend_lease()
+        # A crash before the checkpoint is saved starts the run again
+        client = clients.openai()
+        thread = client.beta.threads.create(
+            messages=[{"role": "user", "content": prompt}],
+            tool_resources={
+                "file_search": {
+                    "vector_store_ids": [self.checkpoint["vector_store_id"]]
+                }
+            },
+        )
+        run = client.beta.threads.runs.create(
+            thread_id=thread.id,
+            assistant_id=(
+                pipeline.EXTRACTION_ASSISTANT_ID
+                if mode == "extraction"
+                else pipeline.CORRECTION_ASSISTANT_ID
+            ),
+            response_format=resume_schema.response_format(),
+        )
+        self.checkpoint.update(thread_id=thread.id, run_id=run.id)
+        self.save_checkpoint(mode)
+
+    def finish_extraction(self):
+        # Returns (cv_data, validation), cv_data is the extraction if it passes
+        # the correction gate, otherwise None and the correction run is started
+        messages = self.wait_for_run("extraction")
+        try:
+            extraction = answers.retrieve_json_answer(messages)
+            response = json.dumps(extraction, ensure_ascii=False)
+            result_cache.store(
+                self.checkpoint.get("content_hash"),
+                pipeline.EXTRACTION_ASSISTANT_ID,
+                "extraction",
+                extraction,
+            )
+        except answers.AnswerError as e:
+            print(f"Error parsing the extraction of {self.upload_id}: {e}")
+            extraction = None
+            response = answers.latest_answer(messages)
+        cv_data, validation = pipeline.check_extraction(self.upload_id, extraction)
+        if cv_data is None:
+            self.start_run(
+                "correction",
+                pipeline.CORRECTION_PROMPT.format(
+                    file_id=self.checkpoint["file_id"], extraction=response
+                ),
+            )
+        return cv_data, validation
+
+    def wait_for_answer(self, mode):
+        return answers.retrieve_json_answer(self.wait_for_run(mode))
+
+    def wait_for_run(self, mode):
+        """Poll the run of the checkpoint until it completed, returns its messages."""
+        client = clients.openai()
+        thread_id = self.checkpoint["thread_id"]
+        last_extension = time.monotonic()
+        while True:
+            run = client.beta.threads.runs.retrieve(
+                self.checkpoint["run_id"], thread_id=thread_id
+            )
+            if run.status == "completed":
+                break
+            if run.status not in ("queued", "in_progress"):
+                raise Exception(
+                    f"The {mode} run of {self.upload_id} ended with status {run.status}"
+                )
+            if time.monotonic() - last_extension > VISIBILITY_TIMEOUT / 2:
+                self.keep_alive()
+                self.extend_lease()
+                last_extension = time.monotonic()
+            time.sleep(RUN_POLL_SECONDS)
+        messages = client.beta.threads.messages.list(thread_id=thread_id)
+        stage_timings.add_run(self.timings, f"{mode}_run", messages.data)
+        return messages
+
+    def save_checkpoint(self, step):
+        self.checkpoint["step"] = step
+        clients.table("cv_uploads").update_item(
+            Key={"upload_id": self.upload_id},
+            UpdateExpression="SET ingest_checkpoint = :checkpoint",
+            ConditionExpression="process_status = :progress",
+            ExpressionAttributeValues={
+                ":checkpoint": self.checkpoint,
+                ":progress": "in_progress",
+            },
+        )
+
+    def save(self, cv_data, **attributes):
+        with self.timings.stage("db_save"):
+            uploads.save_cv_data(
+                self.upload_id,
+                cv_data,
+                ingest_checkpoint={**self.checkpoint, "step": "done"},
+                **attributes,
+            )
+        uploads.release_vector_store(self.vector_store_event())
+        return self.finish(self.checkpoint["content_hash"], "ingested")
+
+    def fail(self, reason):
+        # Frees the file and the pooled vector store once the CV was uploaded
+        event = {"upload_id": self.upload_id}
+        if self.checkpoint.get("file_id"):
+            event = self.vector_store_event()
+        uploads.mark_failed(event, reason)
+
+    def vector_store_event(self):
+        # The fields of a state input the vector store pool helpers read
+        return {
+            "upload_id": self.upload_id,
+            "vector_store_slot": self.checkpoint.get("vector_store_slot"),
+            "vectorstore_ids": [self.checkpoint["vector_store_id"]],
+            "file_id": self.checkpoint["file_id"],
+        }
+
+    def extend_lease(self):
+        if not uploads.extend_vector_store_lease(self.vector_store_event()):
+            raise Exception(f"{self.upload_id} lost its pooled vector store")
+
+    def finish(self, content_hash, outcome):
+        self.timings.record()
+        lambda_function.register_content_hash(content_hash, self.upload_id)
+        return outcome
@@ -0,0 +1,164 @@
+import io
+import re
+from urllib.parse import unquote
+
+# Minimal multipart/form-data parser.
+# Only the boundaries are searched in the decoded request body, the content of
+# every part is handed back as a memoryview slice of that body, so the uploaded
+# file is never copied while it is being parsed.
+
+_PARAM_PATTERN = re.compile(
+    r';\s*([^\s=;]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)', re.IGNORECASE
+)
+
+
+class MultipartError(Exception):
+    pass
+
+
+class Part:
+    """A single part of a multipart/form-data body."""
+
+    __slots__ = ("headers", "data")
+
+    def __init__(self, headers, data):
+        self.headers = headers
+        self.data = data
+
+    @property
+    def disposition_params(self):
+        return parse_header_params(self.headers.get("content-disposition", ""))
+
+    @property
+    def name(self):
+        return self.disposition_params.get("name")
+
+    @property
+    def filename(self):
+        params = self.disposition_params
+        if "filename*" in params:
+            # RFC 5987 encoding, e.g. UTF-8''Lebenslauf%20M%C3%BCller.pdf
+            charset, _, value = params["filename*"].partition("''")
+            return unquote(value or charset, encoding=charset or "utf-8")
+        return params.get("filename")
+
+    @property
+    def content_type(self):
+        return self.headers.get("content-type", "text/plain").split(";")[0].strip()
+
+
+def parse_header_params(header_value):
+    """Parse the parameters of a header like Content-Type or Content-Disposition."""
+    params = {}
+    for key, value in _PARAM_PATTERN.findall(header_value):
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+        params[key.lower()] = value
+    return params
+
+
+def get_boundary(content_type):
+    """Return the multipart boundary of a Content-Type header as bytes."""
+    if not content_type.lower().startswith("multipart/"):
+        raise MultipartError(f"Not a multipart content type: {content_type}")
+    boundary = parse_header_params(content_type).get("boundary")
+    if not boundary:
+        raise MultipartError("No boundary in content type")
+    return boundary.encode("latin-1")
+
+
+def _parse_part_headers(raw_headers):
+    headers = {}
+    for line in raw_headers.decode("latin-1").split("\r\n"):
+        if not line:
+            continue
+        key, _, value = line.partition(":")
+        headers[key.strip().lower()] = value.strip()
+    return headers
+
+
+class ViewReader(io.RawIOBase):
+    """Seekable file object reading the data of a part without copying it.
+
+    boto3 takes bytes or file objects as Body but no memoryview, and
+    io.BytesIO would copy the view.
+    """
+
+    def __init__(self, view):
+        self._view = memoryview(view).cast("B")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._view[self._position : self._position + len(buffer)]
+        buffer[: len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {
+            io.SEEK_SET: 0,
+            io.SEEK_CUR: self._position,
+            io.SEEK_END: len(self._view),
+        }
+        self._position = max(0, base[whence] + offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+def iter_parts(body, content_type):
+    """Yield the parts of a multipart body without copying their content.
+
+    `body` has to be a bytes or bytearray object, the data of every returned
+    part is a memoryview into it.
+    """
+    delimiter = b"--" + get_boundary(content_type)
+    view = memoryview(body)
+
+    position = body.find(delimiter)
+    if position == -1:
+        raise MultipartError("Boundary not found in body")
+
+    while True:
+        position += len(delimiter)
+        if body[position : position + 2] == b"--":
+            return  # Closing delimiter
+
+        # Skip the rest of the delimiter line (transport padding)
+        line_end = body.find(b"\r\n", position)
+        if line_end == -1:
+            raise MultipartError("Unexpected end of body after boundary")
+        header_start = line_end + 2
+
+        if body[header_start : header_start + 2] == b"\r\n":
+            headers = {}
+            data_start = header_start + 2
+        else:
+            header_end = body.find(b"\r\n\r\n", header_start)
+            if header_end == -1:
+                raise MultipartError("Unterminated part headers")
+            headers = _parse_part_headers(body[header_start:header_end])
+            data_start = header_end + 4
+
+        data_end = body.find(b"\r\n" + delimiter, data_start)
+        if data_end == -1:
+            raise MultipartError("Unterminated part")
+
+        yield Part(headers, view[data_start:data_end])
+        position = data_end + 2
+
+
+def find_file_part(body, content_type):
+    """Return the first part carrying a filename, or None."""
+    for part in iter_parts(body, content_type):
+        if part.filename is not None:
+            return part
+    return None
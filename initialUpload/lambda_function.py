@@ -1,21 +1,111 @@
 import json
 import base64
+import decimal
+import functools
+import hashlib
 import io
-from email.parser import Parser
-from email.message import EmailMessage
+import math
+import os
 import time
-from openai import OpenAI
-import boto3
+from concurrent.futures import Future, ThreadPoolExecutor
 import uuid
+from urllib.parse import unquote_plus
+from cvision_runtime import clients
+from cvision_runtime import pipeline
+from cvision_runtime import rate_limit
+from cvision_runtime import result_cache
+from cvision_runtime import stage_timings
+from cvision_runtime import uploads as cv_uploads  # Local variables are named uploads
+from cvision_runtime import vector_store_pool
+import formdata
+import page_groups
+import preflight
+import text_extraction
 
+UPLOAD_BUCKET = "cv-uploaded-resumes"
+# The bucket has one ObjectCreated notification per prefix, S3 rejects
+# overlapping ones: multipart archives below ARCHIVE_PREFIX go to
+# extract_profile, direct uploads below DIRECT_UPLOAD_PREFIX to
+# s3_upload_handler, which passes them on to PROFILE_FUNCTION_NAME.
+ARCHIVE_PREFIX = "multipart/"
+DIRECT_UPLOAD_PREFIX = "direct/"
+PROFILE_FUNCTION_NAME = os.environ.get("PROFILE_FUNCTION_NAME", "")
+DIRECT_UPLOAD_MAX_BYTES = 50 * 1024 * 1024
+DIRECT_UPLOAD_URL_EXPIRY = 900  # Seconds
+# An entry of a direct upload whose file never arrived is marked failed by the
+# sweep of cleanUp this long after its URL expired
+DIRECT_UPLOAD_GRACE_SECONDS = int(os.environ.get("DIRECT_UPLOAD_GRACE_SECONDS", 600))
+# Invocations of s3_upload_handler per direct upload: the first plus the
+# retries of the asynchronous invocation (MaximumRetryAttempts, 2 by default).
+# A direct upload still rate limited on the last one is marked failed.
+DIRECT_UPLOAD_MAX_ATTEMPTS = int(os.environ.get("DIRECT_UPLOAD_MAX_ATTEMPTS", 3))
+MAX_FILES_PER_REQUEST = int(os.environ.get("MAX_FILES_PER_REQUEST", 20))
+# Index of already processed PDFs, keyed by the SHA-256 of the file content
+HASH_INDEX_TABLE = "cv_upload_hashes"
+DEDUP_MAX_AGE_SECONDS = int(os.environ.get("DEDUP_MAX_AGE_SECONDS", 7 * 24 * 3600))
+# "concurrent" overlaps the independent upload steps, "sequential" runs them in order
+UPLOAD_FANOUT_MODE = os.environ.get("UPLOAD_FANOUT_MODE", "concurrent")
+# "auto" extracts short CVs from their text directly, "assistant" always uses
+# the vector store and the state machine
+EXTRACTION_MODE = os.environ.get("EXTRACTION_MODE", "auto")
+# Lets the state machine run the extraction with streamExtraction, which saves
+# the sections of the answer while the run is still going
+EXTRACTION_STREAMING = os.environ.get("EXTRACTION_STREAMING", "false").lower() == "true"
 
+# Seconds from the upload request to the end of its OpenAI upload, including
+# the waits for rate limit tokens. Attaching the ids and starting the execution
+# follow before API Gateway answers after 29 seconds.
+OPENAI_UPLOAD_DEADLINE_SECONDS = float(
+    os.environ.get("OPENAI_UPLOAD_DEADLINE_SECONDS", 25)
+)
+
+# Retry-After of a rate limited upload without a wait of its own, e.g. a 429 of OpenAI
+RATE_LIMIT_RETRY_SECONDS = int(os.environ.get("RATE_LIMIT_RETRY_SECONDS", 5))
+
+# Error messages returned to the client when one of the upload steps fails
+STEP_ERRORS = {
+    "s3_put": "Error archiving the PDF in S3",
+    "openai_upload": "Error uploading PDF to OpenAI API",
+    "dynamodb_init": "Error Initializing the Database entry for this CV - DynamoDB Error",
+    "dynamodb_attach": "Error Initializing the Database entry for this CV - DynamoDB Error",
+    "stepfunctions_start": "Error Initializing the processing of the CV - StepFunctions Error",
+}
+
+
+class UploadStepError(Exception):
+    def __init__(self, step, error):
+        if rate_limit.is_rate_limited(error) or isinstance(
+            error, rate_limit.DeadlinePassed
+        ):
+            # Over the OpenAI budget, the client uploads the file again later
+            self.status_code = 429
+            # Seconds until the client uploads the file again, sent as Retry-After
+            self.retry_after = math.ceil(
+                getattr(error, "retry_after", None) or RATE_LIMIT_RETRY_SECONDS
+            )
+            super().__init__(
+                f"Too Many Requests - {STEP_ERRORS[step]}, retry later: {error}"
+            )
+        else:
+            self.status_code = 500
+            super().__init__(f"Internal Server Error - {STEP_ERRORS[step]}: {error}")
+        self.step = step
+        self.error = error
+
+
+@clients.track_invocation
 def lambda_handler(event, context):
+    # The direct extractions of this request end before API Gateway times out
+    deadline = text_extraction.deadline_from_now()
+    upload_deadline = time.monotonic() + OPENAI_UPLOAD_DEADLINE_SECONDS
     # Check if the Headers and Body are there
     print(f"Headers: {event['headers']}")
     original_headers = event["headers"]
     headers = {k.lower(): v for k, v in original_headers.items()}
     debug_mode = headers.get("debug_mode", "false").lower() == "true"
-    upload_id = uuid.uuid4()
+    force_reextract = headers.get("force_reextract", "false").lower() == "true"
+    # Runs the assistants even if the result cache has the result of this CV
+    cache_bust = headers.get("cache_bust", "false").lower() == "true"
     print(f"Debug Mode: {debug_mode}")
     if debug_mode:
         response = {
@@ -28,102 +118,897 @@ def lambda_handler(event, context):
             return generate_response(400, "Bad Request - No Body found in request")
         return generate_response(400, "Bad Request - No Headers found in request")
 
-    # Exctratct pdf from Request and Save it as a Bytestream
+    # Extract all PDFs from the request, they stay in memory as views of the body
+    parse_started_at = time.time()
     try:
-        pdf = extract_pdf_from_formdata(
-            body64=event["body"],
-            content_type=headers["content-type"],
-            upload_id=f"{upload_id}",
+        files = extract_pdfs_from_formdata(
+            body64=event["body"], content_type=headers["content-type"]
         )
     except Exception as e:
         return generate_response(400, f"Bad Request - No PDF found in request: {e}")
+    parse_ended_at = time.time()
+    if len(files) > MAX_FILES_PER_REQUEST:
+        return generate_response(
+            400, f"Bad Request - At most {MAX_FILES_PER_REQUEST} files per request"
+        )
+    uploads = []
+    for name, pdf in files:
+        upload_id = str(uuid.uuid4())
+        timings = stage_timings.Recorder(upload_id)
+        timings.add("multipart_parse", parse_started_at, parse_ended_at)
+        uploads.append(
+            {
+                "upload_id": upload_id,
+                "file_name": name,
+                "pdf": pdf,
+                "timings": timings,
+                "deadline": deadline,
+                "upload_deadline": upload_deadline,
+            }
+        )
+
+    # Reject unusable PDFs before any network call, the others are processed
+    for upload in uploads:
+        try:
+            upload["page_texts"] = preflight.check_pdf(upload["pdf"])
+        except preflight.PreflightError as e:
+            upload["rejection"] = e
+    accepted = [upload for upload in uploads if "rejection" not in upload]
+    results = dict(
+        zip(
+            (u["upload_id"] for u in accepted),
+            process_uploads(accepted, force_reextract, cache_bust),
+        )
+    )
+    for upload in uploads:
+        if "rejection" in upload:
+            results[upload["upload_id"]] = {
+                "fileName": upload["file_name"],
+                "statusCode": upload["rejection"].status_code,
+                "error": f"Bad Request - {upload['rejection']}",
+                "reason": upload["rejection"].reason,
+            }
+    results = [results[upload["upload_id"]] for upload in uploads]
+
+    if len(results) == 1:
+        result = results[0]
+        if "error" in result:
+            headers = {}
+            if "retryAfter" in result:
+                headers["Retry-After"] = str(result["retryAfter"])
+            return generate_response(result["statusCode"], result["error"], headers)
+        return generate_response(200, {**result, "uploads": results})
+    started = sum(1 for result in results if "uploadId" in result)
+    response = {
+        "uploads": results,
+        "message": f"{started} of {len(results)} CVs uploaded and initiated processing",
+    }
+    return generate_response(200, response)
+
+
+def process_uploads(uploads, force_reextract, cache_bust=False):
+    """Process the accepted files concurrently, returns one result per file."""
+    if not uploads:
+        return []
+
+    # Files are handled concurrently, their steps run on a separate pool so
+    # waiting file workers can never block the steps they are waiting for
+    with create_executor(4 * len(uploads)) as executor, create_executor(
+        len(uploads)
+    ) as file_executor:
+        for upload in uploads:
+            # The S3 archive only needs the PDF, it runs alongside all other steps
+            upload["archive"] = executor.submit(
+                timed,
+                upload["timings"],
+                "s3_put",
+                upload_pdf_to_s3,
+                upload["pdf"],
+                UPLOAD_BUCKET,
+                archive_key(upload["upload_id"]),
+            )
+
+        # Look for identical CVs to reuse their result instead of extracting again
+        for upload in uploads:
+            upload["content_hash"] = hashlib.sha256(upload["pdf"]).hexdigest()
+        originals = file_executor.map(
+            lambda upload: (
+                None
+                if force_reextract
+                else find_duplicate_upload(upload["content_hash"], upload["upload_id"])
+            ),
+            uploads,
+        )
+        for upload, original in zip(uploads, originals):
+            upload["original"] = original
 
-    # Upload the extracted pdf file to the the OpenAI API
+        # The entries of all files are written with one BatchWriteItem request
+        entry_timings = stage_timings.Recorder()
+        entries = executor.submit(
+            timed,
+            entry_timings,
+            "dynamodb_init",
+            write_database_entries,
+            [build_entry_item(upload) for upload in uploads],
+        )
+
+        results = list(
+            file_executor.map(
+                lambda upload: finish_upload(executor, upload, entries, cache_bust),
+                uploads,
+            )
+        )
+
+        # The timings of all files are saved concurrently
+        for upload in uploads:
+            upload["timings"].update(entry_timings)
+        list(
+            file_executor.map(
+                lambda upload: log_step_timings(upload["upload_id"], upload["timings"]),
+                uploads,
+            )
+        )
+    return results
+
+
+def build_entry_item(upload):
+    if upload["original"] is not None:
+        return duplicate_entry_item(
+            upload["upload_id"], upload["original"], upload["content_hash"]
+        )
+    return pending_entry_item(upload["upload_id"], upload["content_hash"])
+
+
+def write_database_entries(items):
+    # The batch writer sends BatchWriteItem requests and resends unprocessed items.
+    # If it fails part way, the entries it already wrote are marked failed
+    table = clients.table("cv_uploads")
     try:
-        openai_file, vectorstore = upload_file_to_openai_v2(
-            pdf=pdf, upload_id=upload_id
+        with table.batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+    except Exception:
+        for item in items:
+            fail_written_entry(item["upload_id"])
+        raise
+
+
+def fail_written_entry(upload_id):
+    try:
+        clients.table("cv_uploads").update_item(
+            Key={"upload_id": upload_id},
+            UpdateExpression="SET process_status = :sta, failure_reason = :reason"
+            + cv_uploads.BUMP_VERSION,
+            ConditionExpression="attribute_exists(upload_id)",
+            ExpressionAttributeValues={
+                ":sta": "failed",
+                ":reason": "entry_write_failed",
+                ":one": 1,
+            },
         )
     except Exception as e:
-        return generate_response(
-            500, f"Internal Server Error - Error uploading PDF to OpenAI API: {e}"
+        if not clients.is_conditional_check_failed(e):
+            print(f"Error marking the entry of {upload_id} failed: {e}")
+
+
+def finish_upload(executor, upload, entries, cache_bust=False):
+    # Returns the per-file result, errors are reported without failing the batch
+    upload_id = upload["upload_id"]
+    result = {"fileName": upload["file_name"]}
+    if upload["original"] is not None:
+        if entries.exception() is not None:
+            return {
+                **result,
+                "statusCode": 500,
+                "error": f"Internal Server Error - {STEP_ERRORS['dynamodb_init']}: {entries.exception()}",
+            }
+        if upload["archive"].exception() is not None:
+            print(
+                f"Error archiving duplicate CV in S3: {upload['archive'].exception()}"
+            )
+        return {
+            **result,
+            "uploadId": upload_id,
+            "duplicateOf": upload["original"]["upload_id"],
+            "message": "CV was already uploaded, reusing the existing result",
+        }
+
+    # Cached results and short CVs are saved right away, only their save waits
+    # for the entry and archive, a cached extraction leaves only the correction run
+    def ready():
+        return entries.exception() is None and upload["archive"].exception() is None
+
+    cached_extraction = None
+    if not cache_bust:
+        saved, cached_extraction = use_cached_results(
+            upload_id, upload["content_hash"], upload["timings"], ready
+        )
+        if saved:
+            register_content_hash(upload["content_hash"], upload_id)
+            return {
+                **result,
+                "uploadId": upload_id,
+                "message": "CV uploaded, the result was taken from the cache",
+            }
+    if cached_extraction is None and try_direct_extraction(
+        upload_id,
+        upload["pdf"],
+        upload["timings"],
+        upload["page_texts"],
+        upload["deadline"],
+        ready,
+    ):
+        register_content_hash(upload["content_hash"], upload_id)
+        return {
+            **result,
+            "uploadId": upload_id,
+            "message": "CV uploaded and extracted successfully",
+        }
+
+    # The OpenAI upload is skipped once the entry write failed, the batch write
+    # takes a fraction of the upload
+    if entries.exception() is not None:
+        return {
+            **result,
+            "statusCode": 500,
+            "error": f"Internal Server Error - {STEP_ERRORS['dynamodb_init']}: {entries.exception()}",
+        }
+
+    # Upload to OpenAI, attach it to the database entry and start the processing
+    try:
+        process_upload(
+            executor,
+            upload["pdf"],
+            upload_id,
+            upload["content_hash"],
+            upload["timings"],
+            archive=upload["archive"],
+            entry=entries,
+            cached_extraction=cached_extraction,
+            cache_bust=cache_bust,
+            deadline=upload["upload_deadline"],
+        )
+    except UploadStepError as e:
+        if e.status_code == 429:
+            result["retryAfter"] = e.retry_after
+        return {**result, "statusCode": e.status_code, "error": str(e)}
+    register_content_hash(upload["content_hash"], upload_id)
+    return {
+        **result,
+        "uploadId": upload_id,
+        "message": "CV uploaded successfully and initiated processing",
+    }
+
+
+def try_direct_extraction(
+    upload_id, pdf, timings, page_texts=None, deadline=None, ready=None
+):
+    """Extract a short or, in page groups, a long CV from its text.
+
+    Neither needs the vector store and the state machine. The completions end
+    by deadline, see text_extraction.extract_resume_from_text. ready() is
+    called before the save and returns whether the entry can be written.
+
+    Returns False if the CV needs the assistant path, also when the direct
+    extraction fails so that the upload falls back to it.
+    """
+    if EXTRACTION_MODE != "auto":
+        return False
+    if page_texts is None:
+        page_texts = timed(
+            timings, "text_extraction", text_extraction.pdf_page_texts, pdf
+        )
+    if page_groups.use_page_groups(page_texts):
+        # Long CV, its page groups are extracted concurrently
+        extraction_mode = "page_groups"
+        step = "page_group_completions"
+        extract = functools.partial(page_groups.extract_resume, page_texts, deadline)
+    elif text_extraction.use_direct_text(page_texts):
+        extraction_mode = "direct_text"
+        step = "direct_completion"
+        extract = functools.partial(
+            text_extraction.extract_resume_from_text,
+            "\n".join(page_texts),
+            deadline=deadline,
+        )
+    else:
+        return False
+    try:
+        cv_data = timed(timings, step, extract)
+        if ready is not None and not ready():
+            return False
+        timed(
+            timings,
+            "db_save",
+            save_extracted_cv_data,
+            upload_id,
+            cv_data,
+            extraction_mode,
+        )
+    except Exception as e:
+        print(f"Direct extraction of {upload_id} failed, using the assistants: {e}")
+        return False
+    return True
+
+
+def save_extracted_cv_data(
+    upload_id, cv_data, extraction_mode="direct_text", **attributes
+):
+    cv_uploads.save_cv_data(
+        upload_id, cv_data, extraction_mode=extraction_mode, **attributes
+    )
+
+
+def use_cached_results(upload_id, content_hash, timings, ready=None):
+    """Save the cached result of an identical CV, returns (saved, cached extraction).
+
+    A cached correction is saved, a cached extraction as well if it passes the
+    correction gate. Otherwise the cached extraction is returned and the
+    upload starts with the correction run. Lookup or save errors fall back to
+    the normal processing, like ready() returning False before the save.
+    """
+    cached = timed(timings, "cache_lookup", result_cache.lookup, content_hash)
+    cv_data = cached.get("correction")
+    attributes = {"correction_skipped": False}
+    if cv_data is None and "extraction" in cached:
+        cv_data, validation = pipeline.check_extraction(upload_id, cached["extraction"])
+        attributes = {
+            "correction_skipped": True,
+            "extraction_confidence": decimal.Decimal(str(validation.confidence)),
+        }
+    if cv_data is None:
+        return False, cached.get("extraction")
+    if ready is not None and not ready():
+        return False, None
+    try:
+        timed(
+            timings,
+            "db_save",
+            save_extracted_cv_data,
+            upload_id,
+            cv_data,
+            "assistant",
+            result_cached=True,
+            **attributes,
+        )
+    except Exception as e:
+        print(f"Error saving the cached result of {upload_id}: {e}")
+        return False, None
+    return True, None
+
+
+def create_executor(max_workers=4):
+    if UPLOAD_FANOUT_MODE == "sequential":
+        return InlineExecutor()
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+class InlineExecutor:
+    """Executor running every submitted step immediately, used for the sequential mode."""
+
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, function, *iterables):
+        return map(function, *iterables)
+
+
+def timed(timings, step, function, *args, **kwargs):
+    # Runs one upload step and records its window in the stage_timings.Recorder
+    with timings.stage(step):
+        return function(*args, **kwargs)
+
+
+def log_step_timings(upload_id, timings):
+    print(
+        json.dumps(
+            {
+                "metric": "upload_step_timings",
+                "upload_id": str(upload_id),
+                "mode": UPLOAD_FANOUT_MODE,
+                "timings_ms": timings.durations_ms(),
+            }
+        )
+    )
+    timings.record()
+
+
+def wait_for_steps(steps):
+    # Returns the results of the successful steps and the first failed step
+    results = {}
+    failed = None
+    for step, future in steps.items():
+        error = future.exception()
+        if error is None:
+            results[step] = future.result()
+        elif failed is None:
+            failed = (step, error)
+    return results, failed
+
+
+def process_upload(
+    executor,
+    pdf,
+    upload_id,
+    content_hash,
+    timings,
+    archive=None,
+    entry=None,
+    cached_extraction=None,
+    cache_bust=False,
+    deadline=None,
+):
+    """Run the upload side effects, only serializing the real dependencies.
+
+    The OpenAI upload, the in_progress database entry and the S3 archive run
+    concurrently, the futures of the archive and entry steps can be passed in
+    when they were started earlier. Attaching the OpenAI ids and starting the state machine both
+    need the OpenAI upload and run concurrently afterwards. If a step fails,
+    everything that already succeeded is rolled back. With a cached_extraction
+    the state machine starts with the correction run. The OpenAI upload ends
+    by deadline (time.monotonic()) if one is given.
+    """
+    upload_id = str(upload_id)
+    steps = {
+        "openai_upload": executor.submit(
+            upload_file_to_openai_v2,
+            pdf=pdf,
+            upload_id=upload_id,
+            timings=timings,
+            deadline=deadline,
         )
+    }
+    if entry is not None:
+        steps["dynamodb_init"] = entry
+    if archive is not None:
+        steps["s3_put"] = archive
+    completed, failed = wait_for_steps(steps)
+    if failed is not None:
+        compensate_upload(upload_id, completed, content_hash)
+        raise UploadStepError(*failed)
+
+    openai_file, vectorstore = completed["openai_upload"]
+    finishing_steps = {
+        "dynamodb_attach": executor.submit(
+            timed,
+            timings,
+            "dynamodb_attach",
+            attach_openai_resources,
+            upload_id,
+            openai_file,
+            vectorstore,
+            content_hash,
+        ),
+        "stepfunctions_start": executor.submit(
+            timed,
+            timings,
+            "stepfunctions_start",
+            startStateMachineProcessing,
+            openai_file,
+            upload_id,
+            vectorstore,
+            content_hash,
+            cached_extraction,
+            cache_bust,
+        ),
+    }
+    finished, failed = wait_for_steps(finishing_steps)
+    if failed is not None:
+        if "stepfunctions_start" in finished:
+            # The execution already runs and saves its result to the entry
+            print(f"Error attaching OpenAI resources to {upload_id}: {failed[1]}")
+            return upload_id
+        compensate_upload(upload_id, completed, content_hash)
+        raise UploadStepError(*failed)
+    return upload_id
+
+
+def compensate_upload(upload_id, completed, content_hash=None):
+    # Best effort rollback of the upload steps that already succeeded. The
+    # content hash claimed by the upload is released, so the next upload of the
+    # same CV is processed instead of waiting for the claim to go stale.
+    if content_hash:
+        release_content_hash(content_hash, upload_id)
+    if "openai_upload" in completed:
+        openai_file, vectorstore = completed["openai_upload"]
+        try:
+            if isinstance(vectorstore, vector_store_pool.PooledVectorStore):
+                vector_store_pool.release(
+                    upload_id, vectorstore.slot, vectorstore.id, openai_file.id
+                )
+            else:
+                client = clients.openai()
+                client.beta.vector_stores.delete(vectorstore.id)
+                client.files.delete(openai_file.id)
+        except Exception as e:
+            print(f"Error deleting OpenAI resources of {upload_id}: {e}")
+    if "dynamodb_init" in completed:
+        try:
+            table = clients.table("cv_uploads")
+            table.delete_item(Key={"upload_id": upload_id})
+        except Exception as e:
+            print(f"Error deleting database entry of {upload_id}: {e}")
+    if "s3_put" in completed:
+        try:
+            clients.s3().delete_object(Bucket=UPLOAD_BUCKET, Key=archive_key(upload_id))
+        except Exception as e:
+            print(f"Error deleting archived PDF of {upload_id}: {e}")
 
-    # Initialize a database entry for this CV
+
+@clients.track_invocation
+def presigned_upload_handler(event, context):
+    # Returns a presigned S3 POST so the browser can upload the PDF directly
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    force_reextract = headers.get("force_reextract", "false").lower()
+    cache_bust = headers.get("cache_bust", "false").lower()
+    upload_id = str(uuid.uuid4())
+    s3_client = clients.s3()
     try:
-        primaryKey = initialize_database_entry(
-            openai_file=openai_file, vectorstore=vectorstore, upload_id=upload_id
+        presigned_post = s3_client.generate_presigned_post(
+            Bucket=UPLOAD_BUCKET,
+            Key=f"{DIRECT_UPLOAD_PREFIX}{upload_id}",
+            Fields={
+                "Content-Type": "application/pdf",
+                "x-amz-meta-force-reextract": force_reextract,
+                "x-amz-meta-cache-bust": cache_bust,
+            },
+            Conditions=[
+                {"Content-Type": "application/pdf"},
+                {"x-amz-meta-force-reextract": force_reextract},
+                {"x-amz-meta-cache-bust": cache_bust},
+                ["content-length-range", 1, DIRECT_UPLOAD_MAX_BYTES],
+            ],
+            ExpiresIn=DIRECT_UPLOAD_URL_EXPIRY,
         )
     except Exception as e:
         return generate_response(
-            500,
-            f"Internal Server Error - Error Initializing the Database entry for this CV - DynamoDB Error: {e}",
+            500, f"Internal Server Error - Error creating the upload URL: {e}"
         )
 
-    # Start the Processing of the CV in the Step Function
+    # Create the entry right away so status polling works before the upload is done
     try:
-        startStateMachineProcessing(openai_file, primaryKey, vectorstore)
+        initialize_pending_entry(
+            upload_id,
+            upload_mode="direct",
+            upload_expires_at=int(time.time())
+            + DIRECT_UPLOAD_URL_EXPIRY
+            + DIRECT_UPLOAD_GRACE_SECONDS,
+        )
     except Exception as e:
         return generate_response(
             500,
-            f"Internal Server Error - Error Initializing the processing of the CV - StepFunctions Error: {e}",
+            f"Internal Server Error - Error Initializing the Database entry for this CV - DynamoDB Error: {e}",
         )
 
     response = {
-        "uploadId": primaryKey,
-        "message": "CV uploaded successfully and initiated processing",
+        "uploadId": upload_id,
+        "upload": presigned_post,
+        "message": "Upload the CV with the returned form fields to start processing",
     }
     return generate_response(200, response)
 
 
-def startStateMachineProcessing(oai_file, uploadId, vectorstore):
-    statemachine_client = boto3.client("stepfunctions")
-    state_machine_arn = (
-        "arn:aws:states:eu-central-1:891376982948:stateMachine:MyStateMachine-h1zdun91x"
+@clients.track_invocation
+def s3_upload_handler(event, context):
+    # Triggered by the S3 event of a direct upload below DIRECT_UPLOAD_PREFIX
+    for record in event["Records"]:
+        object_key = unquote_plus(record["s3"]["object"]["key"])
+        upload_id = object_key.rsplit("/", 1)[-1]
+        print(f"Processing direct upload {upload_id}")
+        attempt = claim_direct_upload(upload_id)
+        if attempt is None:
+            print(f"Direct upload {upload_id} arrived after its entry expired")
+            continue
+        if attempt == 1:
+            # Retries of a rate limited upload are not forwarded again
+            forward_to_profile_extraction(record)
+        try:
+            pdf, metadata = download_pdf_from_s3(
+                record["s3"]["bucket"]["name"], object_key
+            )
+            try:
+                page_texts = preflight.check_pdf(pdf)
+            except preflight.PreflightError as e:
+                print(f"Direct upload {upload_id} rejected: {e}")
+                mark_upload_failed(upload_id, e.reason)
+                continue
+            content_hash = hashlib.sha256(pdf).hexdigest()
+            if metadata.get("force-reextract", "false").lower() != "true":
+                original = find_duplicate_upload(content_hash, upload_id)
+                if original is not None:
+                    link_duplicate_upload(upload_id, original, content_hash)
+                    continue
+            # The object is already in S3 and the entry exists since the URL request
+            timings = stage_timings.Recorder(upload_id)
+            cache_bust = metadata.get("cache-bust", "false").lower() == "true"
+            cached_extraction = None
+            if not cache_bust:
+                saved, cached_extraction = use_cached_results(
+                    upload_id, content_hash, timings
+                )
+                if saved:
+                    log_step_timings(upload_id, timings)
+                    register_content_hash(content_hash, upload_id)
+                    continue
+            if cached_extraction is None and try_direct_extraction(
+                upload_id, pdf, timings, page_texts
+            ):
+                log_step_timings(upload_id, timings)
+                register_content_hash(content_hash, upload_id)
+                continue
+            with create_executor() as executor:
+                primaryKey = process_upload(
+                    executor,
+                    pdf,
+                    upload_id,
+                    content_hash,
+                    timings,
+                    cached_extraction=cached_extraction,
+                    cache_bust=cache_bust,
+                )
+            log_step_timings(upload_id, timings)
+            register_content_hash(content_hash, primaryKey)
+        except Exception as e:
+            if rate_limit.is_rate_limited(e):
+                if len(event["Records"]) == 1 and attempt < DIRECT_UPLOAD_MAX_ATTEMPTS:
+                    # S3 sends one record per event, the asynchronous invocation
+                    # is retried with backoff while the entry stays in_progress
+                    print(f"Direct upload {upload_id} is over the rate limit: {e}")
+                    raise
+                print(f"Direct upload {upload_id} is still rate limited: {e}")
+                mark_upload_failed(upload_id, "rate_limited")
+                continue
+            print(f"Error processing direct upload {upload_id}: {e}")
+            mark_upload_failed(upload_id)
+    return {"statusCode": 200, "body": json.dumps("Direct uploads processed")}
+
+
+def claim_direct_upload(upload_id):
+    """Keep the cleanUp sweep off the entry and count the processing attempts.
+
+    Returns the number of this attempt, or None if the entry expired or the
+    upload was finished by an earlier attempt.
+    """
+    try:
+        response = clients.table("cv_uploads").update_item(
+            Key={"upload_id": upload_id},
+            UpdateExpression="REMOVE upload_expires_at ADD direct_attempts :one",
+            ConditionExpression="process_status = :progress",
+            ExpressionAttributeValues={":progress": "in_progress", ":one": 1},
+            ReturnValues="UPDATED_NEW",
+        )
+    except Exception as e:
+        if clients.is_conditional_check_failed(e):
+            return None
+        raise
+    return int(response["Attributes"]["direct_attempts"])
+
+
+def forward_to_profile_extraction(record):
+    # extract_profile can't have its own notification on DIRECT_UPLOAD_PREFIX
+    if not PROFILE_FUNCTION_NAME:
+        return
+    try:
+        clients.lambda_client().invoke(
+            FunctionName=PROFILE_FUNCTION_NAME,
+            InvocationType="Event",
+            Payload=json.dumps({"Records": [record]}),
+        )
+    except Exception as e:
+        print(f"Error passing the direct upload on to {PROFILE_FUNCTION_NAME}: {e}")
+
+
+def download_pdf_from_s3(bucket_name, object_key):
+    s3_client = clients.s3()
+    response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
+    return response["Body"].read(), response.get("Metadata", {})
+
+
+def mark_upload_failed(upload_id, reason="processing_error"):
+    table = clients.table("cv_uploads")
+    table.update_item(
+        Key={"upload_id": str(upload_id)},
+        UpdateExpression="SET process_status = :sta, failure_reason = :reason"
+        + cv_uploads.BUMP_VERSION,
+        ExpressionAttributeValues={":sta": "failed", ":reason": reason, ":one": 1},
     )
-    assistant_id = "asst_ab8KCfa3TRFd5MbN0iGXs9bj"
-    state_input_data = {
-        "upload_id": uploadId,
-        "assistant_id": assistant_id,
-        "file_id": oai_file.id,
-        "vectorstore_ids": [vectorstore.id],
-        "file_ids": [oai_file.id],
-        "prompt": f"In der PDF-Datei {oai_file.id} befindet sich der Lebenslauf aus dem du die Daten extrahieren sollst",
-        "mode": "extraction",
+
+
+def find_duplicate_upload(content_hash, upload_id):
+    """Claim content_hash for upload_id, returns the item of a finished original.
+
+    The hash entry is written conditionally, so of concurrent uploads of the
+    same PDF one holds the claim. The others are only duplicates once the
+    original is ready_to_retrieve, while it is in progress they are processed
+    again, a failed original hands its claim to the next upload. Returns None
+    when upload_id has to be processed.
+    """
+    table = clients.table(HASH_INDEX_TABLE)
+    try:
+        if claim_content_hash(table, content_hash, upload_id):
+            return None
+        hash_entry = table.get_item(
+            Key={"content_hash": content_hash}, ConsistentRead=True
+        ).get("Item")
+        if not hash_entry:  # Expired between the put and the read
+            claim_content_hash(table, content_hash, upload_id)
+            return None
+        original = (
+            clients.table("cv_uploads")
+            .get_item(Key={"upload_id": hash_entry["upload_id"]})
+            .get("Item")
+        )
+    except Exception as e:
+        print(f"Duplicate lookup failed, processing as a new upload: {e}")
+        return None
+    status = (original or {}).get("process_status")
+    if status == "ready_to_retrieve":
+        print(f"CV is a duplicate of upload {original['upload_id']}")
+        return original
+    print(f"Original upload {hash_entry['upload_id']} is {status}, processing again")
+    if status == "failed":
+        try:
+            claim_content_hash(table, content_hash, upload_id, hash_entry["upload_id"])
+        except Exception as e:
+            print(f"Error claiming content hash {content_hash}: {e}")
+    return None
+
+
+def claim_content_hash(table, content_hash, upload_id, previous_upload_id=None):
+    # Returns False if another upload holds the hash, an expired claim is taken over
+    created_at = int(time.time())
+    condition = "attribute_not_exists(content_hash) OR created_at < :stale"
+    values = {":stale": created_at - DEDUP_MAX_AGE_SECONDS}
+    if previous_upload_id is not None:
+        condition = "upload_id = :previous"
+        values = {":previous": previous_upload_id}
+    try:
+        table.put_item(
+            Item={
+                "content_hash": content_hash,
+                "upload_id": str(upload_id),
+                "created_at": created_at,
+                "expires_at": created_at + DEDUP_MAX_AGE_SECONDS,  # TTL attribute
+            },
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values,
+        )
+    except Exception as e:
+        if clients.is_conditional_check_failed(e):
+            return False
+        raise
+    return True
+
+
+def release_content_hash(content_hash, upload_id):
+    try:
+        clients.table(HASH_INDEX_TABLE).delete_item(
+            Key={"content_hash": content_hash},
+            ConditionExpression="upload_id = :upload",
+            ExpressionAttributeValues={":upload": str(upload_id)},
+        )
+    except Exception as e:
+        # Claimed by another upload in the meantime
+        if not clients.is_conditional_check_failed(e):
+            print(f"Error releasing content hash {content_hash}: {e}")
+
+
+def link_duplicate_upload(upload_id, original, content_hash):
+    table = clients.table("cv_uploads")
+    table.put_item(Item=duplicate_entry_item(upload_id, original, content_hash))
+
+
+def duplicate_entry_item(upload_id, original, content_hash):
+    # Only finished originals are reused, their result is copied
+    return {
+        "process_status": "ready_to_retrieve",
+        "upload_id": str(upload_id),
+        "content_hash": content_hash,
+        "duplicate_of": original["upload_id"],
+        "stage_timings": {},
+        "status_version": 1,
+        "cv_data": original["cv_data"],
     }
-    print(state_input_data)
-    input_str = json.dumps(state_input_data)
+
+
+def register_content_hash(content_hash, upload_id):
+    # Points the hash at the finished upload, also over the claim of another one
+    created_at = int(time.time())
     try:
-        # Start the execution of the state machine
-        response = statemachine_client.start_execution(
-            stateMachineArn=state_machine_arn,
-            input=input_str,
+        table = clients.table(HASH_INDEX_TABLE)
+        table.put_item(
+            Item={
+                "content_hash": content_hash,
+                "upload_id": str(upload_id),
+                "created_at": created_at,
+                "expires_at": created_at + DEDUP_MAX_AGE_SECONDS,  # TTL attribute
+            }
         )
-        print(f"Started state machine execution: {response}")
-        return response
+    except Exception as e:
+        # Not fatal, the next upload of this PDF is simply processed again
+        print(f"Error registering content hash {content_hash}: {e}")
+
+
+def startStateMachineProcessing(
+    oai_file,
+    uploadId,
+    vectorstore,
+    content_hash=None,
+    cached_extraction=None,
+    cache_bust=False,
+):
+    state_input_data = pipeline.extraction_state_input(
+        uploadId, oai_file.id, vectorstore.id, content_hash
+    )
+    if isinstance(vectorstore, vector_store_pool.PooledVectorStore):
+        # saveDataToDatabase hands the store back to the pool when done
+        state_input_data["vector_store_slot"] = vectorstore.slot
+    if cached_extraction is not None:
+        state_input_data = pipeline.correction_state_input(
+            state_input_data, json.dumps(cached_extraction, ensure_ascii=False)
+        )
+    elif EXTRACTION_STREAMING:
+        state_input_data["stream"] = True
+    if cache_bust:
+        state_input_data["cache_bust"] = True
+    try:
+        # Start the execution of the state machine
+        return pipeline.start_execution(state_input_data)
     except Exception as e:
         print(f"Error starting state machine execution: {e}")
         raise e
 
 
-def initialize_database_entry(openai_file, vectorstore, upload_id):
+def initialize_pending_entry(
+    upload_id, content_hash=None, upload_mode="multipart", **attributes
+):
+    table = clients.table("cv_uploads")
+    table.put_item(
+        Item={**pending_entry_item(upload_id, content_hash, upload_mode), **attributes}
+    )
+    return str(upload_id)
+
+
+def pending_entry_item(upload_id, content_hash=None, upload_mode="multipart"):
     print(f"Upload ID: {upload_id}")
     data = {
         "process_status": "in_progress",
         "upload_id": str(upload_id),
-        "vector_store_id": vectorstore.id,
-        "file_id": openai_file.id,
+        "upload_mode": upload_mode,
+        "stage_timings": {},
+        "status_version": 1,
     }
-    database_client = boto3.resource("dynamodb")
-    table = database_client.Table("cv_uploads")
-    try:
-        table.put_item(Item=data)
-    except Exception as e:
-        raise e
-    return str(upload_id)
+    if content_hash:
+        data["content_hash"] = content_hash
+    return data
+
+
+def attach_openai_resources(upload_id, openai_file, vectorstore, content_hash):
+    table = clients.table("cv_uploads")
+    table.update_item(
+        Key={"upload_id": str(upload_id)},
+        UpdateExpression="SET file_id = :fid, vector_store_id = :vid, content_hash = :hash",
+        ExpressionAttributeValues={
+            ":fid": openai_file.id,
+            ":vid": vectorstore.id,
+            ":hash": content_hash,
+        },
+    )
 
 
 def upload_file_to_openai(pdf):
-    client = OpenAI()
+    client = clients.openai()
     try:
         expiration_time = (
             int(time.time()) + 1800
@@ -135,17 +1020,30 @@ def upload_file_to_openai(pdf):
     return file
 
 
-def upload_file_to_openai_v2(pdf, upload_id):
-    client = OpenAI()
+def upload_file_to_openai_v2(pdf, upload_id, timings=None, deadline=None):
+    client = clients.openai(deadline)
+    timings = timings or stage_timings.Recorder(upload_id)
     try:
-        file = client.files.create(
-            file=open("/tmp/temp_cv.pdf", "rb"), purpose="assistants"
-        )
-        vector_store = client.beta.vector_stores.create(
-            name=str(upload_id),
-            file_ids=[file.id],
-            expires_after={"anchor": "last_active_at", "days": 1},
-        )
+        with timings.stage("openai_upload"):
+            file = client.files.create(
+                file=(f"{upload_id}.pdf", io.BytesIO(pdf), "application/pdf"),
+                purpose="assistants",
+            )
+        with timings.stage("vector_store"):
+            vector_store = None
+            if vector_store_pool.enabled():
+                try:
+                    vector_store = vector_store_pool.acquire(
+                        str(upload_id), file.id, deadline
+                    )
+                except vector_store_pool.PoolExhausted as e:
+                    print(f"{e}, creating a vector store for this upload")
+            if vector_store is None:
+                vector_store = client.beta.vector_stores.create(
+                    name=str(upload_id),
+                    file_ids=[file.id],
+                    expires_after={"anchor": "last_active_at", "days": 1},
+                )
         print(vector_store.id)
     except Exception as e:
         raise e
@@ -153,51 +1051,38 @@ def upload_file_to_openai_v2(pdf, upload_id):
     return file, vector_store
 
 
-def upload_pdf_to_s3(pdf_bytesio, bucket_name, object_key):
-    s3_client = boto3.client("s3")
-    s3_client.upload_fileobj(pdf_bytesio, bucket_name, object_key)
+def archive_key(upload_id):
+    return f"{ARCHIVE_PREFIX}{upload_id}"
 
 
-def extract_pdf_from_formdata(body64, content_type, upload_id):
+def upload_pdf_to_s3(pdf, bucket_name, object_key):
+    # The PDF of a multipart upload is a view of the request body, it is sent
+    # from there without a copy
+    if isinstance(pdf, memoryview):
+        pdf = formdata.ViewReader(pdf)
+    clients.s3().put_object(Bucket=bucket_name, Key=object_key, Body=pdf)
+
+
+def extract_pdfs_from_formdata(body64, content_type):
     # Decode Body
     form_data = base64.b64decode(body64)
-    raw_data = form_data.decode("iso-8859-1")
-
-    headers = f"content-type: {content_type}"
-    full_message = headers + "\n\n" + raw_data
-    pdf = io.BytesIO()
-
-    # Use the email parser to parse the multipart data
-    parser = Parser()
-    msg = parser.parsestr(full_message)
-
-    # Initialize an empty bytes object to hold the PDF content
-    pdf_content = b""
-
-    # Iterate through the parts to find the PDF file part
-    if msg.is_multipart():
-        for part in msg.walk():
-            content_disposition = part.get("Content-Disposition", None)
-            if content_disposition and "filename" in content_disposition:
-                # Assuming the part with a filename is your PDF
-                pdf_content = part.get_payload(decode=True)  # decode=True to get bytes
-                break
-
-    # Write the PDF content to a file, if we found any
-    if pdf_content:
-        temp_pdf_path = "/tmp/temp_cv.pdf"
-        with open(temp_pdf_path, "wb") as pdf_file:
-            pdf_file.write(pdf_content)
-        print(f"PDF file extracted and saved to {temp_pdf_path}.")
-        s3_client = boto3.client("s3")
-        s3_client.upload_file(temp_pdf_path, "cv-uploaded-resumes", upload_id)
-        return pdf_content
-    else:
+
+    # Every part carrying a file is a PDF, its content is a view into form_data
+    files = [
+        (part.filename, part.data)
+        for part in formdata.iter_parts(form_data, content_type)
+        if part.filename is not None and len(part.data) > 0
+    ]
+    if not files:
         print("No PDF file found in the multipart data.")
         raise Exception("No PDF in Request")
+    print(
+        f"Extracted {len(files)} PDF file(s) ({sum(len(f[1]) for f in files)} bytes)."
+    )
+    return files
 
 
-def generate_response(statusCode, body):
+def generate_response(statusCode, body, headers=None):
     return {
         "statusCode": statusCode,
         "body": json.dumps(body),
@@ -205,6 +1090,8 @@ def generate_response(statusCode, body):
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Credentials": True,
             "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token, debug_mode",
+            "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token, debug_mode, force_reextract, cache_bust",
+            "Access-Control-Expose-Headers": "Retry-After",
+            **(headers or {}),
         },
     }
@@ -0,0 +1,151 @@
+import concurrent.futures
+import copy
+import math
+import os
+from cvision_runtime import resume_schema
+import text_extraction
+
+# Long CVs are split into groups of consecutive pages and every group is
+# extracted from its text with one completion, all groups at once. The partial
+# resumes are merged in page order, so the result doesn't depend on which
+# completion finished first. Groups have GROUP_PAGES pages, CVs with more
+# than MAX_WORKERS groups get larger ones so no group waits for a worker.
+MIN_PAGES = int(os.environ.get("PAGE_PARALLEL_MIN_PAGES", 8))  # 0 disables it
+GROUP_PAGES = int(os.environ.get("PAGE_PARALLEL_GROUP_PAGES", 3))
+MAX_WORKERS = int(os.environ.get("PAGE_PARALLEL_MAX_WORKERS", 7))
+
+# List sections are concatenated in page order. Entries with the same values
+# in these fields describe the same position, degree or certificate, an
+# entry cut by a page break shows up in two groups and is kept once.
+DEDUPE_FIELDS = {
+    "Working Experience": ("Title", "Company", "Start Date"),
+    "Education": ("Diploma", "Institution", "Start Date"),
+    "Certificates": ("Title", "Institution", "Start Date"),
+}
+# Taken from the first page group, later pages only mention the candidate
+FIRST_GROUP_SECTIONS = ("Personal Information",)
+
+
+def split(page_texts, group_pages=None):
+    """Return the (first page index, texts) of every page group."""
+    group_pages = max(
+        1, group_pages or GROUP_PAGES, math.ceil(len(page_texts) / MAX_WORKERS)
+    )
+    return [
+        (start, page_texts[start : start + group_pages])
+        for start in range(0, len(page_texts), group_pages)
+    ]
+
+
+def use_page_groups(page_texts):
+    if not MIN_PAGES or page_texts is None or len(page_texts) < MIN_PAGES:
+        return False
+    if len("".join(page_texts).strip()) < text_extraction.DIRECT_TEXT_MIN_CHARS:
+        return False  # Probably a scanned CV without a text layer
+    return all(
+        text_extraction.estimate_tokens("\n".join(texts))
+        <= text_extraction.DIRECT_TEXT_MAX_TOKENS
+        for _, texts in split(page_texts)
+    )
+
+
+def extract_resume(page_texts, deadline=None):
+    """Extract the page groups concurrently, returns the merged resume.
+
+    All completions end by one deadline like extract_resume_from_text.
+    Raises the error of the first failed group.
+    """
+    groups = split(page_texts)
+    total = len(page_texts)
+    deadline = deadline or text_extraction.deadline_from_now()
+
+    def extract(group):
+        start, texts = group
+        note = (
+            f"Der Text enthält die Seiten {start + 1} bis {start + len(texts)} "
+            f"von {total} des Lebenslaufs, extrahiere nur die Daten dieser Seiten"
+        )
+        return text_extraction.extract_resume_from_text(
+            "\n".join(texts), note, deadline
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, min(MAX_WORKERS, len(groups)))
+    ) as executor:
+        futures = [executor.submit(extract, group) for group in groups]
+        try:
+            parts = [future.result() for future in futures]
+        except Exception:
+            # The CV falls back to the assistants, groups not started are dropped
+            for future in futures:
+                future.cancel()
+            raise
+    return merge(parts)
+
+
+def merge(parts):
+    """Merge the partial resumes of the page groups, given in page order.
+
+    List sections are concatenated and deduplicated, the other sections come
+    from the first group that filled them, FIRST_GROUP_SECTIONS from the
+    first group.
+    """
+    merged = copy.deepcopy(parts[0])
+    for section, template in resume_schema.RESUME_TEMPLATE.items():
+        if section in FIRST_GROUP_SECTIONS:
+            continue
+        values = [part.get(section) for part in parts]
+        if isinstance(template, list):
+            entries = merge_entries(section, values)
+            if entries:
+                merged[section] = entries
+        else:
+            filled = [v for v in values if resume_schema.has_content(v)]
+            if filled:
+                merged[section] = copy.deepcopy(filled[0])
+    return merged
+
+
+def merge_entries(section, values):
+    entries = []
+    positions = {}  # dedupe key -> index in entries
+    for value in values:
+        for entry in value if isinstance(value, list) else []:
+            if not resume_schema.has_content(entry):
+                continue
+            key = dedupe_key(section, entry)
+            if key not in positions:
+                positions[key] = len(entries)
+                entries.append(copy.deepcopy(entry))
+            elif content_length(entry) > content_length(entries[positions[key]]):
+                # Keep the more complete half of an entry cut by a page break
+                entries[positions[key]] = copy.deepcopy(entry)
+    return entries
+
+
+def dedupe_key(section, entry):
+    fields = DEDUPE_FIELDS.get(section)
+    if fields and isinstance(entry, dict):
+        key = tuple(normalize(entry.get(field)) for field in fields)
+        if any(key):
+            return key
+    return normalize(entry)
+
+
+def normalize(value):
+    # Hashable form of a value ignoring case and whitespace differences
+    if isinstance(value, dict):
+        return tuple(sorted((k, normalize(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(normalize(v) for v in value)
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    return value
+
+
+def content_length(value):
+    if isinstance(value, dict):
+        return sum(content_length(v) for v in value.values())
+    if isinstance(value, list):
+        return sum(content_length(v) for v in value)
+    return len(value.strip()) if isinstance(value, str) else 0
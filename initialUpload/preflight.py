@@ -0,0 +1,73 @@
+import os
+import re
+from cvision_runtime import metrics
+
+try:
+    import fitz
+except ImportError:  # Without PyMuPDF only the byte level checks are done
+    fitz = None
+
+# Cheap checks rejecting PDFs we can't process before any paid or network call
+MAX_PDF_BYTES = int(os.environ.get("PREFLIGHT_MAX_PDF_BYTES", 20 * 1024 * 1024))
+MAX_PDF_PAGES = int(os.environ.get("PREFLIGHT_MAX_PDF_PAGES", 20))
+REQUIRE_TEXT = os.environ.get("PREFLIGHT_REQUIRE_TEXT", "true").lower() == "true"
+
+_PAGE_PATTERN = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+
+# Rejected PDFs per reason
+REJECTION_COUNTS = metrics.counter("preflight_rejection")
+
+
+class PreflightError(Exception):
+    def __init__(self, status_code, reason, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.reason = reason
+
+
+def reject(status_code, reason, message):
+    metrics.count("preflight_rejection", reason)
+    raise PreflightError(status_code, reason, message)
+
+
+def check_pdf(pdf):
+    """Validate the PDF bytes, raises PreflightError for unusable PDFs.
+
+    Returns the text of every page, or None if PyMuPDF is not available.
+    """
+    if len(pdf) > MAX_PDF_BYTES:
+        reject(413, "too_large", f"The PDF is larger than {MAX_PDF_BYTES} bytes")
+    if bytes(pdf[:1024]).find(b"%PDF-") == -1:
+        reject(415, "not_a_pdf", "The file is not a PDF")
+    if bytes(pdf[-2048:]).find(b"%%EOF") == -1:
+        reject(400, "truncated", "The PDF is truncated, no end of file marker found")
+    if fitz is None:
+        return _check_raw_pdf(pdf)
+
+    try:
+        doc = fitz.open(stream=pdf, filetype="pdf")
+    except Exception as e:
+        reject(400, "corrupt", f"The PDF can't be read: {e}")
+    with doc:
+        # PDFs with only an owner password open without one and are processed
+        if doc.needs_pass:
+            reject(422, "encrypted", "The PDF is protected with a password")
+        if doc.page_count > MAX_PDF_PAGES:
+            reject(
+                413, "too_many_pages", f"The PDF has more than {MAX_PDF_PAGES} pages"
+            )
+        page_texts = [page.get_text() for page in doc]
+    if REQUIRE_TEXT and not any(text.strip() for text in page_texts):
+        reject(422, "no_text", "The PDF contains no text, it is probably scanned")
+    return page_texts
+
+
+def _check_raw_pdf(pdf):
+    # Byte level approximation of the checks above. Whether an encrypted PDF
+    # needs a password can't be told from the bytes, those fail in the extraction
+    data = bytes(pdf)
+    if len(_PAGE_PATTERN.findall(data)) > MAX_PDF_PAGES:
+        reject(413, "too_many_pages", f"The PDF has more than {MAX_PDF_PAGES} pages")
+    if REQUIRE_TEXT and b"/Font" not in data:
+        reject(422, "no_text", "The PDF contains no text, it is probably scanned")
+    return None
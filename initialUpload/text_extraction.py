@@ -0,0 +1,87 @@
+import json
+import os
+import time
+from cvision_runtime import clients
+from cvision_runtime import resume_schema
+
+try:
+    import fitz
+except ImportError:  # Without PyMuPDF every CV goes through the assistant path
+    fitz = None
+
+# Short CVs are extracted from their local text with one completion, longer
+# ones still go through the vector store and the assistants.
+DIRECT_TEXT_MODEL = os.environ.get("DIRECT_TEXT_MODEL", "gpt-4o")
+DIRECT_TEXT_MAX_PAGES = int(os.environ.get("DIRECT_TEXT_MAX_PAGES", 4))
+DIRECT_TEXT_MAX_TOKENS = int(os.environ.get("DIRECT_TEXT_MAX_TOKENS", 12000))
+DIRECT_TEXT_MIN_CHARS = int(os.environ.get("DIRECT_TEXT_MIN_CHARS", 200))
+# Seconds from the upload request to the end of its completions. API Gateway
+# answers 29 seconds after the request, a CV over the deadline still needs the
+# time to fall back to the assistants. The completions of one CV share it and
+# are not retried.
+DIRECT_TEXT_DEADLINE_SECONDS = float(os.environ.get("DIRECT_TEXT_DEADLINE_SECONDS", 18))
+
+SYSTEM_PROMPT = (
+    "Du extrahierst die Daten aus Lebensläufen. Antworte ausschließlich mit "
+    "dem JSON im vorgegebenen Schema. Felder, die im Lebenslauf nicht vorkommen, "
+    "bleiben leere Strings oder leere Listen."
+)
+
+
+def pdf_page_texts(pdf):
+    """Return the text of every page of the PDF, or None if it can't be read."""
+    if fitz is None:
+        return None
+    try:
+        with fitz.open(stream=pdf, filetype="pdf") as doc:
+            return [page.get_text() for page in doc]
+    except Exception as e:
+        print(f"Error reading the PDF text: {e}")
+        return None
+
+
+def estimate_tokens(text):
+    # Rough estimate, about four characters per token
+    return len(text) // 4
+
+
+def use_direct_text(page_texts):
+    if page_texts is None or len(page_texts) > DIRECT_TEXT_MAX_PAGES:
+        return False
+    text = "\n".join(page_texts)
+    if len(text.strip()) < DIRECT_TEXT_MIN_CHARS:
+        return False  # Probably a scanned CV without a text layer
+    return estimate_tokens(text) <= DIRECT_TEXT_MAX_TOKENS
+
+
+def deadline_from_now():
+    return time.monotonic() + DIRECT_TEXT_DEADLINE_SECONDS
+
+
+def extract_resume_from_text(text, note=None, deadline=None):
+    """Extract the resume data from the CV text with one structured completion.
+
+    note is added to the instruction, e.g. which pages of the CV text holds.
+    The completion is cancelled at deadline (time.monotonic()), by default
+    DIRECT_TEXT_DEADLINE_SECONDS from now.
+    """
+    instruction = "Im Folgenden befindet sich der Text des Lebenslaufs aus dem du die Daten extrahieren sollst"
+    if note:
+        instruction += f". {note}"
+    # The timeout is the time left after the wait for a rate limit token
+    client = clients.openai(deadline or deadline_from_now())
+    completion = client.chat.completions.create(
+        model=DIRECT_TEXT_MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": f"{instruction}:\n\n{text}",
+            },
+        ],
+        response_format=resume_schema.response_format(),
+    )
+    message = completion.choices[0].message
+    if message.refusal:
+        raise Exception(f"Extraction refused: {message.refusal}")
+    return json.loads(message.content)
@@ -0,0 +1 @@
+"""Code shared by the cvision lambda functions, deployed as a Lambda layer."""
@@ -0,0 +1,49 @@
+import json
+from cvision_runtime import metrics
+
+# Reading the JSON answers of the assistants. With schema-constrained output
+# the answer is the bare object, older assistants wrap it in a ```json fence
+# or some text. The object is located and decoded in one pass, its content is
+# never modified.
+
+_decoder = json.JSONDecoder()
+
+# Parsed answers per outcome
+PARSE_COUNTS = metrics.counter("json_answer")
+
+
+class AnswerError(ValueError):
+    pass
+
+
+def latest_answer(messages):
+    """Return the text of the newest assistant message of a message list page."""
+    for message in messages.data:  # Newest first
+        if message.role == "assistant":
+            return "".join(
+                content.text.value
+                for content in message.content
+                if content.type == "text"
+            )
+    raise AnswerError("The thread has no assistant message")
+
+
+def parse_json(text):
+    """Return the first JSON object in text, raises AnswerError if there is none."""
+    start = text.find("{")
+    while start != -1:
+        try:
+            value, _ = _decoder.raw_decode(text, start)
+        except ValueError:
+            start = text.find("{", start + 1)
+            continue
+        outcome = "bare" if start == 0 else "embedded"
+        metrics.count("json_answer", outcome)
+        return value
+    metrics.count("json_answer", "failed")
+    raise AnswerError("No JSON object found in the answer")
+
+
+def retrieve_json_answer(messages):
+    """Return the parsed JSON object of the newest assistant message."""
+    return parse_json(latest_answer(messages).strip())
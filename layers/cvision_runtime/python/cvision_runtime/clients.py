@@ -0,0 +1,253 @@
+import functools
+import json
+import os
+import threading
+
+# Clients are created lazily once per container and reused by every warm
+# invocation, so TLS handshakes and credential resolution are off the hot path.
+# boto3 clients are thread-safe and shared by all threads. boto3 resources are
+# not, the DynamoDB resource and its Table objects exist once per thread.
+
+AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", 32))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 32))
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", 2))
+
+_lock = threading.RLock()  # Factories may request other pooled clients
+_clients = {}
+_thread_clients = threading.local()
+_stats = {"created": {}, "reused": {}, "invocations": 0, "warm_invocations": 0}
+
+
+def _get(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+                _count_created(name)
+    return client
+
+
+def _get_per_thread(name, factory):
+    # Installed clients (local fakes) are shared by all threads
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    pool = _thread_pool()
+    client = pool.get(name)
+    if client is None:
+        with _lock:  # The shared boto3 session isn't thread-safe either
+            client = factory()
+            _count_created(name)
+        pool[name] = client
+    return client
+
+
+def _thread_pool():
+    if not hasattr(_thread_clients, "pool"):
+        _thread_clients.pool = {}
+    return _thread_clients.pool
+
+
+def _count_created(name):
+    _stats["created"][name] = _stats["created"].get(name, 0) + 1
+
+
+def _session():
+    def factory():
+        import boto3
+
+        return boto3.session.Session()
+
+    return _get("boto3_session", factory)
+
+
+def _aws_config():
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        retries={"mode": "standard"},
+    )
+
+
+def aws_client(service_name):
+    """Return the pooled boto3 client of a service."""
+
+    def factory():
+        import boto3
+
+        return boto3.client(service_name, config=_aws_config())
+
+    return _get(service_name, factory)
+
+
+def s3():
+    return aws_client("s3")
+
+
+def stepfunctions():
+    return aws_client("stepfunctions")
+
+
+def sqs():
+    return aws_client("sqs")
+
+
+def lambda_client():
+    return aws_client("lambda")
+
+
+def websocket_api(endpoint_url):
+    """Return the pooled API Gateway management client of a WebSocket API stage.
+
+    endpoint_url is https://{api id}.execute-api.{region}.amazonaws.com/{stage}.
+    """
+
+    def factory():
+        import boto3
+
+        return boto3.client(
+            "apigatewaymanagementapi", endpoint_url=endpoint_url, config=_aws_config()
+        )
+
+    return _get(f"websocket:{endpoint_url}", factory)
+
+
+def dynamodb():
+    """Return the DynamoDB service resource of the calling thread."""
+    return _get_per_thread(
+        "dynamodb_resource",
+        lambda: _session().resource("dynamodb", config=_aws_config()),
+    )
+
+
+def table(table_name):
+    """Return the DynamoDB Table resource of table_name of the calling thread."""
+    return _get_per_thread(f"table:{table_name}", lambda: dynamodb().Table(table_name))
+
+
+def openai(deadline=None):
+    """Return the pooled OpenAI client with keep-alive connections.
+
+    With the rate limiter enabled every request waits for a token of the
+    shared rate_limit.openai_bucket first. With a deadline (time.monotonic())
+    requests are not retried and end by the deadline, including the wait for
+    the token.
+    """
+    from cvision_runtime import rate_limit
+
+    def factory():
+        from openai import DefaultHttpxClient, OpenAI
+        import httpx
+
+        return OpenAI(
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=DefaultHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                )
+            ),
+        )
+
+    client = _get("openai", factory)
+    bucket = rate_limit.openai_bucket if rate_limit.enabled() else None
+    if deadline is not None:
+        client = client.with_options(max_retries=0)
+        return rate_limit.LimitedClient(client, bucket, deadline=deadline)
+    if bucket is not None:
+        return rate_limit.LimitedClient(client, bucket)
+    return client
+
+
+def async_openai():
+    """Return the pooled AsyncOpenAI client of the run orchestrator.
+
+    Its connections belong to the event loop of their first request, callers
+    keep one loop per container instead of asyncio.run per invocation.
+    """
+    from cvision_runtime import rate_limit
+
+    def factory():
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        import httpx
+
+        return AsyncOpenAI(
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                )
+            ),
+        )
+
+    client = _get("async_openai", factory)
+    if rate_limit.enabled():
+        return rate_limit.LimitedClient(
+            client, rate_limit.openai_bucket, asynchronous=True
+        )
+    return client
+
+
+def install(name, client):
+    """Put a client into the pool, used to run the handlers against local fakes.
+
+    name is the pool key: the service name of an aws_client, "dynamodb_resource",
+    "table:<table name>", "websocket:<endpoint url>", "openai" or
+    "async_openai". Installed clients are shared by all threads.
+    """
+    with _lock:
+        _clients[name] = client
+
+
+def reset():
+    """Drop all pooled clients and counters."""
+    with _lock:
+        _clients.clear()
+        _thread_pool().clear()
+        _stats.update(created={}, reused={}, invocations=0, warm_invocations=0)
+
+
+def stats():
+    """Return a copy of the client pool counters."""
+    with _lock:
+        return {
+            "created": dict(_stats["created"]),
+            "reused": dict(_stats["reused"]),
+            "invocations": _stats["invocations"],
+            "warm_invocations": _stats["warm_invocations"],
+        }
+
+
+def track_invocation(handler):
+    """Decorator for lambda handlers counting invocations that found warm clients.
+
+    reused counts per client the invocations that started with it pooled.
+    """
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        with _lock:
+            _stats["invocations"] += 1
+            warm = set(_clients) | set(_thread_pool())
+            if warm:
+                _stats["warm_invocations"] += 1
+            for name in warm:
+                _stats["reused"][name] = _stats["reused"].get(name, 0) + 1
+        try:
+            return handler(event, context)
+        finally:
+            print(json.dumps({"metric": "client_pool", **stats()}))
+
+    return wrapper
+
+
+def is_conditional_check_failed(error):
+    """Return True if a DynamoDB write failed because of its ConditionExpression."""
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") == "ConditionalCheckFailedException"
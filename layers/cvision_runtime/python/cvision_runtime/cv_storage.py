@@ -0,0 +1,48 @@
+import decimal
+import gzip
+import json
+import os
+
+# Storage format of cv_data in cv_uploads. A native DynamoDB map is charged
+# for every attribute name of every entry, large CVs come close to the 400 KB
+# item limit and every status read pays for the whole item. cv_data is
+# written as a binary attribute instead: one format byte, then the compressed
+# compact JSON of the resume. Items written as a map still read.
+#
+# gzip is in the standard library of the Lambda runtime, other codecs get the
+# next format byte.
+GZIP_JSON = 1
+
+# "gzip" writes the binary format, "map" the native map like before, e.g.
+# while checkUploadStatus still runs a layer version without this module
+STORAGE = os.environ.get("CV_DATA_STORAGE", "gzip")
+COMPRESS_LEVEL = int(os.environ.get("CV_DATA_COMPRESS_LEVEL", 6))
+
+
+def encode(cv_data):
+    """Return the value of the cv_data attribute for a resume."""
+    if STORAGE == "map":
+        return cv_data
+    text = json.dumps(
+        cv_data, ensure_ascii=False, separators=(",", ":"), default=_number
+    )
+    return bytes([GZIP_JSON]) + gzip.compress(
+        text.encode(), compresslevel=COMPRESS_LEVEL, mtime=0
+    )
+
+
+def decode(value):
+    """Return the resume of a cv_data attribute in either format."""
+    value = getattr(value, "value", value)  # boto3.dynamodb.types.Binary
+    if not isinstance(value, (bytes, bytearray)):
+        return value
+    if value[:1] == bytes([GZIP_JSON]):
+        return json.loads(gzip.decompress(value[1:]))
+    raise ValueError(f"Unknown cv_data format {value[:1].hex()}")
+
+
+def _number(value):
+    # Resumes from the result cache come back from DynamoDB with Decimals
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
@@ -0,0 +1,31 @@
+import collections
+import json
+import threading
+
+# Outcome counters of the lambdas, kept for the lifetime of the container.
+# Every count is logged as one line of the same format
+#
+#   {"metric": name, "outcome": outcome, ...fields, "counts": {outcome: n}}
+#
+# with the counts of every outcome of the metric in this container so far.
+
+_counters = collections.defaultdict(collections.Counter)
+_lock = threading.Lock()
+
+
+def counter(name):
+    """Return the counter of the outcomes of metric name."""
+    return _counters[name]
+
+
+def count(name, outcome, amount=1, log=True, **fields):
+    """Add amount to the outcome of metric name and log the metric line."""
+    with _lock:
+        counts = _counters[name]
+        counts[outcome] += amount
+        counts = dict(counts)
+    if log:
+        print(
+            json.dumps({"metric": name, "outcome": outcome, **fields, "counts": counts})
+        )
+    return counts
@@ -0,0 +1,144 @@
+import decimal
+import hashlib
+import json
+import os
+from cvision_runtime import clients
+from cvision_runtime import metrics
+from cvision_runtime import resume_schema
+from cvision_runtime import uploads
+
+# The assistant pipeline: the state machine runs the extraction assistant,
+# startOutputCorrection decides whether the correction assistant runs as well
+# and saveDataToDatabase stores its result.
+
+STATE_MACHINE_ARN = (
+    "arn:aws:states:eu-central-1:891376982948:stateMachine:MyStateMachine-h1zdun91x"
+)
+EXTRACTION_ASSISTANT_ID = "asst_ab8KCfa3TRFd5MbN0iGXs9bj"
+CORRECTION_ASSISTANT_ID = "asst_uPkzE0iGVonUn6cWg3uzlCQr"
+
+EXTRACTION_PROMPT = "In der PDF-Datei {file_id} befindet sich der Lebenslauf aus dem du die Daten extrahieren sollst"
+CORRECTION_PROMPT = "In der PDF-Datei {file_id} befindet sich der Lebenslauf eines Bewerbers. Im Folgenden ist der JSON-Output des Lebenslaufs dargestellt. Korrigiere den JSON-Output.\n{extraction}"
+
+# The instructions of the assistants live in OpenAI, bump these after
+# changing them so that cached results of the old instructions aren't used
+EXTRACTION_PROMPT_VERSION = os.environ.get("EXTRACTION_PROMPT_VERSION", "1")
+CORRECTION_PROMPT_VERSION = os.environ.get("CORRECTION_PROMPT_VERSION", "1")
+
+# "stepfunctions" starts a state machine execution per run, "orchestrator"
+# sends the state input to the queue of runOrchestrator instead, which drives
+# the runs of many uploads at once
+ORCHESTRATION = os.environ.get("ORCHESTRATION", "stepfunctions")
+ORCHESTRATOR_QUEUE_URL = os.environ.get("ORCHESTRATOR_QUEUE_URL", "")
+
+# Extractions validated with at least this confidence are saved right away
+# without the correction run, a value above 1 always runs the correction
+CORRECTION_SKIP_THRESHOLD = float(os.environ.get("CORRECTION_SKIP_THRESHOLD", 0.9))
+
+# Skipped and corrected extractions
+GATE_COUNTS = metrics.counter("correction_gate")
+
+
+def prompt_version(mode):
+    """Return the version of everything producing the result of mode.
+
+    Covers the prompt templates, the assistant instruction versions and the
+    response schema. The correction result depends on the extraction, so its
+    version includes the extraction version.
+    """
+    parts = [
+        EXTRACTION_PROMPT_VERSION,
+        EXTRACTION_PROMPT,
+        json.dumps(resume_schema.response_format(), sort_keys=True),
+    ]
+    if mode == "correction":
+        parts += [CORRECTION_PROMPT_VERSION, CORRECTION_PROMPT]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:16]
+
+
+def extraction_state_input(upload_id, file_id, vectorstore_id, content_hash=None):
+    return {
+        "upload_id": upload_id,
+        "assistant_id": EXTRACTION_ASSISTANT_ID,
+        "file_id": file_id,
+        "vectorstore_ids": [vectorstore_id],
+        "file_ids": [file_id],
+        "prompt": EXTRACTION_PROMPT.format(file_id=file_id),
+        "mode": "extraction",
+        "content_hash": content_hash,
+        # Schema-constrained output, the state machine passes it to the run
+        "response_format": resume_schema.response_format(),
+    }
+
+
+def correction_state_input(event, extraction):
+    """Return the state input correcting extraction, the raw answer or its JSON."""
+    file_id = event["file_id"]
+    state_input = {
+        "upload_id": event["upload_id"],
+        "assistant_id": CORRECTION_ASSISTANT_ID,
+        "file_id": file_id,
+        "file_ids": [file_id],
+        "vectorstore_ids": event["vectorstore_ids"],
+        "prompt": CORRECTION_PROMPT.format(file_id=file_id, extraction=extraction),
+        "mode": "correction",
+        "content_hash": event.get("content_hash"),
+        "response_format": resume_schema.response_format(),
+    }
+    for name in ("vector_store_slot", "cache_bust"):
+        if event.get(name) is not None:
+            state_input[name] = event[name]
+    return state_input
+
+
+def start_execution(state_input):
+    print(state_input)
+    if ORCHESTRATION == "orchestrator":
+        response = clients.sqs().send_message(
+            QueueUrl=ORCHESTRATOR_QUEUE_URL, MessageBody=json.dumps(state_input)
+        )
+        print(f"Queued run for the orchestrator: {response}")
+        return response
+    response = clients.stepfunctions().start_execution(
+        stateMachineArn=STATE_MACHINE_ARN,
+        input=json.dumps(state_input),
+    )
+    print(f"Started state machine execution: {response}")
+    return response
+
+
+def check_extraction(upload_id, cv_data):
+    """Validate the extraction, returns (cv_data, validation).
+
+    cv_data is None if the extraction needs the correction run.
+    """
+    validation = resume_schema.validate(cv_data)
+    skip = validation.confidence >= CORRECTION_SKIP_THRESHOLD
+    metrics.count(
+        "correction_gate",
+        "skipped" if skip else "corrected",
+        upload_id=upload_id,
+        confidence=validation.confidence,
+        threshold=CORRECTION_SKIP_THRESHOLD,
+        issues=validation.kinds(),
+    )
+    return (cv_data if skip else None), validation
+
+
+def save_without_correction(event, cv_data, validation, timings):
+    # Returns False if the data couldn't be saved, the correction run saves it then
+    upload_id = event["upload_id"]
+    try:
+        with timings.stage("db_save"):
+            uploads.save_cv_data(
+                upload_id,
+                cv_data,
+                correction_skipped=True,
+                extraction_confidence=decimal.Decimal(str(validation.confidence)),
+            )
+    except Exception as e:
+        print(f"Error saving the extraction of {upload_id}: {e}")
+        return False
+    timings.record()
+    uploads.release_vector_store(event)
+    return True
@@ -0,0 +1,207 @@
+import asyncio
+import decimal
+import os
+import random
+import time
+from cvision_runtime import clients
+from cvision_runtime import metrics
+
+# Token bucket shared by all containers, so bursts of uploads and executions
+# stay below the OpenAI rate limit instead of failing with 429s. The state
+# lives in DynamoDB, one item per bucket:
+# {"bucket": "openai", "tokens": 12.5, "updated_at": epoch ms, "version": 7}
+# The bucket refills at rpm / 60 tokens per second up to burst tokens. Every
+# request takes one token, writes are conditional on the version that was
+# read so concurrent callers never spend the same token twice.
+
+LIMIT_TABLE = os.environ.get("RATE_LIMIT_TABLE", "cv_rate_limits")
+OPENAI_RPM = int(os.environ.get("OPENAI_RATE_LIMIT_RPM", 0))  # 0 disables the limiter
+OPENAI_BURST = int(os.environ.get("OPENAI_RATE_LIMIT_BURST", max(1, OPENAI_RPM // 6)))
+# Longest wait for a token inside one invocation, RateLimited is raised after
+MAX_WAIT_SECONDS = float(os.environ.get("RATE_LIMIT_MAX_WAIT_SECONDS", 10))
+
+# Immediate, delayed and rejected requests
+WAIT_COUNTS = metrics.counter("rate_limit")
+
+
+class RateLimited(Exception):
+    """No token within the maximum wait, the caller should retry later."""
+
+    def __init__(self, bucket, retry_after):
+        super().__init__(
+            f"Rate limit of {bucket} exceeded, retry after {retry_after:.1f}s"
+        )
+        self.retry_after = retry_after
+
+
+class DeadlinePassed(TimeoutError):
+    """The deadline of a request passed before it was sent, e.g. waiting for a token."""
+
+
+def is_rate_limited(error):
+    """Return True for RateLimited and 429 responses of the OpenAI API."""
+    return isinstance(error, RateLimited) or getattr(error, "status_code", None) == 429
+
+
+class Bucket:
+    def __init__(self, name, rpm, burst, table_name=LIMIT_TABLE):
+        self.name = name
+        self.rate = rpm / 60  # Tokens per second
+        self.burst = burst
+        self.table_name = table_name
+
+    def acquire(self, max_wait=MAX_WAIT_SECONDS, deadline=None):
+        """Take one token, waiting for the refill. Returns the seconds waited.
+
+        Raises RateLimited if the token isn't there within max_wait seconds,
+        or before deadline (time.monotonic()) if one is given.
+        """
+        if deadline is not None:
+            max_wait = min(max_wait, deadline - time.monotonic())
+        table = clients.table(self.table_name)
+        waited = 0.0
+        while True:
+            item = table.get_item(Key={"bucket": self.name}, ConsistentRead=True).get(
+                "Item"
+            )
+            # In the stored milliseconds and never before the last update, the
+            # refill would be counted twice otherwise
+            now = int(time.time() * 1000)
+            if item is not None:
+                now = max(now, int(item["updated_at"]))
+            tokens = self._tokens(item, now)
+            if tokens >= 1:
+                if self._take(table, item, tokens - 1, now):
+                    self._log("delayed" if waited else "immediate", waited)
+                    return waited
+                # Another caller changed the bucket in between, read it again
+                time.sleep(random.uniform(0, 0.01))
+                continue
+            delay = (1 - tokens) / self.rate + 0.001
+            if waited + delay > max_wait:
+                self._log("rejected", waited)
+                raise RateLimited(self.name, delay)
+            # Jitter spreads the waiting callers over the refilled tokens
+            delay *= random.uniform(1, 1.5)
+            time.sleep(delay)
+            waited += delay
+
+    def _tokens(self, item, now):
+        if item is None:
+            return self.burst
+        elapsed = (now - int(item["updated_at"])) / 1000
+        return min(self.burst, float(item["tokens"]) + elapsed * self.rate)
+
+    def _take(self, table, item, tokens, now):
+        # Returns False if the bucket changed since item was read
+        names = {"#version": "version"}
+        values = {
+            ":tokens": decimal.Decimal(str(round(tokens, 3))),
+            ":now": now,
+            ":zero": 0,
+            ":one": 1,
+        }
+        if item is None:
+            condition = "attribute_not_exists(#bucket)"
+            names["#bucket"] = "bucket"
+        else:
+            condition = "#version = :version"
+            values[":version"] = item["version"]
+        try:
+            table.update_item(
+                Key={"bucket": self.name},
+                UpdateExpression="SET tokens = :tokens, updated_at = :now, #version = if_not_exists(#version, :zero) + :one",
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+            )
+        except Exception as e:
+            if clients.is_conditional_check_failed(e):
+                return False
+            raise
+        return True
+
+    def _log(self, outcome, waited):
+        metrics.count(
+            "rate_limit",
+            outcome,
+            log=outcome != "immediate",
+            bucket=self.name,
+            waited_ms=int(waited * 1000),
+        )
+
+
+class LimitedClient:
+    """Proxy of a client or one of its resources taking a token before every request.
+
+    With asynchronous set the proxied client is an AsyncOpenAI client, its
+    requests wait for the token in a worker thread instead of blocking the
+    event loop. With a deadline (time.monotonic()) the token is only waited
+    for until the deadline and the request gets the time left after it as
+    timeout. bucket None sets only the timeouts.
+    """
+
+    __slots__ = ("_target", "_bucket", "_asynchronous", "_deadline")
+
+    # Methods returning a configured copy of the client instead of sending a request
+    CLIENT_METHODS = ("with_options", "copy")
+
+    def __init__(self, target, bucket, asynchronous=False, deadline=None):
+        self._target = target
+        self._bucket = bucket
+        self._asynchronous = asynchronous
+        self._deadline = deadline
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if isinstance(value, (str, bytes, int, float, bool, dict, list, tuple)):
+            return value
+        if value is None:
+            return None
+        bucket = self._bucket
+        asynchronous = self._asynchronous
+        deadline = self._deadline
+        if not callable(value):
+            return LimitedClient(value, bucket, asynchronous, deadline)
+        if name in self.CLIENT_METHODS:
+            return lambda *args, **kwargs: LimitedClient(
+                value(*args, **kwargs), bucket, asynchronous, deadline
+            )
+
+        def take_token(kwargs):
+            if deadline is not None:
+                seconds_left(deadline)  # No token is spent after the deadline
+            if bucket is not None:
+                bucket.acquire(deadline=deadline)
+            if deadline is not None:
+                # Only the time left after the wait for the token
+                kwargs["timeout"] = seconds_left(deadline)
+
+        if asynchronous:
+
+            async def async_request(*args, **kwargs):
+                await asyncio.to_thread(take_token, kwargs)
+                return await value(*args, **kwargs)
+
+            return async_request
+
+        def request(*args, **kwargs):
+            take_token(kwargs)
+            return value(*args, **kwargs)
+
+        return request
+
+
+def seconds_left(deadline):
+    """Return the seconds until deadline, raises TimeoutError if it passed."""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlinePassed("The request deadline passed")
+    return remaining
+
+
+openai_bucket = Bucket("openai", OPENAI_RPM, OPENAI_BURST)
+
+
+def enabled():
+    return OPENAI_RPM > 0
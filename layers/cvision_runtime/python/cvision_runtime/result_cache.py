@@ -0,0 +1,95 @@
+import os
+import time
+from cvision_runtime import clients
+from cvision_runtime import metrics
+from cvision_runtime import pipeline
+
+# Results of the assistant runs keyed by what produced them: the SHA-256 of
+# the PDF, the assistant, the mode (extraction or correction) and the prompt
+# version. Identical CVs uploaded again, also after a prompt change of the
+# other assistant, skip the runs whose inputs are unchanged. One item per
+# result: {"cache_key": ..., "result": {...}, "expires_at": epoch seconds},
+# DynamoDB TTL on expires_at evicts the old results.
+
+CACHE_TABLE = os.environ.get("RESULT_CACHE_TABLE", "cv_result_cache")
+TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "true").lower() == "true"
+
+ASSISTANTS = {
+    "extraction": pipeline.EXTRACTION_ASSISTANT_ID,
+    "correction": pipeline.CORRECTION_ASSISTANT_ID,
+}
+
+# Hits and misses per mode
+COUNTS = metrics.counter("result_cache")
+
+
+def cache_key(content_hash, assistant_id, mode):
+    return "#".join((content_hash, assistant_id, mode, pipeline.prompt_version(mode)))
+
+
+def lookup(content_hash, modes=("correction", "extraction")):
+    """Return {mode: result} of the cached results of a PDF.
+
+    All modes are read with one BatchGetItem request. Lookup errors count as
+    misses, the runs produce the result then.
+    """
+    if not ENABLED or not content_hash:
+        return {}
+    keys = {cache_key(content_hash, ASSISTANTS[mode], mode): mode for mode in modes}
+    try:
+        response = clients.dynamodb().batch_get_item(
+            RequestItems={
+                CACHE_TABLE: {
+                    "Keys": [{"cache_key": key} for key in keys],
+                    "ProjectionExpression": "cache_key, #result, expires_at",
+                    "ExpressionAttributeNames": {"#result": "result"},
+                }
+            }
+        )
+        items = response["Responses"].get(CACHE_TABLE, [])
+    except Exception as e:
+        print(f"Error reading the result cache of {content_hash}: {e}")
+        items = []
+    now = time.time()
+    results = {
+        # TTL deletion lags behind, expired items may still be returned
+        keys[item["cache_key"]]: item["result"]
+        for item in items
+        if item["expires_at"] > now
+    }
+    for mode in modes:
+        _count(mode, mode in results, content_hash)
+    return results
+
+
+def store(content_hash, assistant_id, mode, result):
+    """Cache the parsed result of a run, errors are only logged."""
+    if not ENABLED or not content_hash:
+        return
+    now = int(time.time())
+    try:
+        clients.table(CACHE_TABLE).put_item(
+            Item={
+                "cache_key": cache_key(content_hash, assistant_id, mode),
+                "content_hash": content_hash,
+                "assistant_id": assistant_id,
+                "mode": mode,
+                "prompt_version": pipeline.prompt_version(mode),
+                "result": result,
+                "created_at": now,
+                "expires_at": now + TTL_SECONDS,
+            }
+        )
+    except Exception as e:
+        print(f"Error caching the {mode} result of {content_hash}: {e}")
+
+
+def _count(mode, hit, content_hash):
+    metrics.count(
+        "result_cache",
+        f"{mode}_{'hit' if hit else 'miss'}",
+        content_hash=content_hash,
+        mode=mode,
+        hit=hit,
+    )
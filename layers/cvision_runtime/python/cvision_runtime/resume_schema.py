@@ -0,0 +1,215 @@
+import copy
+import re
+
+# Structure of the extracted resume, mirrors emptyTemplates of the frontend
+# TextEditor and the sections rendered by cv_creation's CVBuilder.
+RESUME_TEMPLATE = {
+    "Professional Summary": {
+        "Professional Summary Text": "",
+        "Professional Summary Bullet Points": [""],
+    },
+    "Personal Information": {
+        "Firstname": "",
+        "Surname": "",
+        "Birthday": "",
+        "Nationality": "",
+        "Marital Status": "",
+        "Availability": "",
+        "Current Role": "",
+        "Additional Information": "",
+    },
+    "Contact Information": {
+        "Address": "",
+        "First Phone Number": "",
+        "Second Phone Number": "",
+        "Email": "",
+        "Additional Information": "",
+    },
+    "Languages": [{"Name": "", "Level": ""}],
+    "Working Experience": [
+        {
+            "Title": "",
+            "Location": "",
+            "Description": "",
+            "Bullet Points": [""],
+            "Start Date": "",
+            "End Date": "",
+            "Company": "",
+            "Website": "",
+            "Additional Information": "",
+        }
+    ],
+    "Education": [
+        {
+            "Diploma": "",
+            "Institution": "",
+            "Start Date": "",
+            "End Date": "",
+            "Grade": "",
+            "Location": "",
+            "Website": "",
+            "Description": "",
+            "Bullet Points": [""],
+            "Additional Information": "",
+        }
+    ],
+    "Certificates": [
+        {
+            "Title": "",
+            "Start Date": "",
+            "End Date": "",
+            "Institution": "",
+            "Additional Information": "",
+        }
+    ],
+    "Skills and Competencies": {
+        "Skills": [""],
+        "Programming Languages": [{"Name": "", "Proficiency Level": ""}],
+    },
+    "Software and Technologies": [""],
+    "Hobbies": [""],
+    "Additional Information": [
+        {
+            "Title": "",
+            "Start Date": "",
+            "End Date": "",
+            "Description": "",
+            "Institution": "",
+            "Location": "",
+            "Address": "",
+            "Website": "",
+            "Additional Information": "",
+        }
+    ],
+}
+
+
+def schema_from_template(template):
+    """Build a strict JSON schema (all keys required) from a template value."""
+    if isinstance(template, dict):
+        return {
+            "type": "object",
+            "properties": {
+                key: schema_from_template(value) for key, value in template.items()
+            },
+            "required": list(template),
+            "additionalProperties": False,
+        }
+    if isinstance(template, list):
+        return {"type": "array", "items": schema_from_template(template[0])}
+    return {"type": "string"}
+
+
+RESUME_JSON_SCHEMA = schema_from_template(RESUME_TEMPLATE)
+
+
+def response_format():
+    """Return the response_format for schema-constrained resume output."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "resume",
+            "strict": True,
+            "schema": copy.deepcopy(RESUME_JSON_SCHEMA),
+        },
+    }
+
+
+# Validation of extracted resumes. Every issue lowers the confidence by the
+# weight of its kind, a confidence of 1.0 means no issue was found.
+ISSUE_WEIGHTS = {
+    "not_an_object": 1.0,
+    "missing_key": 0.2,
+    "wrong_type": 0.2,
+    "empty_required": 0.15,
+    "unknown_key": 0.05,
+    "invalid_date": 0.05,
+    "invalid_email": 0.05,
+    "empty_entry": 0.02,
+}
+DATE_FIELDS = ("Start Date", "End Date", "Birthday")
+# Dates as the CVs write them: 2021, 03/2021, 03.2021, 12.03.1990, 2021-03, März 2021
+DATE_PATTERN = re.compile(
+    r"^(\d{1,2}[./-])?(\d{1,2}[./-])?\d{4}$|^\d{4}-\d{2}(-\d{2})?$|^[^\W\d_]+\.? \d{4}$"
+    r"|^(heute|bis heute|today|present|current|aktuell|laufend)$",
+    re.IGNORECASE,
+)
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+# Fields a usable resume can't leave empty
+REQUIRED_VALUES = (
+    ("Personal Information", "Firstname"),
+    ("Personal Information", "Surname"),
+)
+
+
+class Validation:
+    __slots__ = ("issues", "confidence")
+
+    def __init__(self, issues):
+        self.issues = issues  # (kind, path) tuples
+        penalty = sum(ISSUE_WEIGHTS[kind] for kind, _ in issues)
+        self.confidence = round(max(0.0, 1.0 - penalty), 3)
+
+    def kinds(self):
+        return sorted({kind for kind, _ in self.issues})
+
+
+def validate(data):
+    """Check an extracted resume against RESUME_TEMPLATE, returns a Validation.
+
+    Checks required keys, value types, date and email formats, required values
+    and list entries left completely empty.
+    """
+    if not isinstance(data, dict):
+        return Validation([("not_an_object", ())])
+    issues = []
+    _validate_value(data, RESUME_TEMPLATE, (), issues)
+    for path in REQUIRED_VALUES:
+        value = data
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        if isinstance(value, str) and not value.strip():
+            issues.append(("empty_required", path))
+    sections = [data.get("Working Experience"), data.get("Education")]
+    if not any(isinstance(s, list) and has_content(s) for s in sections):
+        issues.append(("empty_required", ("Working Experience",)))
+    return Validation(issues)
+
+
+def _validate_value(value, template, path, issues):
+    if isinstance(template, dict):
+        if not isinstance(value, dict):
+            issues.append(("wrong_type", path))
+            return
+        for key, child in template.items():
+            if key not in value:
+                issues.append(("missing_key", path + (key,)))
+            else:
+                _validate_value(value[key], child, path + (key,), issues)
+        for key in value.keys() - template.keys():
+            issues.append(("unknown_key", path + (key,)))
+    elif isinstance(template, list):
+        if not isinstance(value, list):
+            issues.append(("wrong_type", path))
+            return
+        for index, entry in enumerate(value):
+            _validate_value(entry, template[0], path + (index,), issues)
+            if isinstance(template[0], dict) and len(value) > 1:
+                if not has_content(entry):
+                    issues.append(("empty_entry", path + (index,)))
+    elif not isinstance(value, str):
+        issues.append(("wrong_type", path))
+    elif value.strip():
+        if path[-1] in DATE_FIELDS and not DATE_PATTERN.match(value.strip()):
+            issues.append(("invalid_date", path))
+        elif path[-1] == "Email" and not EMAIL_PATTERN.match(value.strip()):
+            issues.append(("invalid_email", path))
+
+
+def has_content(value):
+    """Return True if value contains a non-blank string anywhere."""
+    if isinstance(value, dict):
+        return any(has_content(v) for v in value.values())
+    if isinstance(value, list):
+        return any(has_content(v) for v in value)
+    return isinstance(value, str) and bool(value.strip())
@@ -0,0 +1,95 @@
+import json
+from cvision_runtime import answers
+from cvision_runtime import pipeline
+from cvision_runtime import result_cache
+from cvision_runtime import stage_timings
+from cvision_runtime import uploads
+
+# Handling of finished assistant runs, shared by the state machine handlers
+# (startOutputCorrection, saveDataToDatabase) and the run orchestrator. event
+# is the state input of the run, messages the message list of its thread.
+
+
+def finish_extraction(event, messages):
+    """Save the extraction or prepare its correction.
+
+    Returns (outcome, state input of the correction run or None):
+    "saved_without_correction", "cached_correction", "correction" or
+    "failed" if the upload lost its pooled vector store.
+    """
+    upload_id = event["upload_id"]
+    try:
+        extraction = answers.retrieve_json_answer(messages)
+        response = json.dumps(extraction, ensure_ascii=False)
+        result_cache.store(
+            event.get("content_hash"), event["assistant_id"], "extraction", extraction
+        )
+    except answers.AnswerError as e:
+        # The correction run gets the raw answer to repair it
+        print(f"Error parsing the extraction of {upload_id}: {e}")
+        extraction = None
+        response = answers.latest_answer(messages)
+    timings = stage_timings.Recorder(upload_id)
+    stage_timings.add_run(timings, "extraction_run", messages.data)
+    cv_data, validation = pipeline.check_extraction(upload_id, extraction)
+    if cv_data is not None and pipeline.save_without_correction(
+        event, cv_data, validation, timings
+    ):
+        return "saved_without_correction", None
+    if extraction is not None and save_cached_correction(event, timings):
+        return "cached_correction", None
+    timings.record()
+    if not uploads.extend_vector_store_lease(event):
+        uploads.mark_failed(event)
+        return "failed", None
+    return "correction", pipeline.correction_state_input(event, response)
+
+
+def save_cached_correction(event, timings):
+    """Save the cached correction of this PDF instead of running the correction.
+
+    Concurrent uploads of one CV all miss the cache in initialUpload, the
+    first correction to finish is reused here. Skipped with "cache_bust".
+    """
+    if event.get("cache_bust"):
+        return False
+    cached = result_cache.lookup(event.get("content_hash"), modes=("correction",))
+    if "correction" not in cached:
+        return False
+    try:
+        with timings.stage("db_save"):
+            uploads.save_cv_data(
+                event["upload_id"],
+                cached["correction"],
+                correction_skipped=False,
+                result_cached=True,
+            )
+    except Exception as e:
+        print(f"Error saving the cached correction of {event['upload_id']}: {e}")
+        return False
+    timings.record()
+    uploads.release_vector_store(event)
+    return True
+
+
+def finish_correction(event, messages):
+    """Save the corrected resume, returns False if the upload failed."""
+    timings = stage_timings.Recorder(event["upload_id"])
+    stage_timings.add_run(timings, "correction_run", messages.data)
+    try:
+        cv_data = answers.retrieve_json_answer(messages)
+        print(cv_data)
+        with timings.stage("db_save"):
+            uploads.save_cv_data(event["upload_id"], cv_data, correction_skipped=False)
+        result_cache.store(
+            event.get("content_hash"), event["assistant_id"], "correction", cv_data
+        )
+    except Exception as e:
+        print(e)
+        uploads.mark_failed(event)
+        return False
+    finally:
+        timings.record()
+    # Uploads using a pooled vector store hand it back once the pipeline is done
+    uploads.release_vector_store(event)
+    return True
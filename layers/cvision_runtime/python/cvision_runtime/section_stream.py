@@ -0,0 +1,93 @@
+import json
+
+# Incremental parser of a streamed resume answer. The text arrives in chunks,
+# every top-level section of the JSON object is handed to a callback as soon
+# as its value is complete, long before the whole answer is there. Text before
+# the object (a ```json fence) and after it is ignored.
+
+
+class SectionParser:
+    def __init__(self, on_section):
+        self.on_section = on_section  # Called with (section name, parsed value)
+        self.text = []  # Chunks from the opening brace of the object on
+        self.length = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.expecting = "key"  # "key" or "value" at depth 1
+        self.key_start = None
+        self.key = None
+        self.value_start = None
+        self.done = False
+        self.sections = []
+
+    def feed(self, chunk):
+        if self.done:
+            return
+        if self.depth == 0:
+            start = chunk.find("{")
+            if start == -1:
+                return
+            chunk = chunk[start:]
+        offset = self.length
+        self.text.append(chunk)
+        self.length += len(chunk)
+        for index, char in enumerate(chunk, start=offset):
+            self._char(char, index)
+            if self.done:
+                break
+
+    def _char(self, char, index):
+        if self.in_string:
+            if self.escaped:
+                self.escaped = False
+            elif char == "\\":
+                self.escaped = True
+            elif char == '"':
+                self.in_string = False
+                if self.depth == 1 and self.expecting == "key":
+                    self.key = json.loads(self._slice(self.key_start, index + 1))
+            return
+        if char == '"':
+            self.in_string = True
+            if self.depth == 1:
+                if self.expecting == "key":
+                    self.key_start = index
+                elif self.value_start is None:
+                    self.value_start = index
+        elif char in "{[":
+            if self.depth == 1 and self.value_start is None:
+                self.value_start = index
+            self.depth += 1
+        elif char in "}]":
+            self.depth -= 1
+            if self.depth == 1:
+                self._emit(index + 1)  # A nested section value just closed
+            elif self.depth == 0:
+                self._emit(index)
+                self.done = True
+        elif self.depth == 1:
+            if char == ":":
+                self.expecting = "value"
+            elif char == ",":
+                self._emit(index)
+                self.expecting = "key"
+            elif not char.isspace() and self.value_start is None:
+                self.value_start = index  # Number, true, false or null
+
+    def _emit(self, end):
+        if self.value_start is None or self.key is None:
+            return
+        raw = self._slice(self.value_start, end)
+        self.value_start = None
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            return  # The complete answer is parsed again at the end
+        self.sections.append(self.key)
+        self.on_section(self.key, value)
+
+    def _slice(self, start, end):
+        if len(self.text) > 1:
+            self.text = ["".join(self.text)]
+        return self.text[0][start:end]
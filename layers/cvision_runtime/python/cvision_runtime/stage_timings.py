@@ -0,0 +1,152 @@
+import contextlib
+import json
+import time
+from cvision_runtime import clients
+
+# Every handler records the wall clock window of its stages. They are logged as
+# {"metric": "stage_timing", ...} lines and saved in the stage_timings map of
+# the cv_uploads item: {"s3_put": {"started_at": ms, "ended_at": ms,
+# "duration_ms": ms}, ...}. tools/stage_report.py aggregates both sources.
+
+UPLOADS_TABLE = "cv_uploads"
+
+# Stages of the pipeline in processing order
+STAGES = (
+    "multipart_parse",
+    "s3_put",
+    "dynamodb_init",
+    "cache_lookup",
+    "openai_upload",
+    "vector_store",
+    "dynamodb_attach",
+    "stepfunctions_start",
+    "text_extraction",
+    "direct_completion",
+    "page_group_completions",
+    "extraction_run",
+    "correction_run",
+    "db_save",
+    "profile_extraction",
+    "docx_render",
+)
+
+
+def window(started_at, ended_at):
+    """Return the stored form of a stage window given in epoch seconds."""
+    started_ms = int(started_at * 1000)
+    ended_ms = int(ended_at * 1000)
+    return {
+        "started_at": started_ms,
+        "ended_at": ended_ms,
+        "duration_ms": ended_ms - started_ms,
+    }
+
+
+class Recorder:
+    """Collects the stage windows of one upload, saved with a single update."""
+
+    def __init__(self, upload_id=None):
+        self.upload_id = upload_id
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            self.stages[name] = (started_at, time.time())
+
+    def add(self, name, started_at, ended_at):
+        self.stages[name] = (started_at, ended_at)
+
+    def update(self, other):
+        self.stages.update(other.stages)
+
+    def durations_ms(self):
+        return {
+            name: round((ended_at - started_at) * 1000, 1)
+            for name, (started_at, ended_at) in self.stages.items()
+        }
+
+    def record(self):
+        """Log and save the collected stages."""
+        record(self.upload_id, self.stages)
+
+
+@contextlib.contextmanager
+def stage(upload_id, name):
+    """Context manager recording one stage of upload_id when the block exits."""
+    recorder = Recorder(upload_id)
+    try:
+        with recorder.stage(name):
+            yield
+    finally:
+        recorder.record()
+
+
+def record(upload_id, stages):
+    """Log and save stages, a dict of stage name to (started_at, ended_at)."""
+    if not stages or upload_id is None:
+        return
+    stages = {name: window(*times) for name, times in stages.items()}
+    for name, timing in stages.items():
+        print(
+            json.dumps(
+                {
+                    "metric": "stage_timing",
+                    "upload_id": str(upload_id),
+                    "stage": name,
+                    **timing,
+                }
+            )
+        )
+    try:
+        save(upload_id, stages)
+    except Exception as e:
+        # Timings are diagnostics, they never fail the pipeline
+        print(f"Error saving stage timings of {upload_id}: {e}")
+
+
+def save(upload_id, stages):
+    names = {f"#s{i}": name for i, name in enumerate(stages)}
+    values = {f":s{i}": timing for i, timing in enumerate(stages.values())}
+    table = clients.table(UPLOADS_TABLE)
+    update = {
+        "Key": {"upload_id": str(upload_id)},
+        "UpdateExpression": "SET "
+        + ", ".join(f"stage_timings.#s{i} = :s{i}" for i in range(len(stages))),
+        # Entries deleted by a rollback must not be recreated
+        "ConditionExpression": "attribute_exists(upload_id)",
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": values,
+    }
+    try:
+        table.update_item(**update)
+    except Exception as e:
+        if clients.is_conditional_check_failed(e):
+            return
+        if getattr(e, "response", {}).get("Error", {}).get("Code") != (
+            "ValidationException"
+        ):
+            raise
+        # Items created before stage_timings existed have no map to set paths in
+        table.update_item(
+            Key={"upload_id": str(upload_id)},
+            UpdateExpression="SET stage_timings = if_not_exists(stage_timings, :empty)",
+            ConditionExpression="attribute_exists(upload_id)",
+            ExpressionAttributeValues={":empty": {}},
+        )
+        table.update_item(**update)
+
+
+def add_run(recorder, name, messages):
+    """Add the window of the assistant run of a thread to recorder.
+
+    messages are the messages of the thread, the run starts with the first
+    user message and ends with the latest assistant message (second precision).
+    """
+    user = [m.created_at for m in messages if m.role == "user"]
+    assistant = [m.created_at for m in messages if m.role == "assistant"]
+    if user and assistant:
+        recorder.add(name, min(user), max(assistant))
@@ -0,0 +1,185 @@
+import time
+import uuid
+from cvision_runtime import clients
+from cvision_runtime import cv_storage
+from cvision_runtime import vector_store_pool
+
+# Writes ending the processing of an upload, shared by every handler that can
+# finish the pipeline.
+
+UPLOADS_TABLE = "cv_uploads"
+# Every write checkUploadStatus can see increments the status_version of the
+# item, long polling clients wait for it to change. New items start at 1.
+BUMP_VERSION = " ADD status_version :one"
+# Upload ids of the bulk ingestion are derived from the S3 object, enqueuing a
+# prefix again finds the entries of the CVs that are already ingested and
+# extract_profile names the picture of a backfilled CV without a lookup
+BULK_UPLOAD_ID_NAMESPACE = uuid.UUID("6f1c1f8e-3b0e-4c55-9a43-0d2b8a8f5e21")
+
+
+def bulk_upload_id(bucket, key):
+    """Return the upload id of the CV at key of bucket ingested in bulk."""
+    return str(uuid.uuid5(BULK_UPLOAD_ID_NAMESPACE, f"{bucket}/{key}"))
+
+
+def save_cv_data(upload_id, cv_data, **attributes):
+    """Store the extracted resume and mark the upload ready_to_retrieve.
+
+    attributes are set on the item as well, e.g. extraction_mode. The partial
+    results of a streamed extraction are removed. cv_data is stored in the
+    format of cv_storage.
+    """
+    expression = "SET cv_data = :cvData, process_status = :sta"
+    values = {":cvData": cv_storage.encode(cv_data), ":sta": "ready_to_retrieve"}
+    for index, (name, value) in enumerate(attributes.items()):
+        expression += f", {name} = :a{index}"
+        values[f":a{index}"] = value
+    expression += BUMP_VERSION + " REMOVE partial_cv_data, section_status"
+    values[":one"] = 1
+    clients.table(UPLOADS_TABLE).update_item(
+        Key={"upload_id": str(upload_id)},
+        UpdateExpression=expression,
+        ExpressionAttributeValues=values,
+    )
+
+
+def mark_failed(event, reason=None):
+    """Mark the upload of a state input failed and free its OpenAI resources.
+
+    A pooled vector store is released, which deletes the file as well. The
+    file of an own vector store is deleted.
+    """
+    expression = "SET process_status = :sta"
+    values = {":sta": "failed", ":one": 1}
+    if reason is not None:
+        expression += ", failure_reason = :reason"
+        values[":reason"] = reason
+    try:
+        clients.table(UPLOADS_TABLE).update_item(
+            Key={"upload_id": str(event["upload_id"])},
+            UpdateExpression=expression + BUMP_VERSION,
+            ExpressionAttributeValues=values,
+        )
+    finally:
+        if event.get("vector_store_slot") is not None:
+            release_vector_store(event)
+        elif event.get("file_id"):
+            try:
+                clients.openai().files.delete(event["file_id"])
+            except Exception as e:
+                print(f"Error deleting the file of {event['upload_id']}: {e}")
+
+
+def expire_pending_uploads():
+    """Mark the entries failed whose direct upload never arrived.
+
+    Entries of presigned URLs carry upload_expires_at until s3_upload_handler
+    takes them, returns the number of expired entries.
+    """
+    table = clients.table(UPLOADS_TABLE)
+    now = int(time.time())
+    scan = {
+        "ProjectionExpression": "upload_id",
+        "FilterExpression": "upload_expires_at < :now AND process_status = :progress",
+        "ExpressionAttributeValues": {":now": now, ":progress": "in_progress"},
+    }
+    expired = 0
+    while True:
+        response = table.scan(**scan)
+        for item in response.get("Items", []):
+            try:
+                table.update_item(
+                    Key={"upload_id": item["upload_id"]},
+                    UpdateExpression="SET process_status = :sta, failure_reason = :reason"
+                    + BUMP_VERSION
+                    + " REMOVE upload_expires_at",
+                    ConditionExpression="upload_expires_at < :now AND process_status = :progress",
+                    ExpressionAttributeValues={
+                        ":sta": "failed",
+                        ":reason": "upload_expired",
+                        ":now": now,
+                        ":progress": "in_progress",
+                        ":one": 1,
+                    },
+                )
+                expired += 1
+            except Exception as e:
+                if not clients.is_conditional_check_failed(e):
+                    raise
+        if "LastEvaluatedKey" not in response:
+            return expired
+        scan["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def start_partial_results(upload_id, sections):
+    """Reset the partial results of an upload, all sections start as pending.
+
+    Returns False if the upload is no longer in progress.
+    """
+    return _update_in_progress(
+        upload_id,
+        "SET partial_cv_data = :empty, section_status = :status",
+        {},
+        {":empty": {}, ":status": {section: "pending" for section in sections}},
+    )
+
+
+def save_section(upload_id, section, value):
+    """Store one complete section of a streamed extraction.
+
+    Returns False if the upload is no longer in progress.
+    """
+    return _update_in_progress(
+        upload_id,
+        "SET partial_cv_data.#section = :value, section_status.#section = :complete",
+        {"#section": section},
+        {":value": value, ":complete": "complete"},
+    )
+
+
+def _update_in_progress(upload_id, expression, names, values):
+    # Partial results must never overwrite a finished or failed upload
+    kwargs = {"ExpressionAttributeNames": names} if names else {}
+    try:
+        clients.table(UPLOADS_TABLE).update_item(
+            Key={"upload_id": str(upload_id)},
+            UpdateExpression=expression + BUMP_VERSION,
+            ConditionExpression="process_status = :progress",
+            ExpressionAttributeValues={**values, ":progress": "in_progress", ":one": 1},
+            **kwargs,
+        )
+    except Exception as e:
+        if clients.is_conditional_check_failed(e):
+            return False
+        raise
+    return True
+
+
+def extend_vector_store_lease(event):
+    """Renew the lease of the pooled vector store of an upload before a run.
+
+    Returns False if the upload lost its store, it has to fail then.
+    """
+    if event.get("vector_store_slot") is None:
+        return True
+    return vector_store_pool.extend(
+        event["upload_id"],
+        event["vector_store_slot"],
+        event["vectorstore_ids"][0],
+        event["file_id"],
+    )
+
+
+def release_vector_store(event):
+    """Hand the pooled vector store of a state machine execution back to the pool."""
+    if event.get("vector_store_slot") is None:
+        return
+    try:
+        vector_store_pool.release(
+            event["upload_id"],
+            event["vector_store_slot"],
+            event["vectorstore_ids"][0],
+            event["file_id"],
+        )
+    except Exception as e:
+        print(f"Error releasing the vector store of {event['upload_id']}: {e}")
@@ -0,0 +1,289 @@
+import os
+import random
+import time
+from cvision_runtime import clients
+
+# A fixed set of warm vector stores which uploads lease one at a time instead of
+# creating a store per upload. The leases live in DynamoDB, one item per slot:
+# {"slot": 0, "vector_store_id": ..., "leased_by": upload_id, "file_id": ...,
+#  "lease_expires_at": epoch seconds}
+#
+# A store must never hold the files of two CVs, file_search would mix them.
+# A slot whose file could not be detached is quarantined ("quarantined": true,
+# "delete_file": whether the file goes too) and skipped by acquire until the
+# sweep of cleanUp detached every file of its store. The leases are extended
+# before every run, OpenAI expires runs after 10 minutes, and while a handler
+# waits for a run.
+
+POOL_TABLE = os.environ.get("VECTOR_STORE_POOL_TABLE", "cv_vector_store_pool")
+POOL_SIZE = int(os.environ.get("VECTOR_STORE_POOL_SIZE", 0))  # 0 disables the pool
+LEASE_SECONDS = int(os.environ.get("VECTOR_STORE_LEASE_SECONDS", 1800))
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class DetachFailed(Exception):
+    pass
+
+
+class PooledVectorStore:
+    """A leased store of the pool, used like the vector store objects of the API."""
+
+    __slots__ = ("id", "slot")
+
+    def __init__(self, id, slot):
+        self.id = id
+        self.slot = slot
+
+
+def enabled():
+    return POOL_SIZE > 0
+
+
+def acquire(upload_id, file_id, deadline=None):
+    """Lease a free store, attach file_id to it and return it as PooledVectorStore.
+
+    Raises PoolExhausted if every store is leased or quarantined. The OpenAI
+    requests end by deadline (time.monotonic()), see clients.openai.
+    """
+    openai = clients.openai(deadline)
+    table = clients.table(POOL_TABLE)
+    now = int(time.time())
+    slots = list(range(POOL_SIZE))
+    random.shuffle(slots)  # Spread concurrent uploads over the slots
+    for slot in slots:
+        try:
+            previous = table.update_item(
+                Key={"slot": slot},
+                UpdateExpression="SET leased_by = :upload, file_id = :file, lease_expires_at = :expires",
+                ConditionExpression="attribute_not_exists(quarantined) AND "
+                "(attribute_not_exists(leased_by) OR lease_expires_at < :now)",
+                ExpressionAttributeValues={
+                    ":upload": upload_id,
+                    ":file": file_id,
+                    ":expires": now + LEASE_SECONDS,
+                    ":now": now,
+                },
+                ReturnValues="ALL_OLD",
+            ).get("Attributes", {})
+        except Exception as e:
+            if clients.is_conditional_check_failed(e):
+                continue
+            raise
+
+        vector_store_id = previous.get("vector_store_id")
+        try:
+            if previous.get("file_id"):
+                # The lease expired without being released, drop its file first
+                # and delete it like release does
+                _detach_file(vector_store_id, previous["file_id"], openai)
+                _delete_file(previous["file_id"])
+            if not vector_store_id:
+                vector_store_id = _create_store(slot, upload_id, openai)
+            openai.beta.vector_stores.files.create(
+                vector_store_id=vector_store_id, file_id=file_id
+            )
+            file_ids = _file_ids(vector_store_id, openai)
+            if file_ids != [file_id]:
+                raise DetachFailed(f"{vector_store_id} holds the files {file_ids}")
+        except DetachFailed as e:
+            print(f"Quarantining slot {slot}: {e}")
+            _quarantine(slot, upload_id, delete_file=False)
+            continue
+        except Exception:
+            _clear_lease(slot, upload_id)
+            raise
+        print(f"Leased vector store {vector_store_id} (slot {slot}) for {upload_id}")
+        return PooledVectorStore(vector_store_id, slot)
+    raise PoolExhausted(f"All {POOL_SIZE} vector stores are leased")
+
+
+def extend(upload_id, slot, vector_store_id, file_id):
+    """Renew the lease of an upload before a run and check its store.
+
+    Returns False if the lease was lost or the store holds other files than
+    file_id, such a slot is quarantined.
+    """
+    try:
+        clients.table(POOL_TABLE).update_item(
+            Key={"slot": int(slot)},
+            UpdateExpression="SET lease_expires_at = :expires",
+            ConditionExpression="leased_by = :upload AND attribute_not_exists(quarantined)",
+            ExpressionAttributeValues={
+                ":upload": upload_id,
+                ":expires": int(time.time()) + LEASE_SECONDS,
+            },
+        )
+    except Exception as e:
+        if clients.is_conditional_check_failed(e):
+            print(f"Lease of slot {slot} by {upload_id} was lost")
+            return False
+        raise
+    file_ids = _file_ids(vector_store_id)
+    if file_ids != [file_id]:
+        print(f"Quarantining slot {slot}: {vector_store_id} holds the files {file_ids}")
+        _quarantine(int(slot), upload_id, delete_file=False)
+        return False
+    return True
+
+
+def release(upload_id, slot, vector_store_id, file_id, delete_file=True):
+    """Detach the file of an upload from its store and end the lease.
+
+    If the file can't be detached the slot stays leased and is quarantined,
+    the sweep detaches the file before the store is used again.
+    """
+    try:
+        _detach_file(vector_store_id, file_id)
+    except DetachFailed as e:
+        print(f"Quarantining slot {slot}: {e}")
+        _quarantine(int(slot), upload_id, delete_file)
+        return
+    if delete_file:
+        _delete_file(file_id)
+    _clear_lease(int(slot), upload_id)
+    print(f"Released vector store {vector_store_id} (slot {slot}) of {upload_id}")
+
+
+def sweep():
+    """Reap expired leases, clean quarantined slots and create missing stores.
+
+    Returns the number of reaped leases and cleaned slots.
+    """
+    table = clients.table(POOL_TABLE)
+    now = int(time.time())
+    items = {int(item["slot"]): item for item in _scan(table)}
+    reaped = 0
+    for slot in range(POOL_SIZE):
+        item = items.get(slot, {})
+        try:
+            if item.get("quarantined"):
+                reaped += _clean_quarantined(slot, item)
+            elif item.get("leased_by") and int(item["lease_expires_at"]) < now:
+                print(f"Reaping expired lease of {item['leased_by']} on slot {slot}")
+                if item.get("file_id"):
+                    _detach_file(item.get("vector_store_id"), item["file_id"])
+                _clear_lease(slot, item["leased_by"])
+                reaped += 1
+            elif not item.get("vector_store_id"):
+                _warm_slot(table, slot)
+        except DetachFailed as e:
+            print(f"Quarantining slot {slot}: {e}")
+            _quarantine(slot, item["leased_by"], delete_file=False)
+    return reaped
+
+
+def _clean_quarantined(slot, item):
+    # Every file of the store goes, whichever upload attached it
+    for file_id in _file_ids(item["vector_store_id"]):
+        _detach_file(item["vector_store_id"], file_id)
+    if item.get("delete_file") and item.get("file_id"):
+        _delete_file(item["file_id"])
+    clients.table(POOL_TABLE).update_item(
+        Key={"slot": slot},
+        UpdateExpression="REMOVE leased_by, file_id, lease_expires_at, quarantined, delete_file",
+        ConditionExpression="quarantined = :true",
+        ExpressionAttributeValues={":true": True},
+    )
+    print(f"Slot {slot} is clean again")
+    return 1
+
+
+def _scan(table):
+    response = table.scan()
+    yield from response.get("Items", [])
+    while "LastEvaluatedKey" in response:
+        response = table.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
+        yield from response.get("Items", [])
+
+
+def _create_store(slot, upload_id, openai):
+    vector_store = openai.beta.vector_stores.create(name=f"cv-pool-{slot}")
+    clients.table(POOL_TABLE).update_item(
+        Key={"slot": slot},
+        UpdateExpression="SET vector_store_id = :store",
+        ConditionExpression="leased_by = :upload",
+        ExpressionAttributeValues={":store": vector_store.id, ":upload": upload_id},
+    )
+    return vector_store.id
+
+
+def _warm_slot(table, slot):
+    # Create the store of an unused slot so uploads never wait for a creation
+    vector_store = clients.openai().beta.vector_stores.create(name=f"cv-pool-{slot}")
+    try:
+        table.update_item(
+            Key={"slot": slot},
+            UpdateExpression="SET vector_store_id = :store",
+            ConditionExpression="attribute_not_exists(vector_store_id)",
+            ExpressionAttributeValues={":store": vector_store.id},
+        )
+    except Exception as e:
+        clients.openai().beta.vector_stores.delete(vector_store.id)
+        if not clients.is_conditional_check_failed(e):
+            raise
+
+
+def _detach_file(vector_store_id, file_id, openai=None):
+    """Remove a file from a store, raises DetachFailed unless it is gone."""
+    if not vector_store_id:
+        return
+    try:
+        (openai or clients.openai()).beta.vector_stores.files.delete(
+            file_id, vector_store_id=vector_store_id
+        )
+    except Exception as e:
+        if getattr(e, "status_code", None) == 404:
+            return  # Already detached or deleted
+        raise DetachFailed(
+            f"Error detaching file {file_id} from {vector_store_id}: {e}"
+        ) from e
+
+
+def _file_ids(vector_store_id, openai=None):
+    files = (openai or clients.openai()).beta.vector_stores.files.list(
+        vector_store_id=vector_store_id, limit=100
+    )
+    return [f.id for f in files.data]
+
+
+def _delete_file(file_id):
+    try:
+        clients.openai().files.delete(file_id)
+    except Exception as e:
+        print(f"Error deleting file {file_id}: {e}")
+
+
+def _quarantine(slot, upload_id, delete_file):
+    # The lease is kept, acquire skips the slot until the sweep cleaned it
+    try:
+        clients.table(POOL_TABLE).update_item(
+            Key={"slot": slot},
+            UpdateExpression="SET quarantined = :true, delete_file = :delete",
+            ConditionExpression="leased_by = :upload",
+            ExpressionAttributeValues={
+                ":true": True,
+                ":delete": delete_file,
+                ":upload": upload_id,
+            },
+        )
+    except Exception as e:
+        if not clients.is_conditional_check_failed(e):
+            raise
+        print(f"Lease of slot {slot} was already taken over")
+
+
+def _clear_lease(slot, upload_id):
+    try:
+        clients.table(POOL_TABLE).update_item(
+            Key={"slot": slot},
+            UpdateExpression="REMOVE leased_by, file_id, lease_expires_at",
+            ConditionExpression="leased_by = :upload",
+            ExpressionAttributeValues={":upload": upload_id},
+        )
+    except Exception as e:
+        if not clients.is_conditional_check_failed(e):
+            raise
+        print(f"Lease of slot {slot} was already taken over")
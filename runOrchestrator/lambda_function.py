@@ -0,0 +1,271 @@
+import asyncio
+import collections
+import json
+import math
+import os
+from cvision_runtime import clients
+from cvision_runtime import pipeline
+from cvision_runtime import rate_limit
+from cvision_runtime import run_results
+from cvision_runtime import uploads
+
+# Drives the assistant runs of many uploads from one invocation instead of a
+# state machine execution per run (ORCHESTRATION=orchestrator). Threads and
+# runs are created concurrently, one loop polls all runs in flight with a
+# shared backoff and every finished run is saved with the handling of
+# startOutputCorrection and saveDataToDatabase. An extraction needing the
+# correction continues with its correction run in the same invocation.
+
+MAX_CONCURRENT_RUNS = int(os.environ.get("ORCHESTRATOR_MAX_CONCURRENT_RUNS", 50))
+POLL_MIN_SECONDS = float(os.environ.get("ORCHESTRATOR_POLL_MIN_SECONDS", 2))
+POLL_MAX_SECONDS = float(os.environ.get("ORCHESTRATOR_POLL_MAX_SECONDS", 8))
+POLL_BACKOFF = float(os.environ.get("ORCHESTRATOR_POLL_BACKOFF", 1.5))
+# Runs still going this long before the lambda timeout are handed to the next
+# invocation through the queue, with their thread and run so nothing reruns
+STOP_MARGIN_MS = int(os.environ.get("ORCHESTRATOR_STOP_MARGIN_MS", 30000))
+
+ACTIVE_STATUSES = ("queued", "in_progress")
+
+# The pooled AsyncOpenAI client keeps its connections on the loop of its
+# first request, so every invocation of the container runs on this loop
+LOOP = asyncio.new_event_loop()
+
+
+@clients.track_invocation
+def lambda_handler(event, context):
+    """Run the assistant runs of a batch of uploads.
+
+    The event is an SQS batch whose message bodies are the state inputs sent
+    by pipeline.start_execution, or {"executions": [state input, ...]} for a
+    direct invocation. Uploads whose runs can't finish in this invocation are
+    sent back to the queue, messages that couldn't be handed off are
+    reported in batchItemFailures and delivered again.
+    """
+    if "Records" in event:
+        jobs = [
+            Job(json.loads(record["body"]), record["messageId"])
+            for record in event["Records"]
+        ]
+    else:
+        jobs = [Job(state) for state in event.get("executions", [])]
+    timeout = None
+    if context is not None:
+        timeout = max(0, context.get_remaining_time_in_millis() - STOP_MARGIN_MS)
+        timeout /= 1000
+    orchestrator = Orchestrator(clients.async_openai())
+    LOOP.run_until_complete(orchestrator.run(jobs, timeout))
+    failures = orchestrator.hand_off()
+    print(
+        json.dumps(
+            {
+                "metric": "run_orchestrator",
+                "uploads": len(jobs),
+                "runs": orchestrator.runs,
+                "polls": orchestrator.poller.polls,
+                "poll_rounds": orchestrator.poller.rounds,
+                "handed_off": len(orchestrator.handed_off),
+                **orchestrator.outcomes,
+            }
+        )
+    )
+    return {
+        "outcomes": dict(orchestrator.outcomes),
+        "batchItemFailures": [{"itemIdentifier": id} for id in failures],
+    }
+
+
+class Job:
+    """The pipeline of one upload, state is the state input of its current run."""
+
+    def __init__(self, state, message_id=None):
+        self.state = state
+        self.message_id = message_id
+        self.saving = False
+        self.retry_after = 0  # Seconds to delay a rate limited hand-off
+
+
+class RunPoller:
+    """Polls all runs in flight in one loop.
+
+    Every round retrieves the pending runs concurrently. The delay between
+    rounds starts at POLL_MIN_SECONDS, grows by POLL_BACKOFF while nothing
+    finishes and drops back once a run finished, since runs started together
+    tend to finish together.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.pending = {}  # run_id -> (thread_id, future)
+        self.polls = 0
+        self.rounds = 0
+        self._task = None
+
+    def wait(self, thread_id, run_id):
+        """Return a future of the run once it left the active statuses."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending[run_id] = (thread_id, future)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll())
+        return future
+
+    async def _poll(self):
+        delay = POLL_MIN_SECONDS
+        while self.pending:
+            await asyncio.sleep(delay)
+            polled = [
+                (run_id, thread_id, future)
+                for run_id, (thread_id, future) in self.pending.items()
+                if not future.done()  # Cancelled by a stopping orchestrator
+            ]
+            self.rounds += 1
+            self.polls += len(polled)
+            results = await asyncio.gather(
+                *(
+                    self.client.beta.threads.runs.retrieve(run_id, thread_id=thread_id)
+                    for run_id, thread_id, _ in polled
+                ),
+                return_exceptions=True,
+            )
+            finished = False
+            for (run_id, _, future), result in zip(polled, results):
+                if isinstance(result, Exception):
+                    if rate_limit.is_rate_limited(result):
+                        continue  # Polled again in the next round
+                    if not future.done():
+                        future.set_exception(result)
+                elif result.status in ACTIVE_STATUSES:
+                    continue
+                elif not future.done():
+                    future.set_result(result)
+                finished = True
+            for run_id in [
+                run_id for run_id, (_, f) in self.pending.items() if f.done()
+            ]:
+                del self.pending[run_id]
+            if finished:
+                delay = POLL_MIN_SECONDS
+            else:
+                delay = min(POLL_MAX_SECONDS, delay * POLL_BACKOFF)
+
+
+class Orchestrator:
+    def __init__(self, client):
+        self.client = client
+        self.poller = RunPoller(client)
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_RUNS)
+        self.stopping = False
+        self.handed_off = []  # Jobs continued by the next invocation
+        self.outcomes = collections.Counter()
+        self.runs = 0
+
+    async def run(self, jobs, timeout=None):
+        if not jobs:
+            return
+        tasks = {asyncio.create_task(self.drive(job)): job for job in jobs}
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if not pending:
+            return
+        # Out of time: runs in flight go to the queue, saves in progress finish
+        self.stopping = True
+        for task in pending:
+            job = tasks[task]
+            if not job.saving:
+                task.cancel()
+                self.handed_off.append(job)
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def drive(self, job):
+        while job.state is not None:
+            state = job.state
+            try:
+                async with self.semaphore:
+                    run = await self.finish_run(state)
+                    messages = await self.client.beta.threads.messages.list(
+                        thread_id=state["run"]["thread_id"]
+                    )
+            except Exception as e:
+                if rate_limit.is_rate_limited(e):
+                    job.retry_after = getattr(e, "retry_after", POLL_MAX_SECONDS)
+                    self.handed_off.append(job)
+                    return
+                print(f"Error in the {state['mode']} run of {state['upload_id']}: {e}")
+                await asyncio.to_thread(self.fail, state)
+                return
+            if run.status != "completed":
+                print(
+                    f"The {state['mode']} run of {state['upload_id']} "
+                    f"ended with status {run.status}"
+                )
+                await asyncio.to_thread(self.fail, state)
+                return
+            event = {**state, "threadCreationOutput": {"thread_id": run.thread_id}}
+            event.pop("run")
+            job.saving = True
+            try:
+                job.state = await asyncio.to_thread(self.save, event, messages)
+            finally:
+                job.saving = False
+            if job.state is not None and self.stopping:
+                self.handed_off.append(job)
+                return
+
+    async def finish_run(self, state):
+        """Start the run of state unless a previous invocation did, await its end."""
+        if not await asyncio.to_thread(uploads.extend_vector_store_lease, state):
+            raise Exception(f"{state['upload_id']} lost its pooled vector store")
+        if state.get("run") is None:
+            thread = await self.client.beta.threads.create(
+                messages=[{"role": "user", "content": state["prompt"]}],
+                tool_resources={
+                    "file_search": {"vector_store_ids": state["vectorstore_ids"]}
+                },
+            )
+            run = await self.client.beta.threads.runs.create(
+                thread_id=thread.id,
+                assistant_id=state["assistant_id"],
+                response_format=state["response_format"],
+            )
+            state["run"] = {"thread_id": thread.id, "run_id": run.id}
+            self.runs += 1
+        return await self.poller.wait(state["run"]["thread_id"], state["run"]["run_id"])
+
+    def save(self, event, messages):
+        # Returns the state input of the correction run or None
+        if event["mode"] == "extraction":
+            outcome, correction_input = run_results.finish_extraction(event, messages)
+            self.outcomes[outcome] += 1
+            return correction_input
+        saved = run_results.finish_correction(event, messages)
+        self.outcomes["corrected" if saved else "failed"] += 1
+        return None
+
+    def fail(self, state):
+        self.outcomes["failed"] += 1
+        uploads.mark_failed(state)
+
+    def hand_off(self):
+        """Queue the handed off jobs, returns the message ids that failed."""
+        failures = []
+        for start in range(0, len(self.handed_off), 10):
+            batch = self.handed_off[start : start + 10]
+            entries = [
+                {
+                    "Id": str(index),
+                    "MessageBody": json.dumps(job.state),
+                    "DelaySeconds": min(900, math.ceil(job.retry_after)),
+                }
+                for index, job in enumerate(batch)
+            ]
+            try:
+                response = clients.sqs().send_message_batch(
+                    QueueUrl=pipeline.ORCHESTRATOR_QUEUE_URL, Entries=entries
+                )
+                failed = [batch[int(f["Id"])] for f in response.get("Failed", [])]
+            except Exception as e:
+                print(f"Error handing off {len(batch)} uploads: {e}")
+                failed = batch
+            failures += [job.message_id for job in failed]
+        if None in failures:
+            # Jobs of a direct invocation have no message to deliver again
+            raise Exception(f"Could not hand off {failures.count(None)} uploads")
+        return failures
@@ -0,0 +1,50 @@
+import json
+from cvision_runtime import clients
+import subscriptions
+
+# Routes of the status WebSocket API. After connecting, the frontend sends
+# {"action": "subscribe", "upload_ids": [...]} and receives a message
+# {"upload_id": ..., "process_status": ..., "sections": {...}} whenever the
+# status of one of them changes, see stream_publisher. Messages only carry the
+# status, the data is read with one checkUploadStatus call.
+
+MAX_UPLOAD_IDS = 100
+
+
+@clients.track_invocation
+def lambda_handler(event, context):
+    route = event["requestContext"]["routeKey"]
+    connection_id = event["requestContext"]["connectionId"]
+    if route in ("$connect", "$disconnect"):
+        # Subscriptions of closed connections are removed when a publish fails
+        return {"statusCode": 200}
+    try:
+        body = json.loads(event.get("body") or "{}")
+    except json.JSONDecodeError:
+        return {"statusCode": 400, "body": "Bad Request - The message is no JSON"}
+    upload_ids = body.get("upload_ids")
+    if body.get("action") != "subscribe" or not isinstance(upload_ids, list):
+        return {"statusCode": 400, "body": "Bad Request - Unknown action"}
+    if not upload_ids or len(upload_ids) > MAX_UPLOAD_IDS:
+        return {
+            "statusCode": 400,
+            "body": f"Bad Request - Subscribe to 1 to {MAX_UPLOAD_IDS} uploads",
+        }
+    for upload_id in upload_ids:
+        subscribe(connection_id, str(upload_id))
+    return {"statusCode": 200}
+
+
+def subscribe(connection_id, upload_id):
+    table = clients.table("cv_uploads")
+    subscriptions.subscribe(connection_id, upload_id)
+    # Read after saving, the upload may have finished before the subscription
+    item = (
+        table.get_item(Key={"upload_id": upload_id}, ConsistentRead=True).get("Item")
+        or {}
+    )
+    status = item.get("process_status", "failed")
+    if status != "in_progress":
+        subscriptions.send(
+            connection_id, {"upload_id": upload_id, "process_status": status}
+        )
@@ -0,0 +1,57 @@
+from cvision_runtime import clients
+from cvision_runtime import metrics
+import subscriptions
+
+# Handler of the DynamoDB stream of cv_uploads (view type NEW_AND_OLD_IMAGES).
+# Every change of process_status or section_status is pushed to the
+# subscribers of the upload, whichever lambda wrote it.
+
+# Pushed and skipped records, messages sent and batches handled
+PUBLISH_COUNTS = metrics.counter("status_push")
+
+
+@clients.track_invocation
+def lambda_handler(event, context):
+    failures = []
+    for record in event.get("Records", []):
+        try:
+            publish_record(record)
+        except Exception as e:
+            print(f"Error publishing the status change {record.get('eventID')}: {e}")
+            failures.append(
+                {"itemIdentifier": record["dynamodb"].get("SequenceNumber")}
+            )
+    metrics.count(
+        "status_push",
+        "batch",
+        records=len(event.get("Records", [])),
+        failed=len(failures),
+    )
+    # Needs ReportBatchItemFailures on the event source mapping
+    return {"batchItemFailures": failures}
+
+
+def publish_record(record):
+    if record.get("eventName") not in ("INSERT", "MODIFY"):
+        return
+    old = deserialize(record["dynamodb"].get("OldImage"))
+    new = deserialize(record["dynamodb"].get("NewImage"))
+    status = new.get("process_status")
+    sections = new.get("section_status")
+    if status == old.get("process_status") and sections == old.get("section_status"):
+        metrics.count("status_push", "unchanged", log=False)
+        return
+    message = {"process_status": status}
+    if status == "in_progress" and sections:
+        message["sections"] = sections
+    sent = subscriptions.publish(new["upload_id"], message)
+    metrics.count("status_push", "published" if sent else "no_subscriber", log=False)
+    metrics.count("status_push", "messages", amount=sent, log=False)
+
+
+def deserialize(image):
+    """Convert a stream image from the DynamoDB JSON format."""
+    from boto3.dynamodb.types import TypeDeserializer
+
+    deserializer = TypeDeserializer()
+    return {name: deserializer.deserialize(v) for name, v in (image or {}).items()}
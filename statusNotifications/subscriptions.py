@@ -0,0 +1,81 @@
+import json
+import os
+import time
+from cvision_runtime import clients
+
+# Status subscriptions of the WebSocket API, one item per watched upload:
+# {"upload_id": ..., "connections": {"<connection id>#<upload id>"},
+#  "expires_at": epoch seconds}. DynamoDB TTL on expires_at removes
+# subscriptions of uploads that never finished.
+
+SUBSCRIPTIONS_TABLE = os.environ.get(
+    "STATUS_SUBSCRIPTIONS_TABLE", "cv_status_subscriptions"
+)
+SUBSCRIPTION_TTL_SECONDS = int(os.environ.get("STATUS_SUBSCRIPTION_TTL_SECONDS", 7200))
+# https://{api id}.execute-api.{region}.amazonaws.com/{stage} of the WebSocket API
+SOCKET_ENDPOINT = os.environ.get("STATUS_SOCKET_ENDPOINT", "")
+
+
+def subscribe(connection_id, upload_id):
+    clients.table(SUBSCRIPTIONS_TABLE).update_item(
+        Key={"upload_id": upload_id},
+        UpdateExpression="ADD connections :member SET expires_at = :expires",
+        ExpressionAttributeValues={
+            ":member": {f"{connection_id}#{upload_id}"},
+            ":expires": int(time.time()) + SUBSCRIPTION_TTL_SECONDS,
+        },
+    )
+
+
+def unsubscribe(watched_id, members):
+    clients.table(SUBSCRIPTIONS_TABLE).update_item(
+        Key={"upload_id": watched_id},
+        UpdateExpression="DELETE connections :members",
+        ExpressionAttributeValues={":members": set(members)},
+    )
+
+
+def subscribers(watched_id):
+    """Return the (connection id, upload id, member) of an upload."""
+    item = (
+        clients.table(SUBSCRIPTIONS_TABLE)
+        .get_item(Key={"upload_id": watched_id}, ConsistentRead=True)
+        .get("Item")
+    )
+    members = (item or {}).get("connections") or set()
+    return [(*member.split("#", 1), member) for member in sorted(members)]
+
+
+def send(connection_id, message):
+    """Post message to a connection, returns False if the connection is gone."""
+    try:
+        clients.websocket_api(SOCKET_ENDPOINT).post_to_connection(
+            ConnectionId=connection_id, Data=json.dumps(message).encode()
+        )
+    except Exception as e:
+        if is_gone(e):
+            return False
+        raise
+    return True
+
+
+def publish(watched_id, message):
+    """Send message to every subscriber of an upload, returns the number reached.
+
+    Connections that are gone are removed from the subscription.
+    """
+    sent = 0
+    gone = []
+    for connection_id, upload_id, member in subscribers(watched_id):
+        if send(connection_id, {**message, "upload_id": upload_id}):
+            sent += 1
+        else:
+            gone.append(member)
+    if gone:
+        unsubscribe(watched_id, gone)
+    return sent
+
+
+def is_gone(error):
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") == "GoneException"
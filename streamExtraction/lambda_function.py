@@ -0,0 +1,91 @@
+import json
+from cvision_runtime import clients
+from cvision_runtime import resume_schema
+from cvision_runtime import section_stream
+from cvision_runtime import stage_timings
+from cvision_runtime import uploads
+
+
+@clients.track_invocation
+def lambda_handler(event, context):
+    """Run the assistant of a state machine execution with a streamed response.
+
+    Replaces the thread creation and run polling states for executions with
+    "stream": true. Every top-level section of the answer is saved to
+    partial_cv_data as soon as it is complete, checkUploadStatus returns them
+    while the run is still going. The result has the shape of
+    threadCreationOutput.
+    """
+    upload_id = event["upload_id"]
+    if not uploads.extend_vector_store_lease(event):
+        raise Exception(f"{upload_id} lost its pooled vector store")
+    client = clients.openai()
+    thread = client.beta.threads.create(
+        messages=[{"role": "user", "content": event["prompt"]}],
+        tool_resources={"file_search": {"vector_store_ids": event["vectorstore_ids"]}},
+    )
+    writer = SectionWriter(upload_id)
+    parser = section_stream.SectionParser(writer.save)
+    timings = stage_timings.Recorder(upload_id)
+    run_id = None
+    status = None
+    options = {}
+    if event.get("response_format"):
+        options["response_format"] = event["response_format"]
+    with timings.stage(f"{event['mode']}_run"):
+        stream = client.beta.threads.runs.create(
+            thread_id=thread.id,
+            assistant_id=event["assistant_id"],
+            stream=True,
+            **options,
+        )
+        for stream_event in stream:
+            if stream_event.event == "thread.run.created":
+                run_id = stream_event.data.id
+            elif stream_event.event == "thread.message.delta":
+                for content in stream_event.data.delta.content or []:
+                    if content.type == "text" and content.text.value:
+                        parser.feed(content.text.value)
+            elif stream_event.event.startswith(
+                "thread.run."
+            ) and not stream_event.event.startswith("thread.run.step."):
+                status = stream_event.data.status
+    timings.record()
+    print(
+        json.dumps(
+            {
+                "metric": "streamed_sections",
+                "upload_id": upload_id,
+                "sections": parser.sections,
+                "saved": writer.saved,
+            }
+        )
+    )
+    if status != "completed":
+        raise Exception(f"Run {run_id} of {upload_id} ended with status {status}")
+    return {"thread_id": thread.id, "run_id": run_id}
+
+
+class SectionWriter:
+    """Saves the sections of one upload, stops once the upload is finished."""
+
+    def __init__(self, upload_id):
+        self.upload_id = upload_id
+        self.saved = 0
+        try:
+            self.active = uploads.start_partial_results(
+                upload_id, resume_schema.RESUME_TEMPLATE
+            )
+        except Exception as e:
+            print(f"Error starting the partial results of {upload_id}: {e}")
+            self.active = False
+
+    def save(self, section, value):
+        if not self.active:
+            return
+        try:
+            self.active = uploads.save_section(self.upload_id, section, value)
+            self.saved += self.active
+        except Exception as e:
+            # Partial results are a preview, the final save still happens
+            print(f"Error saving section {section} of {self.upload_id}: {e}")
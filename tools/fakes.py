@@ -0,0 +1,1762 @@
+"""In-memory fakes of S3, DynamoDB, Step Functions, SQS, API Gateway and OpenAI.
+
+They implement the subset of the boto3 and openai client interfaces the lambda
+handlers use, so the handlers run unchanged in process once the fakes are put
+into the client pool with FakeCloud.install(). Every call sleeps for a
+configurable simulated service latency.
+"""
+
+import asyncio
+import collections
+import copy
+import datetime
+import decimal
+import io
+import json
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+try:
+    from botocore.exceptions import ClientError
+except ImportError:
+
+    class ClientError(Exception):
+        """Stand-in for botocore's ClientError when botocore is not installed."""
+
+        def __init__(self, error_response, operation_name):
+            error = error_response.get("Error", {})
+            super().__init__(
+                f"An error occurred ({error.get('Code')}) when calling the "
+                f"{operation_name} operation: {error.get('Message')}"
+            )
+            self.response = error_response
+            self.operation_name = operation_name
+
+
+# Simulated service latencies in seconds, multiplied by Latencies.scale
+DEFAULT_LATENCIES = {
+    "s3.put": 0.08,
+    "s3.get": 0.04,
+    "s3.delete": 0.03,
+    "dynamodb.read": 0.006,
+    "dynamodb.write": 0.01,
+    "dynamodb.batch": 0.015,
+    "stepfunctions.start": 0.05,
+    "lambda.invoke": 0.02,
+    "sqs.send": 0.01,
+    "sqs.receive": 0.01,
+    "sqs.delete": 0.01,
+    "dynamodb.stream": 0.3,
+    "apigateway.post": 0.02,
+    "openai.file_upload": 0.7,
+    "openai.file_delete": 0.2,
+    "openai.vector_store": 0.4,
+    "openai.vector_store_file": 0.9,
+    "openai.vector_store_delete": 0.2,
+    "openai.thread": 0.25,
+    "openai.run_start": 0.3,
+    "openai.run_poll": 0.15,
+    "openai.messages": 0.25,
+    "openai.run.extraction": 28.0,
+    "openai.run.correction": 22.0,
+    "openai.completion": 9.0,
+    # Generation time per answer token on top of the run or completion latency,
+    # 0 keeps it independent of the CV length
+    "openai.answer_token": 0.0,
+}
+
+EXTRACTION_ASSISTANT_ID = "asst_ab8KCfa3TRFd5MbN0iGXs9bj"
+CORRECTION_ASSISTANT_ID = "asst_uPkzE0iGVonUn6cWg3uzlCQr"
+# STATUS_SOCKET_ENDPOINT of the handlers posting to FakeCloud.websocket
+WEBSOCKET_ENDPOINT = "https://local.execute-api.eu-central-1.amazonaws.com/default"
+
+
+class Latencies:
+    def __init__(self, scale=1.0, overrides=None):
+        self.scale = scale
+        self.by_operation = {**DEFAULT_LATENCIES, **(overrides or {})}
+
+    def seconds(self, operation):
+        return self.by_operation.get(operation, 0.0) * self.scale
+
+    def sleep(self, operation, units=1):
+        seconds = self.seconds(operation) * units
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+def client_error(code, message, operation_name):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation_name)
+
+
+def sample_resume(firstname="Anna", surname="Schmidt"):
+    """Return a filled resume in the structure of resume_schema.RESUME_TEMPLATE."""
+    return {
+        "Professional Summary": {
+            "Professional Summary Text": "Erfahrene Softwareentwicklerin mit Fokus "
+            "auf Cloud-Architekturen und Datenplattformen.",
+            "Professional Summary Bullet Points": [
+                "8 Jahre Erfahrung in der Backend-Entwicklung",
+                "Leitung von Teams mit bis zu 6 Personen",
+            ],
+        },
+        "Personal Information": {
+            "Firstname": firstname,
+            "Surname": surname,
+            "Birthday": "12.03.1990",
+            "Nationality": "Deutsch",
+            "Marital Status": "",
+            "Availability": "ab sofort",
+            "Current Role": "Senior Software Engineer",
+            "Additional Information": "",
+        },
+        "Contact Information": {
+            "Address": "Musterstraße 1, 10115 Berlin",
+            "First Phone Number": "+49 30 1234567",
+            "Second Phone Number": "",
+            "Email": f"{firstname.lower()}.{surname.lower()}@example.com",
+            "Additional Information": "",
+        },
+        "Languages": [
+            {"Name": "Deutsch", "Level": "Muttersprache"},
+            {"Name": "Englisch", "Level": "C1"},
+        ],
+        "Working Experience": [
+            {
+                "Title": "Senior Software Engineer",
+                "Location": "Berlin",
+                "Description": "Entwicklung einer serverlosen Datenplattform.",
+                "Bullet Points": ["Migration auf AWS Lambda", "Einführung von CI/CD"],
+                "Start Date": "01/2020",
+                "End Date": "heute",
+                "Company": "Beispiel GmbH",
+                "Website": "https://example.com",
+                "Additional Information": "",
+            }
+        ],
+        "Education": [
+            {
+                "Diploma": "M.Sc. Informatik",
+                "Institution": "Technische Universität Berlin",
+                "Start Date": "10/2012",
+                "End Date": "09/2015",
+                "Grade": "1,3",
+                "Location": "Berlin",
+                "Website": "",
+                "Description": "",
+                "Bullet Points": [""],
+                "Additional Information": "",
+            }
+        ],
+        "Certificates": [
+            {
+                "Title": "AWS Certified Solutions Architect",
+                "Start Date": "2021",
+                "End Date": "2024",
+                "Institution": "Amazon Web Services",
+                "Additional Information": "",
+            }
+        ],
+        "Skills and Competencies": {
+            "Skills": ["Systemarchitektur", "Code Reviews"],
+            "Programming Languages": [
+                {"Name": "Python", "Proficiency Level": "Experte"},
+                {"Name": "Go", "Proficiency Level": "Fortgeschritten"},
+            ],
+        },
+        "Software and Technologies": ["AWS", "Docker", "PostgreSQL"],
+        "Hobbies": ["Klettern"],
+        "Additional Information": [
+            {
+                "Title": "",
+                "Start Date": "",
+                "End Date": "",
+                "Description": "",
+                "Institution": "",
+                "Location": "",
+                "Address": "",
+                "Website": "",
+                "Additional Information": "",
+            }
+        ],
+    }
+
+
+# S3
+
+
+class _Body(io.BytesIO):
+    """StreamingBody stand-in of get_object responses."""
+
+
+class FakeS3:
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.objects = {}  # (bucket, key) -> {"data", "metadata", "content_type"}
+        self._lock = threading.Lock()
+        self.exceptions = SimpleNamespace(
+            NoSuchKey=ClientError, ClientError=ClientError
+        )
+
+    def put_object(self, Bucket, Key, Body=b"", Metadata=None, ContentType=None, **_):
+        self.latencies.sleep("s3.put")
+        data = Body.read() if hasattr(Body, "read") else bytes(Body)
+        with self._lock:
+            self.objects[(Bucket, Key)] = {
+                "data": data,
+                "metadata": dict(Metadata or {}),
+                "content_type": ContentType or "binary/octet-stream",
+            }
+        return {"ETag": f'"{uuid.uuid4().hex}"'}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, **_):
+        extra = ExtraArgs or {}
+        self.put_object(
+            Bucket=Bucket,
+            Key=Key,
+            Body=Fileobj,
+            Metadata=extra.get("Metadata"),
+            ContentType=extra.get("ContentType"),
+        )
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, **_):
+        with open(Filename, "rb") as f:
+            self.upload_fileobj(f, Bucket, Key, ExtraArgs)
+
+    def _object(self, bucket, key, operation_name):
+        with self._lock:
+            obj = self.objects.get((bucket, key))
+        if obj is None:
+            raise client_error(
+                "NoSuchKey", "The specified key does not exist.", operation_name
+            )
+        return obj
+
+    def get_object(self, Bucket, Key, **_):
+        self.latencies.sleep("s3.get")
+        obj = self._object(Bucket, Key, "GetObject")
+        return {
+            "Body": _Body(obj["data"]),
+            "ContentLength": len(obj["data"]),
+            "ContentType": obj["content_type"],
+            "Metadata": dict(obj["metadata"]),
+        }
+
+    def head_object(self, Bucket, Key, **_):
+        self.latencies.sleep("s3.get")
+        obj = self._object(Bucket, Key, "HeadObject")
+        return {
+            "ContentLength": len(obj["data"]),
+            "ContentType": obj["content_type"],
+            "Metadata": dict(obj["metadata"]),
+        }
+
+    def list_objects_v2(
+        self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000, **_
+    ):
+        self.latencies.sleep("s3.get")
+        with self._lock:
+            keys = sorted(
+                key
+                for bucket, key in self.objects
+                if bucket == Bucket and key.startswith(Prefix)
+            )
+        start = int(ContinuationToken or 0)
+        page = keys[start : start + MaxKeys]
+        response = {
+            "KeyCount": len(page),
+            "Contents": [
+                {"Key": key, "Size": len(self.objects[(Bucket, key)]["data"])}
+                for key in page
+            ],
+            "IsTruncated": start + MaxKeys < len(keys),
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        return response
+
+    def download_fileobj(self, Bucket, Key, Fileobj, **_):
+        Fileobj.write(self.get_object(Bucket=Bucket, Key=Key)["Body"].read())
+
+    def delete_object(self, Bucket, Key, **_):
+        self.latencies.sleep("s3.delete")
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def generate_presigned_post(
+        self, Bucket, Key, Fields=None, Conditions=None, ExpiresIn=3600
+    ):
+        return {
+            "url": f"https://{Bucket}.s3.amazonaws.com/",
+            "fields": {**(Fields or {}), "key": Key, "policy": "local"},
+        }
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600):
+        params = Params or {}
+        return (
+            f"https://{params.get('Bucket')}.s3.amazonaws.com/{params.get('Key')}?local"
+        )
+
+
+# DynamoDB
+
+MISSING = object()
+
+_TOKEN_PATTERN = re.compile(
+    r"\s*(?:(?P<name>#\w+)|(?P<value>:\w+)|(?P<number>\d+)|(?P<ident>[A-Za-z_]\w*)"
+    r"|(?P<op><>|<=|>=|[=<>(),.\[\]+-]))"
+)
+_KEYWORDS = {"SET", "REMOVE", "ADD", "DELETE", "AND", "OR", "NOT", "BETWEEN", "IN"}
+
+
+def to_dynamodb(value):
+    """Convert a Python value like the boto3 serializer does, ints become Decimals."""
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    if isinstance(value, int):
+        return decimal.Decimal(value)
+    if isinstance(value, decimal.Decimal):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    if isinstance(value, dict):
+        return {str(k): to_dynamodb(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_dynamodb(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return {to_dynamodb(v) for v in value}
+    if hasattr(value, "value"):  # boto3.dynamodb.types.Binary
+        return bytes(value.value)
+    raise TypeError(f"Unsupported type {type(value)} for value {value!r}")
+
+
+def _validation_error(message, operation_name):
+    return client_error("ValidationException", message, operation_name)
+
+
+class _Expression:
+    """Parser of condition, update and projection expressions.
+
+    Parsed expressions are closures over an item, a path is a list of map keys
+    and list indexes.
+    """
+
+    def __init__(self, text, names, values, operation_name):
+        self.operation_name = operation_name
+        self.names = names or {}
+        self.values = {k: to_dynamodb(v) for k, v in (values or {}).items()}
+        self.tokens = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            match = _TOKEN_PATTERN.match(text, position)
+            if not match or match.end() == position:
+                raise self.error(f"Invalid expression near {text[position:]!r}")
+            kind = match.lastgroup
+            token = match.group(kind)
+            if kind == "ident" and token.upper() in _KEYWORDS:
+                kind, token = "keyword", token.upper()
+            self.tokens.append((kind, token))
+            position = match.end()
+        self.position = 0
+
+    def error(self, message):
+        return _validation_error(message, self.operation_name)
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, token=None):
+        kind, value = self.peek()
+        if kind is None or (token is not None and value != token):
+            raise self.error(f"Expected {token or 'a token'}, found {value!r}")
+        self.position += 1
+        return kind, value
+
+    def at(self, *tokens):
+        return self.peek()[1] in tokens
+
+    def done(self):
+        return self.position >= len(self.tokens)
+
+    # Operands
+
+    def parse_path(self):
+        path = [self._attribute_name()]
+        while self.at(".", "["):
+            if self.take()[1] == ".":
+                path.append(self._attribute_name())
+            else:
+                path.append(int(self.take()[1]))
+                self.take("]")
+        return path
+
+    def _attribute_name(self):
+        kind, token = self.take()
+        if kind == "name":
+            if token not in self.names:
+                raise self.error(f"Undefined attribute name {token}")
+            return self.names[token]
+        if kind != "ident":
+            raise self.error(f"Expected an attribute name, found {token!r}")
+        return token
+
+    def parse_operand(self, arithmetic=False):
+        kind, token = self.peek()
+        if kind == "value":
+            self.take()
+            if token not in self.values:
+                raise self.error(f"Undefined attribute value {token}")
+            value = self.values[token]
+            operand = lambda item: value
+        elif kind == "ident" and self.peek(1)[1] == "(":
+            operand = self._function(token.lower())
+        else:
+            path = self.parse_path()
+            operand = lambda item: get_path(item, path)
+        if arithmetic and self.at("+", "-"):
+            sign = 1 if self.take()[1] == "+" else -1
+            right = self.parse_operand()
+            left = operand
+
+            def operand(item):
+                a, b = left(item), right(item)
+                if not isinstance(a, decimal.Decimal) or not isinstance(
+                    b, decimal.Decimal
+                ):
+                    raise self.error("Incorrect operand type for operator or function")
+                return a + sign * b
+
+        return operand
+
+    def _function(self, name):
+        self.take()
+        self.take("(")
+        if name == "if_not_exists":
+            path = self.parse_path()
+            self.take(",")
+            default = self.parse_operand()
+            self.take(")")
+
+            def operand(item):
+                value = get_path(item, path)
+                return default(item) if value is MISSING else value
+
+            return operand
+        if name == "list_append":
+            first = self.parse_operand()
+            self.take(",")
+            second = self.parse_operand()
+            self.take(")")
+            return lambda item: list(first(item)) + list(second(item))
+        if name == "size":
+            path = self.parse_path()
+            self.take(")")
+
+            def operand(item):
+                value = get_path(item, path)
+                if value is MISSING:
+                    return MISSING
+                return decimal.Decimal(len(value))
+
+            return operand
+        raise self.error(f"Invalid function name {name}")
+
+    # Conditions
+
+    def parse_condition(self):
+        condition = self._and_condition()
+        while self.at("OR"):
+            self.take()
+            left, right = condition, self._and_condition()
+            condition = lambda item, l=left, r=right: l(item) or r(item)
+        return condition
+
+    def _and_condition(self):
+        condition = self._not_condition()
+        while self.at("AND"):
+            self.take()
+            left, right = condition, self._not_condition()
+            condition = lambda item, l=left, r=right: l(item) and r(item)
+        return condition
+
+    def _not_condition(self):
+        if self.at("NOT"):
+            self.take()
+            inner = self._not_condition()
+            return lambda item: not inner(item)
+        if self.at("("):
+            self.take()
+            condition = self.parse_condition()
+            self.take(")")
+            return condition
+        kind, token = self.peek()
+        name = token.lower() if kind == "ident" else None
+        if name in (
+            "attribute_exists",
+            "attribute_not_exists",
+            "begins_with",
+            "contains",
+        ):
+            if self.peek(1)[1] == "(":
+                return self._condition_function(name)
+        left = self.parse_operand()
+        if self.at("BETWEEN"):
+            self.take()
+            low = self.parse_operand()
+            self.take("AND")
+            high = self.parse_operand()
+            return lambda item: _compare(left(item), "<=", high(item)) and _compare(
+                low(item), "<=", left(item)
+            )
+        if self.at("IN"):
+            self.take()
+            self.take("(")
+            options = [self.parse_operand()]
+            while self.at(","):
+                self.take()
+                options.append(self.parse_operand())
+            self.take(")")
+            return lambda item: any(_compare(left(item), "=", o(item)) for o in options)
+        comparator = self.take()[1]
+        if comparator not in ("=", "<>", "<", "<=", ">", ">="):
+            raise self.error(f"Invalid comparator {comparator!r}")
+        right = self.parse_operand()
+        return lambda item: _compare(left(item), comparator, right(item))
+
+    def _condition_function(self, name):
+        self.take()
+        self.take("(")
+        path = self.parse_path()
+        if name in ("attribute_exists", "attribute_not_exists"):
+            self.take(")")
+            exists = name == "attribute_exists"
+            return lambda item: (get_path(item, path) is not MISSING) == exists
+        self.take(",")
+        operand = self.parse_operand()
+        self.take(")")
+        if name == "begins_with":
+
+            def condition(item):
+                value, prefix = get_path(item, path), operand(item)
+                return isinstance(value, (str, bytes)) and value.startswith(prefix)
+
+            return condition
+
+        def condition(item):
+            value = get_path(item, path)
+            return value is not MISSING and operand(item) in value
+
+        return condition
+
+    # Updates
+
+    def parse_update(self):
+        """Return the update as a list of (action, path, operand) tuples."""
+        actions = []
+        while not self.done():
+            clause = self.take()[1]
+            if clause not in ("SET", "REMOVE", "ADD", "DELETE"):
+                raise self.error(f"Invalid update clause {clause!r}")
+            while True:
+                path = self.parse_path()
+                if clause == "SET":
+                    self.take("=")
+                    actions.append((clause, path, self.parse_operand(arithmetic=True)))
+                elif clause == "REMOVE":
+                    actions.append((clause, path, None))
+                else:
+                    actions.append((clause, path, self.parse_operand()))
+                if not self.at(","):
+                    break
+                self.take()
+        return actions
+
+    def parse_projection(self):
+        paths = [self.parse_path()]
+        while self.at(","):
+            self.take()
+            paths.append(self.parse_path())
+        return paths
+
+
+def _compare(left, comparator, right):
+    if left is MISSING or right is MISSING:
+        return comparator == "<>" and left is not right
+    if comparator == "=":
+        return type(left) is type(right) and left == right
+    if comparator == "<>":
+        return type(left) is not type(right) or left != right
+    if type(left) is not type(right) or not isinstance(
+        left, (str, bytes, decimal.Decimal)
+    ):
+        return False
+    return {
+        "<": left < right,
+        "<=": left <= right,
+        ">": left > right,
+        ">=": left >= right,
+    }[comparator]
+
+
+def get_path(item, path):
+    value = item
+    for segment in path:
+        if isinstance(segment, int):
+            if not isinstance(value, list) or segment >= len(value):
+                return MISSING
+        elif not isinstance(value, dict) or segment not in value:
+            return MISSING
+        value = value[segment]
+    return value
+
+
+def _parent(item, path, operation_name):
+    parent = get_path(item, path[:-1])
+    if not isinstance(parent, (dict, list)):
+        raise _validation_error(
+            "The document path provided in the update expression is invalid for update",
+            operation_name,
+        )
+    return parent
+
+
+def project(item, paths):
+    """Return the attributes of item named by the projection paths."""
+    projected = {}
+    for path in paths:
+        value = get_path(item, path)
+        if value is MISSING:
+            continue
+        target = projected
+        for segment in path[:-1]:
+            target = target.setdefault(segment, {})
+        target[path[-1]] = copy.deepcopy(value)
+    return projected
+
+
+class _BatchWriter:
+    def __init__(self, table):
+        self.table = table
+        self.requests = []
+
+    def put_item(self, Item):
+        self.requests.append(("put", Item))
+
+    def delete_item(self, Key):
+        self.requests.append(("delete", Key))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # Flushed in chunks of 25 like BatchWriteItem
+        for start in range(0, len(self.requests), 25):
+            self.table.latencies.sleep("dynamodb.batch")
+            for kind, argument in self.requests[start : start + 25]:
+                if kind == "put":
+                    self.table._put(argument)
+                else:
+                    self.table._delete(argument)
+        self.requests = []
+        return False
+
+
+class FakeTable:
+    def __init__(self, name, key_names, latencies, stream=None):
+        self.name = name
+        self.table_name = name
+        self.key_names = tuple(key_names)
+        self.latencies = latencies
+        self.items = {}
+        self.stream = stream  # Receives (event_name, table, old, new) on changes
+        self._lock = threading.RLock()
+
+    def _key(self, key, operation_name):
+        if set(key) != set(self.key_names):
+            raise _validation_error(
+                "The provided key element does not match the schema", operation_name
+            )
+        return tuple(to_dynamodb(key[name]) for name in self.key_names)
+
+    def _check(self, item, condition, names, values, operation_name):
+        if condition is None:
+            return
+        if not isinstance(condition, str):
+            raise TypeError("Only string ConditionExpressions are supported")
+        parser = _Expression(condition, names, values, operation_name)
+        check = parser.parse_condition()
+        if not parser.done():
+            raise parser.error("Invalid ConditionExpression")
+        if not check(item or {}):
+            raise client_error(
+                "ConditionalCheckFailedException",
+                "The conditional request failed",
+                operation_name,
+            )
+
+    def _emit(self, old, new):
+        if self.stream is None or old == new:
+            return
+        event_name = "INSERT" if old is None else "REMOVE" if new is None else "MODIFY"
+        self.stream(event_name, self.name, copy.deepcopy(old), copy.deepcopy(new))
+
+    def _put(self, item):
+        item = to_dynamodb(item)
+        key = self._key({name: item.get(name) for name in self.key_names}, "PutItem")
+        with self._lock:
+            old = self.items.get(key)
+            self.items[key] = item
+        self._emit(old, item)
+        return old
+
+    def _delete(self, key):
+        with self._lock:
+            old = self.items.pop(self._key(key, "DeleteItem"), None)
+        self._emit(old, None)
+        return old
+
+    def put_item(
+        self,
+        Item,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ReturnValues="NONE",
+        **_,
+    ):
+        self.latencies.sleep("dynamodb.write")
+        with self._lock:
+            key = self._key({n: Item.get(n) for n in self.key_names}, "PutItem")
+            old = self.items.get(key)
+            self._check(
+                old,
+                ConditionExpression,
+                ExpressionAttributeNames,
+                ExpressionAttributeValues,
+                "PutItem",
+            )
+            self._put(Item)
+        if ReturnValues == "ALL_OLD" and old is not None:
+            return {"Attributes": copy.deepcopy(old)}
+        return {}
+
+    def get_item(
+        self,
+        Key,
+        ProjectionExpression=None,
+        ExpressionAttributeNames=None,
+        ConsistentRead=False,
+        **_,
+    ):
+        self.latencies.sleep("dynamodb.read")
+        item = self._read(Key, ProjectionExpression, ExpressionAttributeNames)
+        return {} if item is None else {"Item": item}
+
+    def _read(self, key, projection=None, names=None, operation_name="GetItem"):
+        with self._lock:
+            item = self.items.get(self._key(key, operation_name))
+            if item is None:
+                return None
+            if projection:
+                paths = _Expression(
+                    projection, names, None, operation_name
+                ).parse_projection()
+                return project(item, paths)
+            return copy.deepcopy(item)
+
+    def delete_item(
+        self,
+        Key,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ReturnValues="NONE",
+        **_,
+    ):
+        self.latencies.sleep("dynamodb.write")
+        with self._lock:
+            self._check(
+                self.items.get(self._key(Key, "DeleteItem")),
+                ConditionExpression,
+                ExpressionAttributeNames,
+                ExpressionAttributeValues,
+                "DeleteItem",
+            )
+            old = self._delete(Key)
+        if ReturnValues == "ALL_OLD" and old is not None:
+            return {"Attributes": old}
+        return {}
+
+    def update_item(
+        self,
+        Key,
+        UpdateExpression,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ReturnValues="NONE",
+        **_,
+    ):
+        self.latencies.sleep("dynamodb.write")
+        parser = _Expression(
+            UpdateExpression,
+            ExpressionAttributeNames,
+            ExpressionAttributeValues,
+            "UpdateItem",
+        )
+        actions = parser.parse_update()
+        with self._lock:
+            key = self._key(Key, "UpdateItem")
+            old = self.items.get(key)
+            self._check(
+                old,
+                ConditionExpression,
+                ExpressionAttributeNames,
+                ExpressionAttributeValues,
+                "UpdateItem",
+            )
+            item = copy.deepcopy(old) if old is not None else to_dynamodb(dict(Key))
+            # All operands see the item before the update
+            evaluated = [
+                (action, path, operand(old or {}) if operand else None)
+                for action, path, operand in actions
+            ]
+            for action, path, value in evaluated:
+                if path[0] in self.key_names:
+                    raise parser.error("Cannot update attribute of the key")
+                apply_update(item, action, path, value, parser)
+            self.items[key] = item
+        self._emit(old, item)
+
+        if ReturnValues in ("ALL_OLD", "UPDATED_OLD"):
+            attributes = copy.deepcopy(old or {})
+        elif ReturnValues in ("ALL_NEW", "UPDATED_NEW"):
+            attributes = copy.deepcopy(item)
+        else:
+            return {}
+        if ReturnValues.startswith("UPDATED_"):
+            updated = {path[0] for _, path, _ in actions}
+            attributes = {k: v for k, v in attributes.items() if k in updated}
+        return {"Attributes": attributes} if attributes else {}
+
+    def scan(
+        self,
+        ExclusiveStartKey=None,
+        Limit=None,
+        FilterExpression=None,
+        ProjectionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        **_,
+    ):
+        self.latencies.sleep("dynamodb.read")
+        with self._lock:
+            keys = sorted(self.items, key=lambda k: tuple(map(str, k)))
+            if ExclusiveStartKey:
+                start = self._key(ExclusiveStartKey, "Scan")
+                keys = [k for k in keys if tuple(map(str, k)) > tuple(map(str, start))]
+            page = keys[:Limit] if Limit else keys
+            items = [self.items[k] for k in page]
+            if FilterExpression:
+                check = _Expression(
+                    FilterExpression,
+                    ExpressionAttributeNames,
+                    ExpressionAttributeValues,
+                    "Scan",
+                ).parse_condition()
+                items = [item for item in items if check(item)]
+            if ProjectionExpression:
+                paths = _Expression(
+                    ProjectionExpression, ExpressionAttributeNames, None, "Scan"
+                ).parse_projection()
+                items = [project(item, paths) for item in items]
+            else:
+                items = copy.deepcopy(items)
+        response = {"Items": items, "Count": len(items), "ScannedCount": len(page)}
+        if Limit and len(keys) > Limit:
+            last = self.items[page[-1]]
+            response["LastEvaluatedKey"] = {n: last[n] for n in self.key_names}
+        return response
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return _BatchWriter(self)
+
+
+def apply_update(item, action, path, value, parser):
+    if action == "REMOVE":
+        parent = get_path(item, path[:-1])
+        if isinstance(parent, dict):
+            parent.pop(path[-1], None)
+        elif isinstance(parent, list) and path[-1] < len(parent):
+            del parent[path[-1]]
+        return
+    parent = _parent(item, path, parser.operation_name)
+    current = get_path(item, path)
+    if action == "ADD":
+        if current is MISSING:
+            current = (
+                decimal.Decimal(0) if isinstance(value, decimal.Decimal) else set()
+            )
+        if isinstance(value, decimal.Decimal) and isinstance(current, decimal.Decimal):
+            value = current + value
+        elif isinstance(value, set) and isinstance(current, set):
+            value = current | value
+        else:
+            raise parser.error("Incorrect operand type for operator or function")
+    elif action == "DELETE":
+        if current is MISSING:
+            return
+        value = current - value
+    if isinstance(parent, list):
+        if path[-1] < len(parent):
+            parent[path[-1]] = value
+        else:
+            parent.append(value)
+    else:
+        parent[path[-1]] = value
+
+
+class FakeDynamoDB:
+    """Fake of the boto3 DynamoDB service resource."""
+
+    # Key attributes of the tables the handlers use, others can be added
+    KEY_SCHEMAS = {
+        "cv_uploads": ("upload_id",),
+        "cv_upload_hashes": ("content_hash",),
+        "cv_vector_store_pool": ("slot",),
+        "cv_result_cache": ("cache_key",),
+        "cv_rate_limits": ("bucket",),
+        "cv_status_subscriptions": ("upload_id",),
+    }
+
+    def __init__(self, latencies, key_schemas=None, unprocessed_rate=0.0):
+        self.latencies = latencies
+        self.key_schemas = {**self.KEY_SCHEMAS, **(key_schemas or {})}
+        self.unprocessed_rate = unprocessed_rate  # Fraction of keys batch reads skip
+        self.stream_listeners = []
+        self.tables = {}
+        self._lock = threading.Lock()
+
+    def Table(self, name):
+        with self._lock:
+            if name not in self.tables:
+                if name not in self.key_schemas:
+                    raise KeyError(f"No key schema for the fake table {name}")
+                self.tables[name] = FakeTable(
+                    name, self.key_schemas[name], self.latencies, self._stream
+                )
+            return self.tables[name]
+
+    def _stream(self, event_name, table_name, old, new):
+        for listener in list(self.stream_listeners):
+            listener(event_name, table_name, old, new)
+
+    def batch_get_item(self, RequestItems, **_):
+        self.latencies.sleep("dynamodb.batch")
+        if sum(len(request["Keys"]) for request in RequestItems.values()) > 100:
+            raise _validation_error(
+                "Too many items requested for the BatchGetItem call", "BatchGetItem"
+            )
+        responses, unprocessed = {}, {}
+        for table_name, request in RequestItems.items():
+            table = self.Table(table_name)
+            items, skipped = [], []
+            for key in request["Keys"]:
+                if random.random() < self.unprocessed_rate:
+                    skipped.append(key)
+                    continue
+                # The keys of one request are read in parallel, one latency in total
+                item = table._read(
+                    key,
+                    request.get("ProjectionExpression"),
+                    request.get("ExpressionAttributeNames"),
+                    "BatchGetItem",
+                )
+                if item is not None:
+                    items.append(item)
+            responses[table_name] = items
+            if skipped:
+                unprocessed[table_name] = {**request, "Keys": skipped}
+        return {"Responses": responses, "UnprocessedKeys": unprocessed}
+
+
+def typed(value):
+    """Convert a value of a fake table to the DynamoDB JSON of stream records."""
+    if value is None:
+        return {"NULL": True}
+    if isinstance(value, bool):
+        return {"BOOL": value}
+    if isinstance(value, str):
+        return {"S": value}
+    if isinstance(value, decimal.Decimal):
+        return {"N": str(value)}
+    if isinstance(value, bytes):
+        return {"B": value}
+    if isinstance(value, dict):
+        return {"M": {k: typed(v) for k, v in value.items()}}
+    if isinstance(value, list):
+        return {"L": [typed(v) for v in value]}
+    if isinstance(value, (set, frozenset)):
+        if all(isinstance(v, str) for v in value):
+            return {"SS": sorted(value)}
+        if all(isinstance(v, bytes) for v in value):
+            return {"BS": sorted(value)}
+        return {"NS": sorted(str(v) for v in value)}
+    raise TypeError(f"Unsupported type {type(value)} for value {value!r}")
+
+
+class FakeStream:
+    """DynamoDB stream of one fake table delivered to a lambda handler.
+
+    Records (view type NEW_AND_OLD_IMAGES) are delivered one at a time in
+    write order after the simulated "dynamodb.stream" latency, from a
+    background thread like the event source mapping.
+    """
+
+    def __init__(self, dynamodb, table_name, handler):
+        self.latencies = dynamodb.latencies
+        self.table_name = table_name
+        self.key_names = dynamodb.key_schemas[table_name]
+        self.handler = handler
+        self.delivered = 0
+        self._queue = queue.Queue()
+        self._sequence = 0
+        self._lock = threading.Lock()
+        dynamodb.stream_listeners.append(self.on_change)
+        threading.Thread(target=self._deliver, daemon=True).start()
+
+    def on_change(self, event_name, table_name, old, new):
+        if table_name != self.table_name:
+            return
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        image = new if new is not None else old
+        record = {
+            "eventID": uuid.uuid4().hex,
+            "eventName": event_name,
+            "eventSource": "aws:dynamodb",
+            "dynamodb": {
+                "Keys": {name: typed(image[name]) for name in self.key_names},
+                "SequenceNumber": str(sequence),
+                "StreamViewType": "NEW_AND_OLD_IMAGES",
+            },
+        }
+        if old is not None:
+            record["dynamodb"]["OldImage"] = typed(old)["M"]
+        if new is not None:
+            record["dynamodb"]["NewImage"] = typed(new)["M"]
+        self._queue.put(
+            (time.monotonic() + self.latencies.seconds("dynamodb.stream"), record)
+        )
+
+    def _deliver(self):
+        while True:
+            due, record = self._queue.get()
+            time.sleep(max(0.0, due - time.monotonic()))
+            try:
+                self.handler({"Records": [record]}, None)
+            finally:
+                self.delivered += 1
+                self._queue.task_done()
+
+    def drain(self):
+        """Wait until every record written so far was delivered."""
+        self._queue.join()
+
+
+# API Gateway
+
+
+class FakeWebSocketAPI:
+    """API Gateway management API of a WebSocket stage, records posted messages."""
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.messages = collections.defaultdict(list)  # connection -> (time, data)
+        self.connections = set()
+        self._lock = threading.Lock()
+
+    def connect(self):
+        connection_id = f"{uuid.uuid4().hex[:14]}="
+        with self._lock:
+            self.connections.add(connection_id)
+        return connection_id
+
+    def disconnect(self, connection_id):
+        with self._lock:
+            self.connections.discard(connection_id)
+
+    def post_to_connection(self, ConnectionId, Data, **_):
+        self.latencies.sleep("apigateway.post")
+        with self._lock:
+            if ConnectionId not in self.connections:
+                raise client_error("GoneException", "", "PostToConnection")
+            self.messages[ConnectionId].append((time.perf_counter(), json.loads(Data)))
+        return {}
+
+
+# Step Functions
+
+
+class FakeStepFunctions:
+    """Records started executions, the local orchestrator replays them."""
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.executions = []
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def start_execution(self, stateMachineArn, input="{}", name=None, **_):
+        self.latencies.sleep("stepfunctions.start")
+        name = name or str(uuid.uuid4())
+        execution = {
+            "executionArn": stateMachineArn.replace(":stateMachine:", ":execution:")
+            + f":{name}",
+            "input": json.loads(input),
+            "startDate": datetime.datetime.now(datetime.timezone.utc),
+        }
+        with self._lock:
+            self.executions.append(execution)
+            self._pending.append(execution)
+        return {
+            "executionArn": execution["executionArn"],
+            "startDate": execution["startDate"],
+        }
+
+    def take_started(self):
+        """Return the executions started since the last call."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+
+class FakeLambda:
+    """Records the asynchronous invocations of other functions."""
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.invocations = []  # (function name, payload)
+        self._lock = threading.Lock()
+
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload=b"", **_):
+        self.latencies.sleep("lambda.invoke")
+        with self._lock:
+            self.invocations.append((FunctionName, json.loads(Payload)))
+        return {"StatusCode": 202 if InvocationType == "Event" else 200}
+
+
+# SQS
+
+
+class FakeSQS:
+    """In-memory queues with visibility timeouts and receive counts.
+
+    Timeouts and long polling waits are simulated seconds, scaled like the
+    latencies.
+    """
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.queues = {}  # url -> {"messages": [...], "visibility_timeout": s}
+        self._lock = threading.Condition()
+
+    def create_queue(self, QueueName, Attributes=None, **_):
+        url = f"https://sqs.eu-central-1.amazonaws.com/000000000000/{QueueName}"
+        with self._lock:
+            self.queues.setdefault(
+                url,
+                {
+                    "messages": [],
+                    "visibility_timeout": int(
+                        (Attributes or {}).get("VisibilityTimeout", 30)
+                    ),
+                },
+            )
+        return {"QueueUrl": url}
+
+    def _queue(self, url, operation_name):
+        queue = self.queues.get(url)
+        if queue is None:
+            raise client_error(
+                "AWS.SimpleQueueService.NonExistentQueue",
+                "The specified queue does not exist.",
+                operation_name,
+            )
+        return queue
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, **_):
+        self.latencies.sleep("sqs.send")
+        message = {
+            "MessageId": str(uuid.uuid4()),
+            "Body": MessageBody,
+            "ReceiptHandle": None,
+            "visible_at": time.monotonic() + DelaySeconds * self.latencies.scale,
+            "receive_count": 0,
+        }
+        with self._lock:
+            self._queue(QueueUrl, "SendMessage")["messages"].append(message)
+            self._lock.notify_all()
+        return {"MessageId": message["MessageId"]}
+
+    def send_message_batch(self, QueueUrl, Entries, **_):
+        if len(Entries) > 10:
+            raise client_error(
+                "AWS.SimpleQueueService.TooManyEntriesInBatchRequest",
+                "Maximum number of entries per request are 10.",
+                "SendMessageBatch",
+            )
+        successful = [
+            {
+                "Id": entry["Id"],
+                **self.send_message(
+                    QueueUrl, entry["MessageBody"], entry.get("DelaySeconds", 0)
+                ),
+            }
+            for entry in Entries
+        ]
+        return {"Successful": successful, "Failed": []}
+
+    def receive_message(
+        self,
+        QueueUrl,
+        MaxNumberOfMessages=1,
+        VisibilityTimeout=None,
+        WaitTimeSeconds=0,
+        **_,
+    ):
+        self.latencies.sleep("sqs.receive")
+        deadline = time.monotonic() + WaitTimeSeconds * self.latencies.scale
+        with self._lock:
+            queue = self._queue(QueueUrl, "ReceiveMessage")
+            timeout = (
+                queue["visibility_timeout"]
+                if VisibilityTimeout is None
+                else VisibilityTimeout
+            )
+            while True:
+                now = time.monotonic()
+                visible = [m for m in queue["messages"] if m["visible_at"] <= now]
+                if visible or now >= deadline:
+                    break
+                self._lock.wait(deadline - now)
+            received = []
+            for message in visible[:MaxNumberOfMessages]:
+                message["visible_at"] = now + timeout * self.latencies.scale
+                message["receive_count"] += 1
+                message["ReceiptHandle"] = uuid.uuid4().hex
+                received.append(
+                    {
+                        "MessageId": message["MessageId"],
+                        "ReceiptHandle": message["ReceiptHandle"],
+                        "Body": message["Body"],
+                        "Attributes": {
+                            "ApproximateReceiveCount": str(message["receive_count"])
+                        },
+                    }
+                )
+        return {"Messages": received} if received else {}
+
+    def _message(self, queue, receipt_handle, operation_name):
+        for message in queue["messages"]:
+            if message["ReceiptHandle"] == receipt_handle:
+                return message
+        raise client_error(
+            "ReceiptHandleIsInvalid",
+            f"The receipt handle {receipt_handle} is not valid.",
+            operation_name,
+        )
+
+    def delete_message(self, QueueUrl, ReceiptHandle, **_):
+        self.latencies.sleep("sqs.delete")
+        with self._lock:
+            queue = self._queue(QueueUrl, "DeleteMessage")
+            queue["messages"].remove(
+                self._message(queue, ReceiptHandle, "DeleteMessage")
+            )
+        return {}
+
+    def change_message_visibility(
+        self, QueueUrl, ReceiptHandle, VisibilityTimeout, **_
+    ):
+        self.latencies.sleep("sqs.delete")
+        with self._lock:
+            queue = self._queue(QueueUrl, "ChangeMessageVisibility")
+            message = self._message(queue, ReceiptHandle, "ChangeMessageVisibility")
+            message["visible_at"] = (
+                time.monotonic() + VisibilityTimeout * self.latencies.scale
+            )
+            self._lock.notify_all()
+        return {}
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=None, **_):
+        with self._lock:
+            messages = self._queue(QueueUrl, "GetQueueAttributes")["messages"]
+            now = time.monotonic()
+            visible = sum(1 for m in messages if m["visible_at"] <= now)
+        return {
+            "Attributes": {
+                "ApproximateNumberOfMessages": str(visible),
+                "ApproximateNumberOfMessagesNotVisible": str(len(messages) - visible),
+            }
+        }
+
+
+# OpenAI
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeAPITimeoutError(Exception):
+    """Raised like openai.APITimeoutError when a request outlasts its timeout."""
+
+
+def answers_json(answer):
+    start = answer.find("{")
+    return json.JSONDecoder().raw_decode(answer, start)[0]
+
+
+def scripted_answer(assistant_id, prompt):
+    """Default assistant answer, the sample resume as fenced JSON like the real ones."""
+    resume = json.dumps(sample_resume(), ensure_ascii=False, indent=2)
+    return f"```json\n{resume}\n```"
+
+
+class _Files:
+    def __init__(self, api):
+        self.api = api
+
+    def create(self, file, purpose="assistants", **_):
+        self.api.request("openai.file_upload")
+        name, content = (file[0], file[1]) if isinstance(file, tuple) else (None, file)
+        data = content.read() if hasattr(content, "read") else bytes(content)
+        file_id = self.api.new_id("file")
+        self.api.file_contents[file_id] = data
+        self.api.files_by_id[file_id] = SimpleNamespace(
+            id=file_id, object="file", bytes=len(data), filename=name, purpose=purpose
+        )
+        return self.api.files_by_id[file_id]
+
+    def delete(self, file_id, **_):
+        self.api.request("openai.file_delete")
+        self.api.file_contents.pop(file_id, None)
+        if self.api.files_by_id.pop(file_id, None) is None:
+            raise FakeAPIError(404, f"No such File object: {file_id}")
+        return SimpleNamespace(id=file_id, object="file", deleted=True)
+
+
+class _VectorStoreFiles:
+    def __init__(self, api):
+        self.api = api
+
+    def create(self, vector_store_id, file_id, **_):
+        self.api.request("openai.vector_store_file")
+        self.api.vector_store(vector_store_id).file_ids.add(file_id)
+        return SimpleNamespace(
+            id=file_id, vector_store_id=vector_store_id, status="completed"
+        )
+
+    def delete(self, file_id, vector_store_id, **_):
+        self.api.request("openai.vector_store_delete")
+        file_ids = self.api.vector_store(vector_store_id).file_ids
+        if file_id not in file_ids:
+            raise FakeAPIError(404, f"No file {file_id} in {vector_store_id}")
+        file_ids.discard(file_id)
+        return SimpleNamespace(id=file_id, deleted=True)
+
+    def list(self, vector_store_id, **_):
+        file_ids = sorted(self.api.vector_store(vector_store_id).file_ids)
+        return SimpleNamespace(
+            data=[
+                SimpleNamespace(id=f, vector_store_id=vector_store_id) for f in file_ids
+            ]
+        )
+
+
+class _VectorStores:
+    def __init__(self, api):
+        self.api = api
+        self.files = _VectorStoreFiles(api)
+
+    def create(self, name=None, file_ids=None, expires_after=None, **_):
+        self.api.request("openai.vector_store")
+        if file_ids:
+            self.api.latencies.sleep("openai.vector_store_file")
+        store_id = self.api.new_id("vs")
+        self.api.vector_stores_by_id[store_id] = SimpleNamespace(
+            id=store_id,
+            object="vector_store",
+            name=name,
+            file_ids=set(file_ids or []),
+            expires_after=expires_after,
+        )
+        return self.api.vector_stores_by_id[store_id]
+
+    def delete(self, vector_store_id, **_):
+        self.api.request("openai.vector_store_delete")
+        self.api.vector_store(vector_store_id)
+        del self.api.vector_stores_by_id[vector_store_id]
+        return SimpleNamespace(id=vector_store_id, deleted=True)
+
+
+class _Messages:
+    def __init__(self, api):
+        self.api = api
+
+    def create(self, thread_id, role="user", content="", **_):
+        self.api.request("openai.messages")
+        return self.api.add_message(thread_id, role, content)
+
+    def list(self, thread_id, order="desc", limit=20, **_):
+        self.api.request("openai.messages")
+        messages = list(self.api.thread(thread_id).messages)
+        if order == "desc":
+            messages.reverse()
+        return SimpleNamespace(data=messages[:limit])
+
+
+class _Runs:
+    def __init__(self, api):
+        self.api = api
+
+    def create(self, thread_id, assistant_id, stream=False, **kwargs):
+        self.api.request("openai.run_start")
+        self.api.thread(thread_id)
+        mode = self.api.assistants.get(assistant_id, "extraction")
+        run = SimpleNamespace(
+            id=self.api.new_id("run"),
+            object="thread.run",
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            status="queued",
+            created_at=int(time.time()),
+            completed_at=None,
+            response_format=kwargs.get("response_format"),
+        )
+        answer = self._answer(run)
+        self.api.answers_by_run[run.id] = answer
+        run.completes_at = (
+            time.monotonic()
+            + self.api.latencies.seconds(f"openai.run.{mode}")
+            + self.api.latencies.seconds("openai.answer_token") * len(answer) // 4
+        )
+        self.api.runs_by_id[run.id] = run
+        if stream:
+            return self._stream(run)
+        return copy.copy(run)
+
+    def _answer(self, run):
+        if run.id in self.api.answers_by_run:
+            return self.api.answers_by_run[run.id]
+        prompt = next(
+            (
+                m.content[0].text.value
+                for m in self.api.thread(run.thread_id).messages
+                if m.role == "user"
+            ),
+            "",
+        )
+        answer = self.api.responder(run.assistant_id, prompt)
+        if (run.response_format or {}).get("type") == "json_schema":
+            # Schema-constrained runs answer with the bare object
+            return json.dumps(answers_json(answer), ensure_ascii=False)
+        return answer
+
+    def _complete(self, run, answer):
+        self.api.add_message(run.thread_id, "assistant", answer, run_id=run.id)
+        run.status = "completed"
+        run.completed_at = int(time.time())
+
+    def _stream(self, run, chunk_size=24):
+        # Server-sent events of a streamed run, the answer arrives in small
+        # deltas spread over the simulated run time
+        def event(name, data):
+            return SimpleNamespace(event=name, data=data)
+
+        yield event("thread.run.created", copy.copy(run))
+        run.status = "in_progress"
+        answer = self._answer(run)
+        chunks = [answer[i : i + chunk_size] for i in range(0, len(answer), chunk_size)]
+        pause = max(0.0, run.completes_at - time.monotonic()) / max(1, len(chunks))
+        for chunk in chunks:
+            time.sleep(pause)
+            yield event(
+                "thread.message.delta",
+                SimpleNamespace(
+                    delta=SimpleNamespace(
+                        content=[
+                            SimpleNamespace(
+                                type="text", text=SimpleNamespace(value=chunk)
+                            )
+                        ]
+                    )
+                ),
+            )
+        self._complete(run, answer)
+        yield event("thread.run.completed", copy.copy(run))
+
+    def retrieve(self, run_id, thread_id, **_):
+        self.api.request("openai.run_poll")
+        run = self.api.runs_by_id.get(run_id)
+        if run is None or run.thread_id != thread_id:
+            raise FakeAPIError(404, f"No run found with id {run_id}")
+        if run.status in ("queued", "in_progress"):
+            if time.monotonic() >= run.completes_at:
+                self._complete(run, self._answer(run))
+            else:
+                run.status = "in_progress"
+        return copy.copy(run)
+
+    def list(self, thread_id, **_):
+        runs = [r for r in self.api.runs_by_id.values() if r.thread_id == thread_id]
+        return SimpleNamespace(data=[copy.copy(r) for r in reversed(runs)])
+
+
+class _Threads:
+    def __init__(self, api):
+        self.api = api
+        self.messages = _Messages(api)
+        self.runs = _Runs(api)
+
+    def create(self, messages=None, tool_resources=None, metadata=None, **_):
+        self.api.request("openai.thread")
+        thread_id = self.api.new_id("thread")
+        self.api.threads_by_id[thread_id] = SimpleNamespace(
+            id=thread_id,
+            object="thread",
+            messages=[],
+            tool_resources=tool_resources,
+            metadata=metadata or {},
+        )
+        for message in messages or []:
+            self.api.add_message(thread_id, message["role"], message["content"])
+        return self.api.threads_by_id[thread_id]
+
+    def create_and_run(self, assistant_id, thread=None, **kwargs):
+        thread = self.create(**(thread or {}))
+        return self.runs.create(thread.id, assistant_id, **kwargs)
+
+    def delete(self, thread_id, **_):
+        self.api.request("openai.thread")
+        self.api.threads_by_id.pop(thread_id, None)
+        return SimpleNamespace(id=thread_id, deleted=True)
+
+
+class _Completions:
+    def __init__(self, api, timeout=None):
+        self.api = api
+        self.timeout = timeout  # Seconds, set with FakeOpenAI.with_options
+
+    def create(self, model, messages, response_format=None, timeout=None, **_):
+        started = time.monotonic()
+        timeout = self.timeout if timeout is None else timeout
+        self.api.request("openai.completion")
+        self.api.completion_requests.append(
+            {"model": model, "messages": messages, "response_format": response_format}
+        )
+        resume = (
+            self.api.completion_responder(messages)
+            if self.api.completion_responder
+            else sample_resume()
+        )
+        content = json.dumps(resume, ensure_ascii=False)
+        answer_seconds = self.api.latencies.seconds("openai.answer_token") * (
+            len(content) // 4
+        )
+        if timeout is not None:
+            left = timeout - (time.monotonic() - started)
+            if answer_seconds > left:
+                time.sleep(max(0.0, left))
+                raise FakeAPITimeoutError("Request timed out.")
+        if answer_seconds > 0:
+            time.sleep(answer_seconds)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+        return SimpleNamespace(
+            id=self.api.new_id("chatcmpl"),
+            model=model,
+            choices=[
+                SimpleNamespace(
+                    index=0,
+                    finish_reason="stop",
+                    message=SimpleNamespace(
+                        role="assistant", content=content, refusal=None
+                    ),
+                )
+            ],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=len(content) // 4,
+                total_tokens=prompt_tokens + len(content) // 4,
+            ),
+        )
+
+
+class FakeOpenAI:
+    """Fake OpenAI client whose assistants answer with a scripted responder.
+
+    responder(assistant_id, prompt) returns the text of the assistant message,
+    assistants maps assistant ids to the mode deciding the simulated run time.
+    completion_responder(messages), if set, returns the resume of a chat
+    completion instead of sample_resume().
+    With rpm set, requests beyond rpm per simulated minute (60 seconds times
+    the latency scale) fail with status 429 like the real rate limit.
+    """
+
+    def __init__(self, latencies, responder=scripted_answer, assistants=None, rpm=None):
+        self.latencies = latencies
+        self.rpm = rpm
+        self.request_times = collections.deque()
+        self.rejected = 0
+        self.request_counts = collections.Counter()  # operation -> accepted requests
+        self.peak_requests = 0  # Most requests accepted within one simulated minute
+        self.responder = responder
+        self.assistants = assistants or {
+            EXTRACTION_ASSISTANT_ID: "extraction",
+            CORRECTION_ASSISTANT_ID: "correction",
+        }
+        self.completion_responder = None
+        self.files_by_id = {}
+        self.file_contents = {}  # file_id -> uploaded bytes
+        self.answers_by_run = {}
+        self.vector_stores_by_id = {}
+        self.threads_by_id = {}
+        self.runs_by_id = {}
+        self.completion_requests = []
+        self._lock = threading.Lock()
+        self.files = _Files(self)
+        self.beta = SimpleNamespace(
+            vector_stores=_VectorStores(self), threads=_Threads(self)
+        )
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+    def with_options(self, timeout=None, **_):
+        if timeout is None:
+            return self
+        # Only the completions honour the timeout, also as request option
+        return SimpleNamespace(
+            chat=SimpleNamespace(completions=_Completions(self, timeout))
+        )
+
+    def request(self, operation):
+        """Count one request against the rate limit and wait its latency."""
+        if self.rpm:
+            with self._lock:
+                now = time.monotonic()
+                while self.request_times and (
+                    self.request_times[0] <= now - 60 * self.latencies.scale
+                ):
+                    self.request_times.popleft()
+                if len(self.request_times) >= self.rpm:
+                    self.rejected += 1
+                    raise FakeAPIError(429, "Rate limit reached for requests")
+                self.request_times.append(now)
+                self.peak_requests = max(self.peak_requests, len(self.request_times))
+        with self._lock:
+            self.request_counts[operation] += 1
+        self.latencies.sleep(operation)
+
+    def new_id(self, prefix):
+        return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+    def vector_store(self, vector_store_id):
+        store = self.vector_stores_by_id.get(vector_store_id)
+        if store is None:
+            raise FakeAPIError(404, f"No vector store found with id {vector_store_id}")
+        return store
+
+    def thread(self, thread_id):
+        thread = self.threads_by_id.get(thread_id)
+        if thread is None:
+            raise FakeAPIError(404, f"No thread found with id {thread_id}")
+        return thread
+
+    def add_message(self, thread_id, role, content, run_id=None):
+        message = SimpleNamespace(
+            id=self.new_id("msg"),
+            object="thread.message",
+            thread_id=thread_id,
+            role=role,
+            run_id=run_id,
+            created_at=int(time.time()),
+            content=[
+                SimpleNamespace(
+                    type="text", text=SimpleNamespace(value=content, annotations=[])
+                )
+            ],
+        )
+        with self._lock:
+            self.thread(thread_id).messages.append(message)
+        return message
+
+
+class FakeAsyncOpenAI:
+    """AsyncOpenAI facade of a FakeOpenAI for clients.async_openai().
+
+    Every method becomes a coroutine running the fake request in a worker
+    thread, so concurrent requests overlap like on the real endpoint.
+    """
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if callable(value):
+
+            async def request(*args, **kwargs):
+                return await asyncio.to_thread(value, *args, **kwargs)
+
+            return request
+        if isinstance(value, SimpleNamespace) or hasattr(value, "api"):
+            return FakeAsyncOpenAI(value)  # A resource like beta.threads
+        return value
+
+
+class FakeCloud:
+    """All fakes of one local environment."""
+
+    def __init__(
+        self, latency_scale=1.0, latency_overrides=None, responder=None, openai_rpm=None
+    ):
+        self.latencies = Latencies(latency_scale, latency_overrides)
+        self.s3 = FakeS3(self.latencies)
+        self.dynamodb = FakeDynamoDB(self.latencies)
+        self.stepfunctions = FakeStepFunctions(self.latencies)
+        self.sqs = FakeSQS(self.latencies)
+        self.websocket = FakeWebSocketAPI(self.latencies)
+        self.lambda_ = FakeLambda(self.latencies)
+        self.openai = FakeOpenAI(
+            self.latencies, responder or scripted_answer, rpm=openai_rpm
+        )
+
+    def install(self):
+        """Replace the pooled clients of cvision_runtime with the fakes."""
+        from cvision_runtime import clients
+
+        clients.reset()
+        clients.install("s3", self.s3)
+        clients.install("stepfunctions", self.stepfunctions)
+        clients.install("sqs", self.sqs)
+        clients.install("lambda", self.lambda_)
+        clients.install(f"websocket:{WEBSOCKET_ENDPOINT}", self.websocket)
+        clients.install("dynamodb_resource", self.dynamodb)
+        clients.install("openai", self.openai)
+        clients.install("async_openai", FakeAsyncOpenAI(self.openai))
+
+    def table(self, name):
+        return self.dynamodb.Table(name)
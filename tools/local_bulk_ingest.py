@@ -0,0 +1,124 @@
+"""Run the bulk ingestion in process against in-memory fakes, optionally crashing a worker.
+
+Puts generated sample CVs below a prefix of the fake S3 bucket, enqueues them
+with bulk_ingestion.enqueue_handler and runs workers until the queue is
+empty. With --crash-after the first worker dies after that many checkpoints,
+its messages are delivered again after the visibility timeout and the next
+worker continues from their checkpoints. The report counts the OpenAI files
+and runs, only the work of a crashed job since its last checkpoint is repeated.
+
+    python tools/local_bulk_ingest.py --cvs 200 --parallelism 16
+    python tools/local_bulk_ingest.py --cvs 50 --crash-after 40
+"""
+
+import argparse
+import collections
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "layers", "cvision_runtime", "python"))
+sys.path.insert(0, os.path.join(ROOT, "initialUpload"))
+
+import fakes  # noqa: E402
+from local_pipeline import sample_cv_pdf  # noqa: E402
+
+BUCKET = "cv-uploaded-resumes"
+PREFIX = "historical/"
+
+
+class SimulatedCrash(BaseException):
+    """Ends the worker like a killed process, the job code doesn't catch it."""
+
+
+def crash_after(job_class, checkpoints):
+    # Replaces save_checkpoint so that the given number of checkpoints succeed
+    save_checkpoint = job_class.save_checkpoint
+    remaining = [checkpoints]
+
+    def crashing(self, step):
+        remaining[0] -= 1
+        if remaining[0] < 0:
+            raise SimulatedCrash(f"Worker crashed before checkpoint {step}")
+        save_checkpoint(self, step)
+
+    job_class.save_checkpoint = crashing
+    return lambda: setattr(job_class, "save_checkpoint", save_checkpoint)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cvs", type=int, default=50, help="CVs to ingest")
+    parser.add_argument("--parallelism", type=int, default=8)
+    parser.add_argument("--latency-scale", type=float, default=0.01)
+    parser.add_argument(
+        "--crash-after", type=int, metavar="CHECKPOINTS", help="Crash the first worker"
+    )
+    parser.add_argument(
+        "--extraction-mode", choices=("auto", "assistant"), default="assistant"
+    )
+    parser.add_argument("--log", help="Write the handler output to this file")
+    args = parser.parse_args()
+
+    scale = args.latency_scale
+    cloud = fakes.FakeCloud(latency_scale=scale)
+    queue_url = cloud.sqs.create_queue(QueueName="cv-bulk-ingestion")["QueueUrl"]
+    # The handlers read their configuration at import time
+    os.environ["EXTRACTION_MODE"] = args.extraction_mode
+    os.environ["BULK_QUEUE_URL"] = queue_url
+    os.environ["INGEST_RUN_POLL_SECONDS"] = str(5 * scale)
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+    cloud.install()
+    import bulk_ingestion
+
+    for index in range(args.cvs):
+        cloud.s3.put_object(
+            Bucket=BUCKET, Key=f"{PREFIX}cv_{index}.pdf", Body=sample_cv_pdf(index)
+        )
+
+    log = io.StringIO()
+    workers = []
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        enqueued = bulk_ingestion.enqueue_handler(
+            {"bucket": BUCKET, "prefix": PREFIX}, None
+        )
+        restore = None
+        if args.crash_after is not None:
+            restore = crash_after(bulk_ingestion.IngestionJob, args.crash_after)
+        while True:
+            attributes = cloud.sqs.get_queue_attributes(QueueUrl=queue_url)
+            if not sum(int(value) for value in attributes["Attributes"].values()):
+                break
+            try:
+                outcomes = bulk_ingestion.run_worker(queue_url, args.parallelism)
+            except SimulatedCrash as e:
+                outcomes = {"crashed": str(e)}
+                restore()
+            if outcomes:
+                workers.append(outcomes)
+            else:  # The remaining messages are still invisible
+                time.sleep(bulk_ingestion.VISIBILITY_TIMEOUT * scale / 10)
+    elapsed = time.perf_counter() - started
+    if args.log:
+        with open(args.log, "w", encoding="utf-8") as f:
+            f.write(log.getvalue())
+
+    items = cloud.table("cv_uploads").items.values()
+    statuses = collections.Counter(item["process_status"] for item in items)
+    print(f"Enqueued {enqueued['enqueued']} CVs, skipped {enqueued['skipped']}")
+    for index, outcomes in enumerate(workers, start=1):
+        print(f"Worker {index}: {outcomes}")
+    print(f"Final statuses: {dict(statuses)}")
+    print(
+        f"OpenAI files uploaded: {len(cloud.openai.files_by_id)}, "
+        f"runs started: {len(cloud.openai.runs_by_id)}"
+    )
+    print(f"Wall time {elapsed:.1f}s, {elapsed / scale / 60:.1f} simulated minutes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,503 @@
+"""Run the CV extraction pipeline in process against in-memory fakes.
+
+Chains the lambda handlers like the deployed pipeline does: initialUpload
+starts the state machine, the replayed state machine creates the thread and
+run of the assistant and polls it, then calls startOutputCorrection (mode
+"extraction") or saveDataToDatabase (mode "correction") with the execution
+input plus threadCreationOutput. With --orchestrator the runs are queued
+instead and drained into runOrchestrator invocations, like the SQS event
+source mapping with a batching window. S3, DynamoDB, Step Functions, SQS and
+OpenAI are the fakes of tools/fakes.py, their simulated latencies are scaled
+by --latency-scale. Prints the wall time of every stage per upload.
+
+    python tools/local_pipeline.py --files 3 --runs 5 --latency-scale 0.02
+    python tools/local_pipeline.py --files 50 --orchestrator
+    python tools/local_pipeline.py --pdf cv.pdf --extraction-mode auto
+"""
+
+import argparse
+import base64
+import concurrent.futures
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "layers", "cvision_runtime", "python"))
+
+import fakes  # noqa: E402
+
+HANDLERS = (
+    "initialUpload",
+    "streamExtraction",
+    "startOutputCorrection",
+    "saveDataToDatabase",
+    "checkUploadStatus",
+    "runOrchestrator",
+    "statusNotifications",
+)
+FINAL_STATUSES = ("ready_to_retrieve", "failed")
+# Simulated seconds between two polls of a run, like the Wait state of the state machine
+POLL_INTERVAL = 5.0
+# Order of the stages in the report
+STAGES = (
+    "initialUpload",
+    "extraction_run",
+    "startOutputCorrection",
+    "correction_run",
+    "saveDataToDatabase",
+    "runOrchestrator",
+    "checkUploadStatus",
+    "first_section",
+    "end_to_end",
+    "poll_lag",
+    "push_lag",
+)
+
+
+def load_handler(folder):
+    """Import the lambda_function module of a handler folder under a unique name."""
+    directory = os.path.join(ROOT, folder)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)  # Sibling modules like formdata
+    spec = importlib.util.spec_from_file_location(
+        f"{folder}_lambda_function", os.path.join(directory, "lambda_function.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def sample_pdf(lines):
+    """Build a one page PDF with a text layer showing lines."""
+
+    def escape(line):
+        return (
+            line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        ).encode("latin-1", "replace")
+
+    content = b"BT /F1 11 Tf 14 TL 50 800 Td\n"
+    content += b"".join(b"(" + escape(line) + b") Tj T*\n" for line in lines)
+    content += b"ET"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        b"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica "
+        b"/Encoding /WinAnsiEncoding >>",
+        b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content),
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\n" % (len(objects) + 1)
+    pdf += b"startxref\n%d\n%%%%EOF\n" % xref
+    return bytes(pdf)
+
+
+def sample_cv_pdf(index):
+    # Every sample differs so the content hash dedup does not catch them
+    resume = fakes.sample_resume(surname=f"Schmidt {index}")
+    lines = [f"Lebenslauf {index}"]
+    for section, value in resume.items():
+        lines.append(section)
+        lines.extend(f"  {line}" for line in json.dumps(value).split(", "))
+    return sample_pdf(lines)
+
+
+def multipart_event(files, headers=None):
+    """Build the API Gateway event of a multipart upload of (name, bytes) files."""
+    boundary = "----cvisionLocalBoundary"
+    body = b""
+    for name, data in files:
+        body += (
+            (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'
+                "Content-Type: application/pdf\r\n\r\n"
+            ).encode()
+            + data
+            + b"\r\n"
+        )
+    body += f"--{boundary}--\r\n".encode()
+    return {
+        "headers": {
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+            **(headers or {}),
+        },
+        "body": base64.b64encode(body).decode(),
+        "isBase64Encoded": True,
+    }
+
+
+class LocalPipeline:
+    def __init__(self, cloud, handlers, orchestrator_queue=None, status_stream=None):
+        self.cloud = cloud
+        self.handlers = handlers
+        self.orchestrator_queue = orchestrator_queue
+        # FakeStream of cv_uploads publishing to the subscribed status WebSocket
+        self.status_stream = status_stream
+        self.finished = {}  # upload_id -> time the final status was saved
+        self.poll_interval = POLL_INTERVAL * cloud.latencies.scale
+        self.first_section = {}  # upload_id -> time the first partial section was saved
+        cloud.dynamodb.stream_listeners.append(self.on_change)
+
+    def on_change(self, event_name, table_name, old, new):
+        if table_name == "cv_uploads" and new and new.get("partial_cv_data"):
+            self.first_section.setdefault(new["upload_id"], time.perf_counter())
+        if (
+            table_name == "cv_uploads"
+            and new
+            and new["process_status"] in FINAL_STATUSES
+        ):
+            self.finished.setdefault(new["upload_id"], time.perf_counter())
+
+    def run(self, files, headers=None):
+        """Upload files and replay every execution, returns the stage timings per upload."""
+        started = time.perf_counter()
+        response = self.handlers["initialUpload"].lambda_handler(
+            multipart_event(files, headers), None
+        )
+        upload_time = time.perf_counter() - started
+        body = json.loads(response["body"])
+        uploads = body.get("uploads", []) if isinstance(body, dict) else []
+        timings = {
+            u["uploadId"]: {"initialUpload": upload_time}
+            for u in uploads
+            if "uploadId" in u
+        }
+        connection_id = None
+        if self.status_stream:
+            connection_id = self.subscribe(list(timings))
+
+        if self.orchestrator_queue:
+            self.orchestrate(timings)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=32) as executor:
+            running = set()
+            while True:
+                for execution in self.cloud.stepfunctions.take_started():
+                    running.add(executor.submit(self.replay, execution, timings))
+                if not running:
+                    break
+                done, running = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    future.result()
+
+        if self.status_stream:
+            self.status_stream.drain()
+        for upload_id, stages in timings.items():
+            saved = self.finished.pop(upload_id, None)
+            finished = stages.pop("finished", None) or saved
+            stages["end_to_end"] = (finished or time.perf_counter()) - started
+            if connection_id and saved:
+                self.status_lags(upload_id, stages, started + upload_time, saved)
+                pushed = [
+                    received
+                    for received, message in self.cloud.websocket.messages[
+                        connection_id
+                    ]
+                    if message["upload_id"] == upload_id
+                    and message["process_status"] in FINAL_STATUSES
+                ]
+                if pushed:
+                    stages["push_lag"] = pushed[0] - saved
+            if upload_id in self.first_section:
+                stages["first_section"] = self.first_section.pop(upload_id) - started
+            check_started = time.perf_counter()
+            status = self.handlers["checkUploadStatus"].lambda_handler(
+                {"queryStringParameters": {"upload_id": upload_id}}, None
+            )
+            stages["checkUploadStatus"] = time.perf_counter() - check_started
+            stages["process_status"] = json.loads(status["body"])["process_status"]
+        return timings
+
+    def subscribe(self, upload_ids):
+        """Subscribe to the status of upload_ids like the frontend, returns the connection."""
+        connection_id = self.cloud.websocket.connect()
+        self.handlers["statusNotifications"].lambda_handler(
+            {
+                "requestContext": {
+                    "routeKey": "subscribe",
+                    "connectionId": connection_id,
+                },
+                "body": json.dumps({"action": "subscribe", "upload_ids": upload_ids}),
+            },
+            None,
+        )
+        return connection_id
+
+    def status_lags(self, upload_id, stages, polling_since, saved):
+        # The frontend without push polls every POLL_INTERVAL after the upload
+        # response, poll_lag is the wait from the save to the next poll
+        interval = self.poll_interval
+        polls = int((saved - polling_since) // interval) + 1
+        stages["status_polls"] = polls
+        stages["poll_lag"] = polling_since + polls * interval - saved
+
+    def orchestrate(self, timings):
+        """Deliver the queued runs to runOrchestrator until the queue is empty."""
+        sqs = self.cloud.sqs
+        while True:
+            messages = []
+            while True:
+                received = sqs.receive_message(
+                    QueueUrl=self.orchestrator_queue, MaxNumberOfMessages=10
+                ).get("Messages", [])
+                if not received:
+                    break
+                messages += received
+            if not messages:
+                attributes = sqs.get_queue_attributes(QueueUrl=self.orchestrator_queue)
+                if not sum(int(v) for v in attributes["Attributes"].values()):
+                    return
+                time.sleep(self.poll_interval)  # Delayed hand-offs
+                continue
+            event = {
+                "Records": [
+                    {"messageId": m["MessageId"], "body": m["Body"]} for m in messages
+                ]
+            }
+            started = time.perf_counter()
+            response = self.handlers["runOrchestrator"].lambda_handler(event, None)
+            elapsed = time.perf_counter() - started
+            failed = {f["itemIdentifier"] for f in response["batchItemFailures"]}
+            for message in messages:
+                if message["MessageId"] not in failed:
+                    sqs.delete_message(
+                        QueueUrl=self.orchestrator_queue,
+                        ReceiptHandle=message["ReceiptHandle"],
+                    )
+                stages = timings.setdefault(
+                    json.loads(message["Body"])["upload_id"], {}
+                )
+                stages["runOrchestrator"] = stages.get("runOrchestrator", 0) + elapsed
+
+    def openai(self):
+        # Client of the OpenAI requests the state machine sends itself
+        return self.cloud.openai
+
+    def state(self, function, *args, **kwargs):
+        """Run one state of an execution, simulations add the Retry of the states."""
+        return function(*args, **kwargs)
+
+    def replay(self, execution, timings):
+        """Run one state machine execution, the definition lives in the AWS console."""
+        state = execution["input"]
+        mode = state["mode"]
+        stages = timings.setdefault(state["upload_id"], {})
+        if state.get("stream"):
+            started = time.perf_counter()
+            output = self.state(
+                self.handlers["streamExtraction"].lambda_handler, state, None
+            )
+            stages[f"{mode}_run"] = time.perf_counter() - started
+            self.finish(state, output, stages)
+            return
+
+        client = self.openai()
+        started = time.perf_counter()
+        thread = self.state(
+            client.beta.threads.create,
+            messages=[{"role": "user", "content": state["prompt"]}],
+            tool_resources={
+                "file_search": {"vector_store_ids": state["vectorstore_ids"]}
+            },
+        )
+        run = self.state(
+            client.beta.threads.runs.create,
+            thread_id=thread.id,
+            assistant_id=state["assistant_id"],
+            response_format=state.get("response_format"),
+        )
+        while run.status in ("queued", "in_progress"):
+            time.sleep(self.poll_interval)
+            run = self.state(
+                client.beta.threads.runs.retrieve, run.id, thread_id=thread.id
+            )
+        stages[f"{mode}_run"] = time.perf_counter() - started
+        if run.status != "completed":
+            raise RuntimeError(f"Run {run.id} of {state['upload_id']} {run.status}")
+        self.finish(state, {"thread_id": thread.id}, stages)
+
+    def finish(self, state, thread_output, stages):
+        mode = state["mode"]
+        event = {**state, "threadCreationOutput": thread_output}
+        handler = (
+            "startOutputCorrection" if mode == "extraction" else "saveDataToDatabase"
+        )
+        started = time.perf_counter()
+        self.state(self.handlers[handler].lambda_handler, event, None)
+        finished = time.perf_counter()
+        stages[handler] = finished - started
+        # Without a correction run startOutputCorrection saves the result itself
+        stages["finished"] = finished
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def print_report(results, latency_scale):
+    print(f"\nStage timings in seconds (simulated latencies x{latency_scale})")
+    print(f"{'stage':<24}{'n':>5}{'p50':>10}{'p95':>10}{'max':>10}")
+    for stage in STAGES:
+        values = [t[stage] for t in results if stage in t]
+        if values:
+            print(
+                f"{stage:<24}{len(values):>5}{statistics.median(values):>10.3f}"
+                f"{percentile(values, 0.95):>10.3f}{max(values):>10.3f}"
+            )
+    statuses = {}
+    for t in results:
+        statuses[t.get("process_status")] = statuses.get(t.get("process_status"), 0) + 1
+    print(f"Final statuses: {statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", action="append", help="PDF to upload, repeatable")
+    parser.add_argument(
+        "--files", type=int, default=1, help="Generated sample PDFs per request"
+    )
+    parser.add_argument("--runs", type=int, default=1, help="Requests to send")
+    parser.add_argument("--latency-scale", type=float, default=0.01)
+    parser.add_argument(
+        "--extraction-mode", choices=("auto", "assistant"), default="assistant"
+    )
+    parser.add_argument("--vector-store-pool", type=int, default=0, metavar="SIZE")
+    parser.add_argument(
+        "--stream", action="store_true", help="Run the extraction with streamExtraction"
+    )
+    parser.add_argument(
+        "--correction-threshold",
+        type=float,
+        default=0.9,
+        help="Confidence to skip the correction run, above 1 always corrects",
+    )
+    parser.add_argument(
+        "--force-reextract",
+        action="store_true",
+        help="Skip the content hash dedup, needed to upload the same --pdf repeatedly",
+    )
+    parser.add_argument(
+        "--cache-bust",
+        action="store_true",
+        help="Ignore the result cache, the runs happen for every upload",
+    )
+    parser.add_argument(
+        "--orchestrator",
+        action="store_true",
+        help="Drive the runs with runOrchestrator instead of the state machine",
+    )
+    parser.add_argument(
+        "--push",
+        action="store_true",
+        help="Push status changes over the status WebSocket, compared with polling",
+    )
+    parser.add_argument("--log", help="Write the handler output to this file")
+    parser.add_argument("--json", action="store_true", help="Print raw timings as JSON")
+    args = parser.parse_args()
+
+    # The handlers read their configuration at import time
+    os.environ["EXTRACTION_MODE"] = args.extraction_mode
+    os.environ["VECTOR_STORE_POOL_SIZE"] = str(args.vector_store_pool)
+    os.environ["EXTRACTION_STREAMING"] = str(args.stream).lower()
+    os.environ["CORRECTION_SKIP_THRESHOLD"] = str(args.correction_threshold)
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+
+    cloud = fakes.FakeCloud(latency_scale=args.latency_scale)
+    queue_url = None
+    if args.orchestrator:
+        queue_url = cloud.sqs.create_queue(
+            QueueName="cv-run-orchestrator", Attributes={"VisibilityTimeout": "900"}
+        )["QueueUrl"]
+        os.environ["ORCHESTRATION"] = "orchestrator"
+        os.environ["ORCHESTRATOR_QUEUE_URL"] = queue_url
+        # Poll delays of the orchestrator in simulated seconds
+        for name, seconds in (("MIN", 2.0), ("MAX", 8.0)):
+            os.environ[f"ORCHESTRATOR_POLL_{name}_SECONDS"] = str(
+                seconds * args.latency_scale
+            )
+    os.environ["STATUS_SOCKET_ENDPOINT"] = fakes.WEBSOCKET_ENDPOINT
+    cloud.install()
+    handlers = {name: load_handler(name) for name in HANDLERS}
+    status_stream = None
+    if args.push:
+        import stream_publisher  # Next to statusNotifications/lambda_function.py
+
+        status_stream = fakes.FakeStream(
+            cloud.dynamodb, "cv_uploads", stream_publisher.lambda_handler
+        )
+    pipeline = LocalPipeline(cloud, handlers, queue_url, status_stream)
+
+    headers = {}
+    if args.force_reextract:
+        headers["force_reextract"] = "true"
+    if args.cache_bust:
+        headers["cache_bust"] = "true"
+    results = []
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        for run in range(args.runs):
+            if args.pdf:
+                files = []
+                for path in args.pdf:
+                    with open(path, "rb") as f:
+                        files.append((os.path.basename(path), f.read()))
+            else:
+                files = [
+                    (f"cv_{run}_{i}.pdf", sample_cv_pdf(f"{run}-{i}"))
+                    for i in range(args.files)
+                ]
+            results.extend(pipeline.run(files, headers).values())
+    if args.log:
+        with open(args.log, "w") as f:
+            f.write(log.getvalue())
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    print_report(results, args.latency_scale)
+    if args.push:
+        polls = sum(t.get("status_polls", 0) for t in results)
+        # The frontend reads the status after a final push, partial sections
+        # at most once per poll interval
+        fetches = 0
+        section_reads = {}
+        for messages in cloud.websocket.messages.values():
+            for received, message in messages:
+                if message["process_status"] in FINAL_STATUSES:
+                    fetches += 1
+                elif message.get("sections"):
+                    last = section_reads.get(message["upload_id"])
+                    if last is None or received - last >= pipeline.poll_interval:
+                        section_reads[message["upload_id"]] = received
+                        fetches += 1
+        print(
+            f"checkUploadStatus calls: {polls} polling every {POLL_INTERVAL:.0f} "
+            f"simulated seconds, {fetches} with push"
+        )
+    from cvision_runtime import clients
+
+    print(
+        f"Lambda invocations: {clients.stats()['invocations']}, "
+        f"state machine executions: {len(cloud.stepfunctions.executions)}, "
+        f"run polls: {cloud.openai.request_counts['openai.run_poll']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
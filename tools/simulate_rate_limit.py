@@ -0,0 +1,221 @@
+"""Drive simulated uploads through the lambda handlers against a fixed RPM.
+
+Every upload is a client posting one generated CV to initialUpload, all
+clients start at once like a bulk import. A file answered with 429 is
+uploaded again after its Retry-After like the frontend does. The state
+machine executions are replayed like tools/local_pipeline.py, with the
+extraction and the correction run of the assistants. The OpenAI requests of
+the handlers and of the replayed states go through clients.openai(), so with
+the limiter enabled they wait for tokens of the shared DynamoDB bucket. A
+state failing with a rate limit error is retried like the Retry of the state
+machine states (see README), after the last attempt the upload is marked
+failed like the Catch does. Time is simulated: one minute of the endpoint
+lasts 60 seconds times --latency-scale, the Retry-After seconds as well.
+
+With the limiter the run fails unless every upload is ready and the endpoint
+answered no request with 429.
+
+    python tools/simulate_rate_limit.py --uploads 500 --rpm 300
+    python tools/simulate_rate_limit.py --no-limiter --retries 0
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "layers", "cvision_runtime", "python"))
+
+import fakes  # noqa: E402
+import local_pipeline  # noqa: E402
+
+# Retry of the states in simulated seconds: IntervalSeconds, BackoffRate
+RETRY_INTERVAL = 2.0
+RETRY_BACKOFF = 2.0
+# Real seconds the handlers of a request may spend on CPU, e.g. in PyMuPDF
+CPU_SECONDS = 1.0
+# Longest wait of the frontend before uploading a file answered with 429 again
+UPLOAD_MAX_RETRY_SECONDS = 60
+
+
+class RateLimitedPipeline(local_pipeline.LocalPipeline):
+    """Replays the executions with the shared limiter and the Retry of the states."""
+
+    def __init__(self, cloud, handlers, retries):
+        super().__init__(cloud, handlers)
+        self.retries = retries
+        self.retried = 0
+        self.lock = threading.Lock()
+
+    def openai(self):
+        from cvision_runtime import clients
+
+        return clients.openai()
+
+    def state(self, function, *args, **kwargs):
+        from cvision_runtime import rate_limit
+
+        interval = RETRY_INTERVAL
+        for attempt in range(self.retries + 1):
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                if not rate_limit.is_rate_limited(e) or attempt == self.retries:
+                    raise
+                with self.lock:
+                    self.retried += 1
+                time.sleep(interval * self.cloud.latencies.scale)
+                interval *= RETRY_BACKOFF
+
+
+def retry_delay(retry_after, attempt):
+    # Like the frontend: Retry-After doubled per attempt, at most UPLOAD_MAX_RETRY_SECONDS
+    return min(UPLOAD_MAX_RETRY_SECONDS, retry_after * 2**attempt)
+
+
+def upload(handler, index, max_retries, scale):
+    """Upload one CV like the frontend, returns (upload_id or None, 429 answers)."""
+    files = [(f"cv_{index}.pdf", local_pipeline.sample_cv_pdf(index))]
+    limited = 0
+    for attempt in range(max_retries + 1):
+        response = handler.lambda_handler(
+            local_pipeline.multipart_event(files, {"cache_bust": "true"}), None
+        )
+        if response["statusCode"] != 429:
+            break
+        limited += 1
+        if attempt < max_retries:
+            time.sleep(
+                retry_delay(int(response["headers"]["Retry-After"]), attempt) * scale
+            )
+    body = json.loads(response["body"])
+    return (body.get("uploadId") if isinstance(body, dict) else None), limited
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uploads", type=int, default=500)
+    parser.add_argument(
+        "--rpm", type=int, default=300, help="Requests per minute of the fake endpoint"
+    )
+    parser.add_argument(
+        "--headroom",
+        type=float,
+        default=0.8,
+        help="Share of the RPM the limiter refills, half of the rest is its burst",
+    )
+    parser.add_argument("--latency-scale", type=float, default=0.01)
+    parser.add_argument(
+        "--no-limiter", action="store_true", help="Send the requests right away"
+    )
+    parser.add_argument(
+        "--retries", type=int, default=6, help="Retries of a rate limited state"
+    )
+    parser.add_argument(
+        "--upload-retries",
+        type=int,
+        default=8,
+        help="Uploads of a file answered with 429, UPLOAD_MAX_RETRIES of the frontend",
+    )
+    args = parser.parse_args()
+
+    # The limiter reads its configuration at import time, in real seconds
+    scale = args.latency_scale
+    if not args.no_limiter:
+        os.environ["OPENAI_RATE_LIMIT_RPM"] = str(int(args.rpm * args.headroom / scale))
+        os.environ["OPENAI_RATE_LIMIT_BURST"] = str(
+            max(1, int(args.rpm * (1 - args.headroom) / 2))
+        )
+        os.environ["RATE_LIMIT_MAX_WAIT_SECONDS"] = str(10 * scale)
+    # The OpenAI uploads of initialUpload end by the request deadline. The CPU
+    # time of hundreds of handlers at once isn't scaled, it gets CPU_SECONDS on top
+    os.environ["OPENAI_UPLOAD_DEADLINE_SECONDS"] = str(25 * scale + CPU_SECONDS)
+    os.environ["EXTRACTION_MODE"] = "assistant"
+    os.environ["CORRECTION_SKIP_THRESHOLD"] = "1.1"  # Every upload is corrected
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+
+    cloud = fakes.FakeCloud(latency_scale=scale, openai_rpm=args.rpm)
+    cloud.install()
+    from cvision_runtime import rate_limit
+    from cvision_runtime import uploads as cv_uploads
+
+    handlers = {
+        name: local_pipeline.load_handler(name) for name in local_pipeline.HANDLERS
+    }
+    pipeline = RateLimitedPipeline(cloud, handlers, args.retries)
+
+    log = io.StringIO()
+    started = time.perf_counter()
+    timings = {}
+    failed_executions = 0
+    with contextlib.redirect_stdout(log), concurrent.futures.ThreadPoolExecutor(
+        max_workers=args.uploads
+    ) as clients_pool, concurrent.futures.ThreadPoolExecutor(
+        max_workers=args.uploads
+    ) as executions:
+        uploaded = [
+            clients_pool.submit(
+                upload, handlers["initialUpload"], index, args.upload_retries, scale
+            )
+            for index in range(args.uploads)
+        ]
+        replays = {}
+        while True:
+            for execution in cloud.stepfunctions.take_started():
+                future = executions.submit(pipeline.replay, execution, timings)
+                replays[future] = execution["input"]
+            if not replays and all(future.done() for future in uploaded):
+                break
+            done, _ = concurrent.futures.wait(
+                replays,
+                timeout=pipeline.poll_interval,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                state_input = replays.pop(future)
+                if future.exception() is not None:
+                    # The Catch of the state machine
+                    failed_executions += 1
+                    cv_uploads.mark_failed(state_input)
+        results = [future.result() for future in uploaded]
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    durations = []
+    for upload_id, _ in results:
+        status = "rejected"
+        if upload_id is not None:
+            item = cloud.table("cv_uploads").get_item(Key={"upload_id": upload_id})
+            status = item.get("Item", {}).get("process_status", "missing")
+            if upload_id in pipeline.finished:
+                durations.append((pipeline.finished[upload_id] - started) / scale)
+        statuses[status] = statuses.get(status, 0) + 1
+    ready = statuses.get("ready_to_retrieve", 0)
+    print(f"{ready} of {args.uploads} uploads ready, statuses {statuses}")
+    print(f"Endpoint: {args.rpm} RPM, {cloud.openai.rejected} requests answered 429")
+    print(f"Peak: {cloud.openai.peak_requests} requests within one simulated minute")
+    print(f"Limiter: {'off' if args.no_limiter else dict(rate_limit.WAIT_COUNTS)}")
+    print(
+        f"initialUpload answered 429 {sum(n for _, n in results)} times, "
+        f"state retries {pipeline.retried}, failed executions {failed_executions}"
+    )
+    if durations:
+        print(
+            f"Upload duration in simulated seconds: p50 {statistics.median(durations):.0f}"
+            f", max {max(durations):.0f}"
+        )
+    print(f"Wall time {elapsed:.1f}s, {elapsed / scale / 60:.1f} simulated minutes")
+    if not args.no_limiter:
+        assert cloud.openai.rejected == 0, "The endpoint answered 429"
+        assert ready == args.uploads, f"Not every upload is ready: {statuses}"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Report p50/p95/p99 durations per pipeline stage and the correction skip rate.
+
+Reads the stage_timings maps and correction_skipped flags of the cv_uploads
+items with a table scan, or the {"metric": "stage_timing", ...} and
+{"metric": "correction_gate", ...} lines of an exported log file (CloudWatch
+exports or the --log output of tools/local_pipeline.py).
+
+    python tools/stage_report.py --table cv_uploads
+    python tools/stage_report.py --log exported.log
+"""
+
+import argparse
+import collections
+import json
+import math
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "layers",
+        "cvision_runtime",
+        "python",
+    ),
+)
+
+from cvision_runtime import stage_timings  # noqa: E402
+
+
+def timings_from_table(table_name):
+    """Yield (upload_id, {stage: window}, correction_skipped) of every item."""
+    import boto3
+
+    table = boto3.resource("dynamodb").Table(table_name)
+    kwargs = {
+        "ProjectionExpression": "upload_id, stage_timings, correction_skipped",
+        "FilterExpression": "attribute_exists(stage_timings)",
+    }
+    while True:
+        response = table.scan(**kwargs)
+        for item in response.get("Items", []):
+            yield item["upload_id"], item["stage_timings"], item.get(
+                "correction_skipped"
+            )
+        if "LastEvaluatedKey" not in response:
+            break
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def timings_from_log(path):
+    """Yield (upload_id, {stage: window}, correction_skipped) from a log file."""
+    uploads = collections.defaultdict(dict)
+    skipped = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            start = line.find('{"metric": ')
+            if start == -1:
+                continue
+            try:
+                metric = json.loads(line[start:])
+            except ValueError:
+                continue
+            if metric["metric"] == "stage_timing":
+                uploads[metric["upload_id"]][metric["stage"]] = metric
+            elif metric["metric"] == "correction_gate":
+                skipped[metric["upload_id"]] = metric["outcome"] == "skipped"
+    for upload_id, stages in uploads.items():
+        yield upload_id, stages, skipped.get(upload_id)
+
+
+def percentile(values, fraction):
+    # Nearest rank percentile of sorted values
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def collect(timings):
+    """Return the durations per stage and the counts of correction_skipped values."""
+    durations = collections.defaultdict(list)
+    gate = collections.Counter()
+    for _, stages, correction_skipped in timings:
+        if correction_skipped is not None:
+            gate[bool(correction_skipped)] += 1
+        if not stages:
+            continue
+        for stage, window in stages.items():
+            durations[stage].append(float(window["duration_ms"]))
+        # Upload to result, the stages of the pipeline don't overlap at the ends
+        durations["end_to_end"].append(
+            float(max(w["ended_at"] for w in stages.values()))
+            - float(min(w["started_at"] for w in stages.values()))
+        )
+    return durations, gate
+
+
+def print_report(durations, gate):
+    order = [s for s in stage_timings.STAGES if s in durations]
+    order += sorted(set(durations) - set(order) - {"end_to_end"})
+    order += ["end_to_end"] if "end_to_end" in durations else []
+    print(f"{'stage':<22}{'n':>6}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+    for stage in order:
+        values = sorted(durations[stage])
+        print(
+            f"{stage:<22}{len(values):>6}"
+            + "".join(f"{percentile(values, q):>11.0f}" for q in (0.5, 0.95, 0.99))
+        )
+    if gate:
+        total = gate[True] + gate[False]
+        print(
+            f"Correction run skipped for {gate[True]} of {total} assistant "
+            f"extractions ({gate[True] / total:.0%})"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--table", help="DynamoDB table to scan")
+    source.add_argument("--log", help="Exported log file with stage_timing lines")
+    args = parser.parse_args()
+
+    if args.table:
+        timings = timings_from_table(args.table)
+    else:
+        timings = timings_from_log(args.log)
+    durations, gate = collect(timings)
+    if not durations:
+        sys.exit("No stage timings found")
+    print_report(durations, gate)
+
+
+if __name__ == "__main__":
+    main()